@@ -0,0 +1,272 @@
+"""benchmark.py
+
+Times the recipe database and the solver on the presets and on synthetic lines
+(see synthetic.py), and reports the results as JSON.
+
+    python benchmark.py --output bench.json
+    python benchmark.py --sizes 10 1000 --shapes loops --baseline bench.json
+"""
+
+import argparse
+import glob
+import json
+import os
+import platform
+import statistics
+import sys
+import threading
+import time
+
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+from numpy.linalg import lstsq
+
+from headless import build_line, default_root, load_line
+from recipes import Recipes
+from throughput import Buffer, Group, Node, Step, make_groups
+from tscca import circuits
+import synthetic
+
+
+Result = Dict[str, Any]
+
+
+def measure(fn: Callable[[], Any], setup: Optional[Callable[[], Any]]=None, repeat=5, budget=2.0) -> List[float]:
+    """Times `repeat` calls of fn, or fewer if they take more than `budget` seconds in total (but at least one)"""
+    samples: List[float] = []
+    start = time.perf_counter()
+
+    while len(samples) < repeat:
+        if setup:
+            setup()
+
+        t = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - t)
+
+        if time.perf_counter() - start > budget:
+            break
+
+    return samples
+
+
+def summarise(samples: List[float]) -> Result:
+    return { "samples": samples
+           , "median": statistics.median(samples)
+           , "min": min(samples) }
+
+
+def run_deep(fn: Callable[[], Any]) -> Any:
+    """Runs fn in a thread with a large stack, the solver and tscca recurse once per step on long lines"""
+    result: List[Any] = []
+    error: List[BaseException] = []
+
+    def target():
+        try:
+            result.append(fn())
+        except BaseException as exc: # pylint: disable=broad-except
+            error.append(exc)
+
+    limit = sys.getrecursionlimit()
+    stack_size = threading.stack_size(1 << 30)
+    sys.setrecursionlimit(10 ** 6)
+
+    try:
+        thread = threading.Thread(target=target)
+        thread.start()
+        thread.join()
+    finally:
+        threading.stack_size(stack_size)
+        sys.setrecursionlimit(limit)
+
+    if error:
+        raise error[0]
+
+    return result[0]
+
+
+def groups_of(models: List[Node]) -> List[Group]:
+    groups = []
+    for model in models:
+        if isinstance(model, Step) and model.group is not None and model.group not in groups:
+            groups.append(model.group)
+
+    return groups
+
+
+def padded_systems(groups: List[Group]) -> List[Tuple[np.ndarray, np.ndarray]]:
+    # the systems as Group.propagate sets them up, fixing the rate of the first variable
+    systems = []
+    for group in groups:
+        rate_flow, _, _ = group.matrix()
+        rate_flow = np.pad(rate_flow, ((0, 1), (0, 0)))
+        flows = np.zeros(rate_flow.shape[0])
+        rate_flow[-1][0] = 1
+        flows[-1] = 1.0
+        systems.append((rate_flow, flows))
+
+    return systems
+
+
+def line_benchmarks(name: str, models: List[Node], root: int, rate=1.0, **kwargs) -> Dict[str, Result]:
+    results = {}
+
+    results[f"{name}/scc"] = summarise(measure(lambda: circuits(models), **kwargs))
+
+    make_groups(circuits(models))
+    groups = groups_of(models)
+
+    if groups:
+        results[f"{name}/matrix"] = summarise(measure(lambda: [group.matrix() for group in groups], **kwargs))
+
+        systems = padded_systems(groups)
+        results[f"{name}/lstsq"] = summarise(measure(lambda: [lstsq(a, b, rcond=None) for a, b in systems], **kwargs))
+
+    step = models[root]
+    assert isinstance(step, Step)
+
+    def propagate():
+        for model in models:
+            if isinstance(model, Step):
+                model.group = None
+
+        make_groups(circuits(models))
+        Buffer.global_reset()
+        step.propagate(rate=rate)
+
+    results[f"{name}/propagate"] = summarise(measure(propagate, **kwargs))
+
+    return results
+
+
+def search_queries(recipes: Recipes, n=20) -> List[Tuple[Optional[str], List[str], List[str]]]:
+    """A fixed sample of searches: by the first input and the first output of some machines, and over all machines"""
+    queries = []
+    for machine in sorted(recipes.recipes_by_machine_by_input)[:n]:
+        by_input = recipes.recipes_by_machine_by_input[machine]
+        by_output = recipes.recipes_by_machine_by_output[machine]
+
+        if by_input:
+            queries.append((machine, [next(iter(by_input))], []))
+        if by_output:
+            queries.append((machine, [], [next(iter(by_output))]))
+
+    for machine, inputs, outputs in queries[:5]:
+        queries.append((None, inputs, outputs))
+
+    return queries
+
+
+def run_searches(recipes: Recipes, queries):
+    for machine, inputs, outputs in queries:
+        if machine is None:
+            recipes.search_machine_recipe(inputs, outputs)
+        else:
+            recipes.search_recipe(machine, inputs, outputs)
+
+
+def recipe_benchmarks(recipes: Recipes, **kwargs) -> Dict[str, Result]:
+    results = {}
+
+    results["recipes/load"] = summarise(measure(recipes.load, **kwargs))
+
+    queries = search_queries(recipes)
+    results["recipes/search"] = summarise(measure(lambda: run_searches(recipes, queries), **kwargs))
+
+    return results
+
+
+def preset_name(path: str) -> str:
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+def run(presets: List[str], shapes: List[str], sizes: List[int], repeat=5, budget=2.0, database=True, log=sys.stderr) -> Dict[str, Result]:
+    kwargs = {"repeat": repeat, "budget": budget}
+    results: Dict[str, Result] = {}
+
+    recipes: Optional[Recipes] = None
+    if database:
+        try:
+            recipes = Recipes()
+        except OSError as exc:
+            print(f"skipping the recipe database and presets: {exc}", file=log)
+
+    if recipes is not None:
+        results.update(recipe_benchmarks(recipes, **kwargs))
+
+        for path in presets:
+            print(f"preset {path}", file=log)
+            canvas = load_line(path)
+            root = default_root(canvas)
+            models = build_line(canvas, recipes)
+            results.update(line_benchmarks(f"preset/{preset_name(path)}", models, root, canvas[root]["rate"], **kwargs))
+
+    for shape in shapes:
+        for size in sizes:
+            print(f"synthetic {shape} {size}", file=log)
+            models, root = synthetic.line(shape, size)
+            results.update(line_benchmarks(f"synthetic/{shape}/{size}", models, root, **kwargs))
+
+    return results
+
+
+def report(results: Dict[str, Result]) -> Dict[str, Any]:
+    return { "meta": { "time": time.time()
+                     , "python": platform.python_version()
+                     , "numpy": np.__version__
+                     , "platform": platform.platform() }
+           , "results": results }
+
+
+def compare(results: Dict[str, Result], baseline: Dict[str, Result]) -> List[Tuple[str, Optional[float], Optional[float]]]:
+    """(name, baseline median, current median) for every benchmark in either"""
+    names = list(baseline) + [name for name in results if name not in baseline]
+
+    return [ (name, baseline[name]["median"] if name in baseline else None, results[name]["median"] if name in results else None)
+             for name in names ]
+
+
+def print_comparison(rows, fp=sys.stdout):
+    def ms(x):
+        return "-" if x is None else f"{1000 * x:.3f}"
+
+    print(f"{'benchmark':<48} {'baseline ms':>12} {'current ms':>12} {'ratio':>7}", file=fp)
+    for name, old, new in rows:
+        ratio = f"{new / old:.2f}" if old and new is not None else "-"
+        print(f"{name:<48} {ms(old):>12} {ms(new):>12} {ratio:>7}", file=fp)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the recipe database and the solver")
+    parser.add_argument("--presets", nargs="*", default=None, help="line files to benchmark (default: presets/*.json)")
+    parser.add_argument("--no-database", action="store_true", help="skip the recipe database and the presets")
+    parser.add_argument("--shapes", nargs="*", default=list(synthetic.SHAPES), choices=synthetic.SHAPES)
+    parser.add_argument("--sizes", nargs="*", type=int, default=list(synthetic.SIZES))
+    parser.add_argument("--repeat", type=int, default=5, help="maximal number of samples per benchmark")
+    parser.add_argument("--budget", type=float, default=2.0, help="stop sampling a benchmark after this many seconds")
+    parser.add_argument("--output", "-o", default=None, help="write the JSON report here (default: stdout)")
+    parser.add_argument("--baseline", default=None, help="a previous JSON report to compare against")
+    args = parser.parse_args(argv)
+
+    presets = sorted(glob.glob(os.path.join("presets", "*.json"))) if args.presets is None else args.presets
+
+    results = run_deep(lambda: run(presets, args.shapes, args.sizes, args.repeat, args.budget, not args.no_database))
+    d = report(results)
+
+    if args.output:
+        with open(args.output, mode="w", encoding="utf-8") as fp:
+            json.dump(d, fp, indent=1)
+    else:
+        json.dump(d, sys.stdout, indent=1)
+        print()
+
+    if args.baseline:
+        with open(args.baseline, mode="r", encoding="utf-8") as fp:
+            baseline = json.load(fp)["results"]
+
+        print_comparison(compare(results, baseline), fp=sys.stderr if args.output is None else sys.stdout)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,344 @@
+"""buses.py
+
+Which steps of the same machine type can share input buses. The circuit of a
+recipe is fixed, so what is left to choose is the grouping. Two steps on one bus
+conflict if the machine of one could run a recipe of its circuit on the items of
+the other: for different circuits that is looked up in the containment index of
+the machine (see confusion.Containment, with the confusion matrix of its circuits
+as a quick test for pairs of circuits that never conflict), and for the same
+circuit it is one recipe needing a subset of the items of the other. Assigning
+buses is then colouring the conflict graph with as few colours as possible:
+DSatur, followed by an exact search for groups of up to EXACT_MAX steps.
+
+    python buses.py presets/PBI.json --machine Assembler
+    python buses.py presets/PBI.json --machine Assembler --check 0,0,1,1
+"""
+
+import argparse
+import sys
+
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Dict, Hashable, List, Optional, Set, Tuple
+
+import confusion
+from confusion import Containment, Signature
+from recipes import Recipes
+
+
+Graph = List[Set[int]]
+
+# largest group that is coloured exactly, and the search steps it may take
+EXACT_MAX = 32
+EXACT_STEPS = 1000000
+
+
+def signature_conflict(a: Tuple[int, Signature], b: Tuple[int, Signature], matrix: Optional[confusion.Matrix], containment: Optional[Containment]) -> bool:
+    """Whether recipes with these (circuit, signature)s conflict, signatures interned into containment.ids;
+    without the containment index only on the same circuit"""
+    (ca, siga), (cb, sigb) = a, b
+
+    if ca == cb:
+        return siga & ~sigb == 0 or sigb & ~siga == 0
+
+    if containment is None:
+        return False
+
+    if matrix is not None and not (matrix.conflict(ca, cb) or matrix.conflict(cb, ca)):
+        # no recipe of either circuit runs on the items of any recipe of the other
+        return False
+
+    return containment.contained(ca, sigb) is not None or containment.contained(cb, siga) is not None
+
+
+def conflict_graph(recipes: List[Dict[str, Any]], matrix: Optional[confusion.Matrix], containment: Containment) -> Graph:
+    """The conflicts between the raw recipes of steps of one machine"""
+    sigs = [confusion.signature(recipe, containment.ids) for recipe in recipes]
+    graph: Graph = [set() for _ in recipes]
+
+    for i, a in enumerate(recipes):
+        for j in range(i + 1, len(recipes)):
+            # the same recipe twice is fine, both machines do the same
+            if a is recipes[j] or a == recipes[j]:
+                continue
+
+            sa, sb = sigs[i], sigs[j]
+
+            # unnamed inputs, nothing sensible to say
+            if sa is None or sb is None or signature_conflict(sa, sb, matrix, containment):
+                graph[i].add(j)
+                graph[j].add(i)
+
+    return graph
+
+
+def dsatur(graph: Graph) -> List[int]:
+    """A colouring of graph, picking the vertex with the most differently coloured neighbours next"""
+    n = len(graph)
+    colours = [-1] * n
+    saturation: List[Set[int]] = [set() for _ in range(n)]
+
+    for _ in range(n):
+        v = max((v for v in range(n) if colours[v] < 0), key=lambda v: (len(saturation[v]), len(graph[v])))
+
+        colour = 0
+        while colour in saturation[v]:
+            colour += 1
+
+        colours[v] = colour
+        for w in graph[v]:
+            saturation[w].add(colour)
+
+    return colours
+
+
+def exact(graph: Graph, best: List[int], steps=EXACT_STEPS) -> Tuple[List[int], bool]:
+    """A colouring with as few colours as possible, starting from best; also whether it is proven optimal"""
+    n = len(graph)
+    order = sorted(range(n), key=lambda v: -len(graph[v]))
+    colours = [-1] * n
+
+    best = list(best)
+    limit = max(best) + 1
+    budget = [steps]
+
+    def search(k: int, used: int) -> bool:
+        nonlocal best, limit
+
+        budget[0] -= 1
+        if budget[0] < 0:
+            return False
+
+        if k == n:
+            best, limit = list(colours), used
+            return True
+
+        v = order[k]
+        taken = {colours[w] for w in graph[v]}
+
+        # a new colour only as the next one, the others are the same up to renaming
+        for colour in range(min(used + 1, limit - 1)):
+            if colour not in taken:
+                colours[v] = colour
+                search(k + 1, max(used, colour + 1))
+                colours[v] = -1
+
+                if budget[0] < 0:
+                    return False
+
+        return True
+
+    proven = search(0, 0) and budget[0] >= 0
+    return best, proven
+
+
+def assign(graph: Graph) -> Tuple[List[int], bool]:
+    """Bus per vertex, and whether the number of buses is known to be the minimum"""
+    colours = dsatur(graph)
+
+    if not graph or len(graph) > EXACT_MAX:
+        return colours, not graph
+
+    return exact(graph, colours)
+
+
+def check(graph: Graph, buses: List[int]) -> List[Tuple[int, int]]:
+    """The pairs of conflicting vertices on the same bus"""
+    return [(i, j) for i in range(len(graph)) for j in graph[i] if i < j and buses[i] == buses[j]]
+
+
+class ConflictIndex:
+    """The conflicts between steps as their recipes are set, for the canvas. Setting a recipe costs a
+    signature and a lookup per other step of the machine, the confusion matrix and the containment index
+    are made once per machine. With background they are made on a worker thread (analysing a machine
+    that is not in the confusion cache reads the whole recipe database), until then only recipes on the
+    same circuit are checked, and poll rechecks the steps of the machines that are done"""
+
+    def __init__(self, recipes: Optional[Recipes]=None, background=False):
+        # for the containment indices, without it only recipes on the same circuit are checked
+        self.recipes = recipes
+        # per machine, shared by the signatures of its steps and its containment index
+        self.ids: Dict[str, Dict[str, int]] = {}
+        self.matrices: Dict[str, Optional[confusion.Matrix]] = {}
+        self.containment: Dict[str, Optional[Containment]] = {}
+
+        self.loader = ThreadPoolExecutor(max_workers=1) if background else None
+        # machine -> its matrix and containment index being made
+        self.loading: Dict[str, "Future[Tuple[Optional[confusion.Matrix], Optional[Containment]]]"] = {}
+
+        # step -> machine, raw recipe, (circuit, signature)
+        self.steps: Dict[Hashable, Tuple[str, Dict[str, Any], Optional[Tuple[int, Signature]]]] = {}
+        self.by_machine: Dict[str, Set[Hashable]] = {}
+        self.edges: Dict[Hashable, Set[Hashable]] = {}
+
+    def make(self, machine: str) -> Tuple[Optional[confusion.Matrix], Optional[Containment]]:
+        """The matrix and containment index of machine, the index with ids of its own, so this can run on any thread"""
+        try:
+            matrix = confusion.load(machine, recipes=self.recipes)
+        except (OSError, KeyError) as exc:
+            print(f"Warning: no circuit confusion for {machine} ({exc})")
+            matrix = None
+
+        containment = None
+        if self.recipes is not None:
+            try:
+                containment = Containment(self.recipes.recipes_by_machine[machine])
+            except (OSError, KeyError) as exc:
+                print(f"Warning: no recipes for {machine} ({exc}), only checking recipes on the same circuit")
+
+        return matrix, containment
+
+    def ready(self, machine: str) -> bool:
+        """Whether the matrix and the containment index of machine are there, if not they are started on"""
+        if machine in self.matrices:
+            return True
+
+        if self.loader is None:
+            self.adopt(machine, *self.make(machine))
+            return True
+
+        if machine not in self.loading:
+            self.loading[machine] = self.loader.submit(self.make, machine)
+
+        return False
+
+    def adopt(self, machine: str, matrix: Optional[confusion.Matrix], containment: Optional[Containment]):
+        self.matrices[machine] = matrix
+        self.containment[machine] = containment
+
+        if containment is not None:
+            # the signatures of the steps are redone in these ids, see poll
+            self.ids[machine] = containment.ids
+
+    def poll(self) -> Set[Hashable]:
+        """Takes in the machines made in the background since the last poll, returns the steps whose conflicts changed"""
+        changed: Set[Hashable] = set()
+
+        for machine, future in list(self.loading.items()):
+            if future.done():
+                del self.loading[machine]
+                self.adopt(machine, *future.result())
+                changed |= self.recheck(machine)
+
+        return changed
+
+    def recheck(self, machine: str) -> Set[Hashable]:
+        steps = [(step, self.steps[step][1]) for step in self.by_machine.get(machine, ())]
+        changed: Set[Hashable] = set()
+
+        for step, _ in steps:
+            changed |= self.remove(step)
+
+        for step, recipe in steps:
+            changed |= self.set(step, machine, recipe)
+
+        return changed
+
+    def close(self):
+        if self.loader is not None:
+            self.loader.shutdown(wait=False, cancel_futures=True)
+
+    def set(self, step: Hashable, machine: str, recipe: Dict[str, Any]) -> Set[Hashable]:
+        """Sets the recipe of step, returns the steps whose conflicts changed"""
+        changed = self.remove(step)
+
+        self.ready(machine)
+        matrix = self.matrices.get(machine)
+        containment = self.containment.get(machine)
+
+        sig = confusion.signature(recipe, self.ids.setdefault(machine, {}))
+        self.steps[step] = (machine, recipe, sig)
+
+        edges = self.edges[step] = set()
+        for other in self.by_machine.setdefault(machine, set()):
+            _, other_recipe, other_sig = self.steps[other]
+
+            if other_recipe is recipe:
+                continue
+
+            if sig is None or other_sig is None or signature_conflict(sig, other_sig, matrix, containment):
+                edges.add(other)
+                self.edges[other].add(step)
+                changed.add(other)
+
+        self.by_machine[machine].add(step)
+
+        if edges:
+            changed.add(step)
+
+        return changed
+
+    def remove(self, step: Hashable) -> Set[Hashable]:
+        """Forgets step, returns the steps whose conflicts changed"""
+        if step not in self.steps:
+            return set()
+
+        machine, _, _ = self.steps.pop(step)
+        self.by_machine[machine].discard(step)
+
+        changed = self.edges.pop(step)
+        for other in changed:
+            self.edges[other].discard(step)
+
+        changed.add(step)
+        return changed
+
+    def conflicts_of(self, step: Hashable) -> Set[Hashable]:
+        return self.edges.get(step, set())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Group steps of a line onto shared input buses without circuit confusion")
+    parser.add_argument("file", help="line file")
+    parser.add_argument("--machine", default=None, help="only this machine type (default: every machine type in the line)")
+    parser.add_argument("--check", default=None, help="comma separated bus per step of --machine, in line order, to check instead of solving")
+    args = parser.parse_args(argv)
+
+    if args.check is not None and args.machine is None:
+        parser.error("--check needs --machine")
+
+    from headless import load_line
+
+    canvas = load_line(args.file)
+    recipes = Recipes()
+
+    by_machine: Dict[str, List[int]] = {}
+    for i, d_node in enumerate(canvas):
+        if d_node["type"] == "step" and d_node["recipe"] is not None:
+            by_machine.setdefault(d_node["machine"], []).append(i)
+
+    if args.machine is not None:
+        by_machine = {args.machine: by_machine.get(args.machine, [])}
+
+    matrices = confusion.load_all(sorted(by_machine), recipes=recipes)
+
+    failed = False
+    for machine, indices in sorted(by_machine.items()):
+        raw = [recipes.recipe_by_id(machine, canvas[i]["recipe"]).raw for i in indices]
+        graph = conflict_graph(raw, matrices[machine], Containment(recipes.recipes_by_machine[machine]))
+
+        if args.check is not None:
+            buses = [int(bus) for bus in args.check.split(",")]
+            if len(buses) != len(indices):
+                parser.error(f"--check has {len(buses)} buses for {len(indices)} {machine} steps")
+
+            bad = check(graph, buses)
+            failed |= bool(bad)
+
+            print(f"{machine}: {'ok' if not bad else f'{len(bad)} conflicts'}")
+            for i, j in bad:
+                print(f"  steps {indices[i]} and {indices[j]} on bus {buses[i]}")
+            continue
+
+        buses, optimal = assign(graph)
+        count = max(buses) + 1 if buses else 0
+
+        print(f"{machine}: {count} buses{'' if optimal else ' (maybe not the fewest)'}")
+        for bus in range(count):
+            print(f"  bus {bus}: steps {', '.join(str(indices[i]) for i, b in enumerate(buses) if b == bus)}")
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""cache.py
+
+The on-disk caches (recipes.pickle, items.pickle, confusion.pickle) share one
+layout: a magic number, the length of a JSON header, the header, and a pickled
+payload. The header holds the schema name and version, the hash of the source the
+cache was built from, the build time, and the size and CRC32 of the payload.
+
+A cache that is missing, from another schema version, built from another source,
+truncated or corrupt is rebuilt once, with a message saying why:
+
+    recipes = cache.load("recipes.pickle", "recipes", 1, cache.digest("recipes.json"), build)
+"""
+
+import hashlib
+import json
+import os
+import pickle
+import struct
+import time
+import zlib
+
+from typing import Any, Callable, Dict, Optional, Tuple, TypeVar
+
+
+MAGIC = b"PLCACHE\x00"
+LENGTH = struct.Struct(">I")
+
+T = TypeVar("T")
+Header = Dict[str, Any]
+
+
+class CacheError(ValueError):
+    """A cache file that cannot be used, the message says why"""
+
+
+def digest(path: str) -> str:
+    """Hash of the contents of a source file, so copies and checkouts of the same file match"""
+    h = hashlib.sha256()
+    with open(path, mode="rb") as fp:
+        for chunk in iter(lambda: fp.read(1 << 20), b""):
+            h.update(chunk)
+
+    return h.hexdigest()
+
+
+def read_header(path: str) -> Header:
+    """The header of the cache at path; raises OSError if it cannot be opened and CacheError if it is not a cache"""
+    with open(path, mode="rb") as fp:
+        return _read_header(fp)
+
+
+def _read_header(fp) -> Header:
+    if fp.read(len(MAGIC)) != MAGIC:
+        raise CacheError("not a cache file, probably from an older version")
+
+    try:
+        (length,) = LENGTH.unpack(fp.read(LENGTH.size))
+        return json.loads(fp.read(length))
+    except (struct.error, ValueError) as exc:
+        raise CacheError(f"damaged header ({exc})") from exc
+
+
+def read(path: str, schema: str, version: int, source: Optional[str]=None) -> Any:
+    """The payload of the cache at path, checked against the schema, its version and (unless None) the source"""
+    return read_with_header(path, schema, version, source)[1]
+
+
+def read_with_header(path: str, schema: str, version: int, source: Optional[str]=None) -> Tuple[Header, Any]:
+    """As read, with the header"""
+    with open(path, mode="rb") as fp:
+        header = _read_header(fp)
+
+        if header.get("schema") != schema or header.get("version") != version:
+            raise CacheError(f"{header.get('schema')} version {header.get('version')}, expected {schema} version {version}")
+
+        if source is not None and header.get("source") != source:
+            raise CacheError("built from another version of the source")
+
+        payload = fp.read()
+
+    if len(payload) != header.get("size") or zlib.crc32(payload) != header.get("crc32"):
+        raise CacheError("payload is truncated or corrupt")
+
+    try:
+        return header, pickle.loads(payload)
+    except (pickle.UnpicklingError, EOFError, AttributeError, ImportError) as exc:
+        raise CacheError(f"payload cannot be unpickled ({exc})") from exc
+
+
+def write(path: str, obj: Any, schema: str, version: int, source: Optional[str]):
+    """Writes obj to a cache at path, atomically"""
+    payload = pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
+    header = json.dumps({ "schema": schema, "version": version, "source": source
+                        , "built": time.time(), "size": len(payload), "crc32": zlib.crc32(payload) }).encode("utf-8")
+
+    tmp = path + ".tmp"
+    with open(tmp, mode="wb") as fp:
+        fp.write(MAGIC)
+        fp.write(LENGTH.pack(len(header)))
+        fp.write(header)
+        fp.write(payload)
+
+    os.replace(tmp, path)
+
+
+def load(path: str, schema: str, version: int, source: Optional[str], build: Callable[[], T]) -> T:
+    """The payload of the cache at path, rebuilt with build() (and written back) if it cannot be used.
+    With source None the cache is used whatever it was built from, e.g. when the source is not around"""
+    try:
+        return read(path, schema, version, source)
+    except FileNotFoundError:
+        print(f"Building {path}...")
+    except (OSError, CacheError) as exc:
+        print(f"Rebuilding {path}: {exc}")
+
+    obj = build()
+
+    try:
+        write(path, obj, schema, version, source)
+    except OSError as exc:
+        print(f"Warning: could not write {path}: {exc}")
+
+    return obj
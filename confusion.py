@@ -0,0 +1,305 @@
+"""confusion.py
+
+Which programmed circuit configurations can share the inputs of a machine.
+Circuit c1 is confused with c2 if the items of some c2 recipe are all among the
+items of a c1 recipe: a machine set to c2 on a bus carrying the c1 ingredients
+could then run the wrong recipe.
+
+Every recipe is reduced to a signature, an int with one bit per (interned) input
+item, so containment is `a & ~b == 0`. Only the recipes sharing the rarest item
+of a signature are tested against it. The results, a Matrix per machine, are
+cached in confusion.pickle (see cache.py), stamped with the recipe database they
+were built from, and rebuilt when the database changes.
+
+    confusion.load("Assembler").conflict(c1, c2)  # the items of a c2 recipe, or False
+    confusion.load_all(jobs=8)                    # every machine, over a process pool
+"""
+
+import os
+
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple, Union
+
+import cache
+from recipes import Recipes, database_digest
+
+
+CACHE_FN = "confusion.pickle"
+# bump when Matrix changes
+CACHE_VERSION = 2
+
+Signature = int
+# circuit -> circuit -> the items of a recipe of the second that the first can run, or False
+Confusion = Dict[int, Dict[int, Union[Tuple[str, ...], bool]]]
+
+CIRCUIT = "gt.integrated_circuit"
+# the witness of a recipe that needs nothing but its circuit, an empty one would read as no conflict
+ANYTHING = ("(nothing but the circuit)",)
+# selectors of other recipe maps, their configuration cannot be read from the recipe
+SELECTORS = {"item.BioRecipeSelector": 100, "item.T3RecipeSelector": 200}
+
+
+def bits(signature: Signature) -> List[int]:
+    found = []
+    while signature:
+        low = signature & -signature
+        found.append(low.bit_length() - 1)
+        signature ^= low
+
+    return found
+
+
+def signature(recipe: Dict[str, Any], ids: Dict[str, int]) -> Optional[Tuple[int, Signature]]:
+    """The circuit and the input signature of a recipe, interning new items into ids, or None if it has unnamed inputs"""
+    circuit = 0
+    sig = 0
+
+    for item in recipe["iI"] + recipe["fI"]:
+        name = item["uN"]
+
+        if not name:
+            return None
+
+        if name == CIRCUIT:
+            circuit = item["cfg"]
+        elif name in SELECTORS:
+            circuit = SELECTORS[name]
+        else:
+            sig |= 1 << ids.setdefault(name, len(ids))
+
+    return circuit, sig
+
+
+def signatures(recipes: Iterable[Any], ids: Optional[Dict[str, int]]=None) -> Tuple[Dict[int, Set[Signature]], List[str]]:
+    """The distinct input signatures per circuit, and the item name of every bit"""
+    ids = {} if ids is None else ids
+    by_circuit: Dict[int, Set[Signature]] = {}
+
+    for recipe in recipes:
+        result = signature(recipe.unwrap() if hasattr(recipe, "unwrap") else recipe, ids)
+
+        if result is not None:
+            circuit, sig = result
+            by_circuit.setdefault(circuit, set()).add(sig)
+
+    names = [""] * len(ids)
+    for name, i in ids.items():
+        names[i] = name
+
+    return by_circuit, names
+
+
+def analyse(recipes: Iterable[Any]) -> Confusion:
+    """The confusion between the circuits of one machine, given its recipes"""
+    by_circuit, names = signatures(recipes)
+
+    # bit -> the recipes using that item
+    postings: Dict[int, List[Tuple[int, Signature]]] = {}
+    everything: List[Tuple[int, Signature]] = []
+    for c1, sigs in by_circuit.items():
+        for sig in sigs:
+            everything.append((c1, sig))
+            for bit in bits(sig):
+                postings.setdefault(bit, []).append((c1, sig))
+
+    confusion: Confusion = {c1: {c2: False for c2 in by_circuit if c2 != c1} for c1 in by_circuit}
+
+    for c2, sigs in by_circuit.items():
+        # circuits not yet known to be confused with c2
+        open_ = len(by_circuit) - 1
+
+        for sig2 in sorted(sigs, key=lambda s: bin(s).count("1")):
+            if not open_:
+                break
+
+            sig_bits = bits(sig2)
+            candidates = min((postings[bit] for bit in sig_bits), key=len) if sig_bits else everything
+
+            for c1, sig1 in candidates:
+                if c1 != c2 and not confusion[c1][c2] and sig2 & ~sig1 == 0:
+                    confusion[c1][c2] = tuple(sorted(names[bit] for bit in sig_bits)) or ANYTHING
+                    open_ -= 1
+
+    return confusion
+
+
+def circuit_of(recipe: Dict[str, Any]) -> int:
+    """The circuit configuration a (raw) recipe needs, 0 if none"""
+    result = signature(recipe, {})
+    return result[0] if result is not None else 0
+
+
+class Matrix:
+    """The confusion of one machine: bit j of rows[i] is set if circuits[i] is confused with circuits[j]"""
+    __slots__ = ("circuits", "rows", "witnesses")
+
+    def __init__(self, confusion: Confusion):
+        self.circuits: List[int] = sorted(confusion)
+        index = {c: i for i, c in enumerate(self.circuits)}
+
+        self.rows: List[int] = [0] * len(self.circuits)
+        # (c1, c2) -> the items of a c2 recipe that c1 can run
+        self.witnesses: Dict[Tuple[int, int], Tuple[str, ...]] = {}
+
+        for c1, c2s in confusion.items():
+            for c2, overlap in c2s.items():
+                if overlap:
+                    self.rows[index[c1]] |= 1 << index[c2]
+                    self.witnesses[c1, c2] = overlap
+
+    def conflict(self, c1: int, c2: int) -> Union[Tuple[str, ...], bool]:
+        """The items of a c2 recipe that c1 can run, or False"""
+        return self.witnesses.get((c1, c2), False)
+
+    def conflicting(self, circuit: int) -> List[int]:
+        """The circuits that cannot share inputs with circuit, in either direction"""
+        return [c for c in self.circuits if c != circuit and (self.conflict(circuit, c) or self.conflict(c, circuit))]
+
+    def safe_with(self, circuit: int) -> List[int]:
+        conflicting = set(self.conflicting(circuit))
+        return [c for c in self.circuits if c != circuit and c not in conflicting]
+
+    def to_confusion(self) -> Confusion:
+        return {c1: {c2: self.conflict(c1, c2) for c2 in self.circuits if c2 != c1} for c1 in self.circuits}
+
+
+class Containment:
+    """The input signatures of one machine per circuit, keyed on their rarest item, to find a recipe of a
+    circuit that runs on a given set of items by looking only at the recipes keyed on one of those items"""
+
+    def __init__(self, recipes: Iterable[Any], ids: Optional[Dict[str, int]]=None):
+        # the signatures asked about must be interned into the same ids
+        self.ids: Dict[str, int] = {} if ids is None else ids
+        by_circuit, _ = signatures(recipes, self.ids)
+
+        counts: Dict[int, int] = {}
+        for sigs in by_circuit.values():
+            for sig in sigs:
+                for bit in bits(sig):
+                    counts[bit] = 1 + counts.get(bit, 0)
+
+        # circuit -> item -> signatures; circuits with a recipe that needs nothing but the circuit run on anything
+        self.index: Dict[int, Dict[int, List[Signature]]] = {}
+        self.unconditional: Set[int] = set()
+
+        for circuit, sigs in by_circuit.items():
+            keyed = self.index[circuit] = {}
+
+            for sig in sigs:
+                if sig:
+                    keyed.setdefault(min(bits(sig), key=counts.__getitem__), []).append(sig)
+                else:
+                    self.unconditional.add(circuit)
+
+        self.memo: Dict[Tuple[int, Signature], Optional[Signature]] = {}
+
+    def contained(self, circuit: int, items: Signature) -> Optional[Signature]:
+        """The signature of a recipe on circuit whose inputs are all among items, or None"""
+        key = circuit, items
+
+        if key not in self.memo:
+            self.memo[key] = self._contained(circuit, items)
+
+        return self.memo[key]
+
+    def _contained(self, circuit: int, items: Signature) -> Optional[Signature]:
+        if circuit in self.unconditional:
+            return 0
+
+        keyed = self.index.get(circuit, {})
+        for bit in bits(items):
+            for sig in keyed.get(bit, ()):
+                if sig & ~items == 0:
+                    return sig
+
+        return None
+
+
+def symmetric(confusion: Confusion) -> Confusion:
+    """Confusion in either direction, so c1 and c2 are safe together iff both are False"""
+    both = {c1: dict(c2s) for c1, c2s in confusion.items()}
+
+    for c1, c2s in confusion.items():
+        for c2, overlap in c2s.items():
+            if overlap:
+                both.setdefault(c2, {})[c1] = overlap
+
+    return both
+
+
+def read_cache(path=CACHE_FN) -> Tuple[Optional[str], Dict[str, Matrix]]:
+    """The recipe database the cache was built from, and its matrices"""
+    try:
+        header, payload = cache.read_with_header(path, "confusion", CACHE_VERSION)
+    except FileNotFoundError:
+        return None, {}
+    except (OSError, cache.CacheError) as exc:
+        print(f"Rebuilding {path}: {exc}")
+        return None, {}
+
+    return header["source"], payload["machines"]
+
+
+_recipes: Optional[Recipes] = None
+
+
+def _init_worker():
+    global _recipes
+    _recipes = Recipes()
+
+
+def _analyse_machine(machine: str, recipes: Optional[Recipes]=None) -> Tuple[str, Matrix]:
+    recipes = _recipes if recipes is None else recipes
+    assert recipes is not None
+    return machine, Matrix(analyse(recipes.recipes_by_machine[machine]))
+
+
+def load_all(machines: Optional[List[str]]=None, path=CACHE_FN, rebuild=False, jobs: Optional[int]=None, recipes: Optional[Recipes]=None) -> Dict[str, Matrix]:
+    """The Matrix of every machine (or of machines), analysing the ones missing from the cache over a process pool.
+    Analyses in this process use recipes if given (e.g. the GUI's), only the pool workers load a database of their own"""
+    source, cached = read_cache(path)
+
+    try:
+        digest = database_digest()
+    except FileNotFoundError:
+        if machines is None or any(machine not in cached for machine in machines):
+            raise
+
+        print(f"Warning: no recipe database to check {path} against, it may be stale")
+        return {machine: cached[machine] for machine in machines}
+
+    if cached and source != digest and not rebuild:
+        print(f"Rebuilding {path}: built from another version of the recipe database")
+
+    known = cached if source == digest and not rebuild else {}
+
+    if machines is None:
+        if recipes is None:
+            _init_worker()
+            recipes = _recipes
+        assert recipes is not None
+        machines = [machine for machine in recipes.recipes_by_machine if machine != "None"]
+
+    todo = [machine for machine in machines if machine not in known]
+
+    if todo:
+        jobs = min(jobs or os.cpu_count() or 1, len(todo))
+
+        if jobs <= 1:
+            if recipes is None:
+                _init_worker()
+                recipes = _recipes
+            known.update(_analyse_machine(machine, recipes) for machine in todo)
+        else:
+            from multiprocessing import Pool
+
+            with Pool(jobs, initializer=_init_worker) as pool:
+                known.update(pool.imap_unordered(_analyse_machine, todo))
+
+        cache.write(path, {"machines": known}, "confusion", CACHE_VERSION, digest)
+
+    return {machine: known[machine] for machine in machines}
+
+
+def load(machine="Assembler", path=CACHE_FN, rebuild=False, recipes: Optional[Recipes]=None) -> Matrix:
+    """The Matrix of machine, from the cache if it is as new as the recipe database, else analysed with recipes"""
+    return load_all([machine], path, rebuild, jobs=1, recipes=recipes)[machine]
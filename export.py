@@ -0,0 +1,169 @@
+"""export.py
+
+Exports the results of a solve as tables, for spreadsheets and dashboards:
+
+    steps     one row per step: rate, machines, EU/t, voltage tier and loop group
+    buffers   one row per buffer and item: the flow through that buffer
+    flows     one row per item: the net flow of the whole line
+    machines  one row per machine type: the number of steps and their EU/t
+
+The rows are generated lazily and written as they come, to CSV, JSON lines, or
+Parquet (if pyarrow is installed, in batches of BATCH rows). Every table goes
+to its own file, <prefix>.<table>.<format>. Of the nodes only the machine and the
+recipe of the steps are used, so headless.py passes the slim nodes it keeps while
+reading a line (see headless.build_line) rather than the whole canvas.
+
+    export.export("out/pbi", "csv", canvas, models, Buffer.global_flow, recipes.item_name)
+"""
+
+import csv
+import json
+import math
+
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
+
+from headless import step_power
+from throughput import TIERS, Buffer, Node, Step, powerTier
+
+
+Row = Dict[str, Any]
+
+FORMATS = ("csv", "jsonl", "parquet")
+TABLES = ("steps", "buffers", "flows", "machines")
+# rows per Parquet row group
+BATCH = 10000
+
+
+def group_ids(models: Iterable[Node]) -> Callable[[Node], Optional[int]]:
+    """Numbers the loop groups in order of appearance"""
+    ids: Dict[int, int] = {}
+
+    def group_id(model: Node) -> Optional[int]:
+        group = getattr(model, "group", None)
+        return ids.setdefault(id(group), len(ids)) if group is not None else None
+
+    return group_id
+
+
+def step_rows(canvas: List[Dict[str, Any]], models: List[Node]) -> Iterator[Row]:
+    group_id = group_ids(models)
+
+    for i, (d_node, model) in enumerate(zip(canvas, models)):
+        if isinstance(model, Step):
+            eut, _ = step_power(model)
+            _, tier = powerTier(eut)
+
+            yield { "node": i
+                  , "machine": d_node["machine"]
+                  , "recipe": d_node["recipe"]
+                  , "rate": model.rate
+                  , "machines": math.ceil(model.rate - 1e-9)
+                  , "eut": eut
+                  , "tier": TIERS[tier]
+                  , "group": group_id(model) }
+
+
+def buffer_rows(models: List[Node], item_name: Callable[[str], str]) -> Iterator[Row]:
+    for i, model in enumerate(models):
+        if isinstance(model, Buffer):
+            for item, flow in model.flow.items():
+                yield {"node": i, "item": item, "name": item_name(item), "flow": flow}
+
+
+def flow_rows(global_flow: Dict[str, float], item_name: Callable[[str], str]) -> Iterator[Row]:
+    for flow, item in sorted((flow, item) for item, flow in global_flow.items()):
+        yield {"item": item, "name": item_name(item), "flow": flow}
+
+
+def machine_rows(canvas: List[Dict[str, Any]], models: List[Node]) -> Iterator[Row]:
+    # one row per machine type, so small enough to add up first
+    machines: Dict[str, Row] = {}
+
+    for d_node, model in zip(canvas, models):
+        if isinstance(model, Step):
+            eut, _ = step_power(model)
+            row = machines.setdefault(d_node["machine"], {"machine": d_node["machine"], "steps": 0, "machines": 0, "eut": 0.0})
+            row["steps"] += 1
+            row["machines"] += math.ceil(model.rate - 1e-9)
+            row["eut"] += eut
+
+    yield from machines.values()
+
+
+def tables(canvas: List[Dict[str, Any]], models: List[Node], global_flow: Dict[str, float], item_name: Callable[[str], str]) -> Dict[str, Iterator[Row]]:
+    return { "steps": step_rows(canvas, models)
+           , "buffers": buffer_rows(models, item_name)
+           , "flows": flow_rows(global_flow, item_name)
+           , "machines": machine_rows(canvas, models) }
+
+
+def write_csv(path: str, rows: Iterator[Row]) -> int:
+    n = 0
+    with open(path, mode="w", encoding="utf-8", newline="") as fp:
+        writer = None
+
+        for row in rows:
+            if writer is None:
+                writer = csv.DictWriter(fp, fieldnames=list(row))
+                writer.writeheader()
+
+            writer.writerow(row)
+            n += 1
+
+    return n
+
+
+def write_jsonl(path: str, rows: Iterator[Row]) -> int:
+    n = 0
+    with open(path, mode="w", encoding="utf-8") as fp:
+        for row in rows:
+            fp.write(json.dumps(row) + "\n")
+            n += 1
+
+    return n
+
+
+def write_parquet(path: str, rows: Iterator[Row]) -> int:
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError as exc:
+        raise RuntimeError("Parquet export needs pyarrow (pip install pyarrow)") from exc
+
+    n = 0
+    writer = None
+    batch: List[Row] = []
+
+    def flush():
+        nonlocal writer
+
+        table = pyarrow.Table.from_pylist(batch, schema=writer.schema if writer is not None else None)
+        if writer is None:
+            writer = pyarrow.parquet.ParquetWriter(path, table.schema)
+
+        writer.write_table(table)
+        batch.clear()
+
+    for row in rows:
+        batch.append(row)
+        n += 1
+
+        if len(batch) >= BATCH:
+            flush()
+
+    if batch or writer is None:
+        flush()
+
+    writer.close()
+    return n
+
+
+WRITERS = {"csv": write_csv, "jsonl": write_jsonl, "parquet": write_parquet}
+
+
+def export(prefix: str, fmt: str, canvas: List[Dict[str, Any]], models: List[Node], global_flow: Dict[str, float], item_name: Callable[[str], str]) -> Dict[str, int]:
+    """Writes every table to <prefix>.<table>.<fmt>, returns the number of rows per table"""
+    if fmt not in WRITERS:
+        raise ValueError(f"Unknown export format {fmt}, use one of {', '.join(FORMATS)}")
+
+    return {name: WRITERS[fmt](f"{prefix}.{name}.{fmt}", rows) for name, rows in tables(canvas, models, global_flow, item_name).items()}
@@ -1,20 +1,36 @@
 from abc import ABC, abstractmethod
 import colorsys
-import math
 import tkinter as tk
 import time
 import json
+import logging
+import os
+import threading
 
-from typing import Any, Dict, List, Optional, Union, Tuple
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Union, Tuple
 from enum import IntFlag, auto
 
-from ttkwidgets.autocomplete import AutocompleteEntry
+import tkinter.filedialog
 import tkinter.simpledialog
 
+import journal
+import lineformat
+from latency import LatencyMonitor
+import undo
 from recipes import Recipes
-from throughput import Buffer, Recipe, Step, make_groups
-from tscca import circuits
+from buses import ConflictIndex
+from spatial import Grid, Rect
+from throughput import TIERS, Buffer, Recipe, Step, make_groups, powerTier
+import instrumentation
+
+# ttkwidgets, the solver stack (numpy, tscca, headless) and the recipe database are
+# only loaded on first use, see startup.py
+
 
+logger = logging.getLogger(__name__)
 
 SAVE_FN = "procline.json"
 MOUSE_EVENTS = ["<Button-1>", "<B1-Motion>", "<ButtonRelease-1>", "<Button-2>", "<B2-Motion>", "<ButtonRelease-2>", "<Button-3>", "<B3-Motion>", "<ButtonRelease-3>", "<MouseWheel>"]
@@ -104,7 +120,13 @@ class GestureManager():
             pos = Vec2(e.delta, 0)
 
 
-        self.canvas.gesture(pos, posi, mod, source)
+        monitor = self.canvas.latency
+        if monitor is None:
+            self.canvas.gesture(pos, posi, mod, source)
+        else:
+            name = "|".join(flag.name for flag in Gesture if flag in mod and flag.name)
+            with monitor.timer("gesture", name, monitor.queue_delay(e.time)):
+                self.canvas.gesture(pos, posi, mod, source)
 
 
 class CanvasMenu(tk.Menu):
@@ -113,8 +135,9 @@ class CanvasMenu(tk.Menu):
 
         self.coords = vzero
 
-        self.add_command(label="New node", command=lambda: master.new_node(self.coords))
-        self.add_command(label="New buffer", command=lambda: master.new_buffer(self.coords))
+        self.add_command(label="New node", command=lambda: master.run_command("new_node", pos=self.coords.encode()))
+        self.add_command(label="New buffer", command=lambda: master.run_command("new_buffer", pos=self.coords.encode()))
+        self.add_command(label="Insert preset...", command=lambda: PresetBrowser(master, self.coords))
 
 
 class NodeMenu(tk.Menu):
@@ -123,8 +146,32 @@ class NodeMenu(tk.Menu):
         self.master: NodeCanvas
 
         self.node: Optional["StepFrame"] = None
-        self.add_command(label="Propagate from here", command=lambda: self.master.propagate_flow(self.node))
+        self.add_command(label="Propagate from here", command=lambda: self.master.run_command("propagate", node=self.master.nodes.index(self.node)))
         self.add_command(label="Delete", command=lambda: (self.node.delete() if self.node is not None else None))
+        self.add_command(label="Circuit conflicts...", command=self.show_confusion)
+
+    def show_confusion(self):
+        """Lists the circuits that cannot share input buses with the circuit of this node's recipe"""
+        import confusion
+
+        if self.node is None or self.node.recipe is None:
+            logger.warning("Set a recipe first")
+            return
+
+        machine = self.node.machine.get()
+        circuit = confusion.circuit_of(self.node.recipe.raw)
+        # analyses the machine with the loaded database if the cache has not got it yet
+        matrix = confusion.load(machine, recipes=self.node.globalstate)
+
+        window = tk.Toplevel(self.master)
+        window.title(f"Circuit conflicts: {machine}, circuit {circuit}")
+
+        text = tk.Text(window, font=("Consolas", 9), wrap="none", width=100, height=30)
+        for c in matrix.conflicting(circuit):
+            text.insert("end", f"{c:>4}  {', '.join(matrix.conflict(circuit, c) or matrix.conflict(c, circuit))}\n")
+        text.insert("end", f"\nSafe with: {' '.join(map(str, matrix.safe_with(circuit)))}\n")
+        text.configure(state="disabled")
+        text.pack(expand=1, fill="both")
 
 
 class NodeToolbar(tk.Menu):
@@ -134,10 +181,110 @@ class NodeToolbar(tk.Menu):
 
         self.master.root.config(menu=self)
 
+        file_menu = tk.Menu(self)
+        self.add_cascade(label="File", menu=file_menu)
+        file_menu.add_command(label="Save as...", command=self.save_as)
+        file_menu.add_command(label="Export results...", command=self.export_results)
+
         calc_menu = tk.Menu(self)
         self.add_cascade(label="Calculate", menu=calc_menu)
         calc_menu.add_command(label="Find connected components", command=self.master.run_sccs)
         calc_menu.add_command(label="Force graph reconstruction", command=self.master.reconstruct)
+        calc_menu.add_command(label="Auto-connect all", command=lambda: self.master.run_command("auto_connect_all"))
+        calc_menu.add_separator()
+
+        self.log_timings = tk.BooleanVar(value=False)
+        calc_menu.add_checkbutton(label="Log solver timings", variable=self.log_timings, command=self.toggle_instrumentation)
+
+        edit_menu = tk.Menu(self)
+        self.add_cascade(label="Edit", menu=edit_menu)
+        edit_menu.add_command(label="Undo", accelerator="Ctrl+Z", command=lambda: self.master.run_command("undo"))
+        edit_menu.add_command(label="Redo", accelerator="Ctrl+Y", command=lambda: self.master.run_command("redo"))
+
+        debug_menu = tk.Menu(self)
+        self.add_cascade(label="Debug", menu=debug_menu)
+        debug_menu.add_command(label="Memory report", command=self.memory_report)
+        debug_menu.add_separator()
+
+        self.show_latency = tk.BooleanVar(value=False)
+        debug_menu.add_checkbutton(label="Gesture latency overlay", variable=self.show_latency, command=lambda: self.master.set_latency(self.show_latency.get()))
+        debug_menu.add_command(label="Save latency trace...", command=self.save_latency_trace)
+
+        self.record_gestures = tk.BooleanVar(value=False)
+        debug_menu.add_checkbutton(label="Record gesture trace", variable=self.record_gestures, command=self.toggle_gesture_trace)
+
+        # shows the progress of a running solve, click to cancel it
+        self.add_command(label="", state="disabled", command=self.master.cancel_solve)
+        self.status_index = self.index("end")
+
+    def set_status(self, text: str):
+        self.entryconfigure(self.status_index, label=text, state="normal" if text else "disabled")
+
+    def save_as(self):
+        path = tkinter.filedialog.asksaveasfilename(defaultextension=".json", filetypes=[("Line file", "*.json"), ("Compressed line file", "*.json.gz")])
+        if path:
+            lineformat.write(path, self.master.encode()["canvas"])
+
+    def export_results(self):
+        import export
+
+        canvas = self.master
+        models = [node.model for node in canvas.nodes]
+        if canvas.global_flow is None or any(model is None for model in models):
+            logger.warning("Propagate first")
+            return
+
+        path = tkinter.filedialog.asksaveasfilename(filetypes=[("CSV", "*.csv"), ("JSON lines", "*.jsonl"), ("Parquet", "*.parquet")])
+        if not path:
+            return
+
+        prefix, ext = os.path.splitext(path)
+        fmt = ext[1:] if ext[1:] in export.FORMATS else "csv"
+
+        try:
+            counts = export.export(prefix, fmt, canvas.encode()["canvas"], models, canvas.global_flow, canvas.globalstate.item_name)
+        except (OSError, RuntimeError) as exc:
+            logger.warning("Export failed: %s", exc)
+            return
+
+        logger.info("Exported %s to %s.*.%s", ", ".join(f"{n} {name}" for name, n in counts.items()), prefix, fmt)
+
+    def memory_report(self):
+        import memreport
+
+        window = tk.Toplevel(self.master)
+        window.title("Memory report")
+
+        text = tk.Text(window, font=("Consolas", 9), wrap="none", width=120, height=30)
+        text.insert("1.0", memreport.format_report(memreport.report(self.master.globalstate)))
+        text.configure(state="disabled")
+        text.pack(expand=1, fill="both")
+
+    def save_latency_trace(self):
+        if self.master.latency is None:
+            logger.warning("Turn on the gesture latency overlay first")
+            return
+
+        path = tkinter.filedialog.asksaveasfilename(defaultextension=".jsonl", filetypes=[("JSON lines", "*.jsonl")])
+        if path:
+            self.master.latency.dump(path)
+
+    def toggle_gesture_trace(self):
+        if self.record_gestures.get():
+            self.master.start_trace()
+            return
+
+        trace = self.master.stop_trace()
+        path = tkinter.filedialog.asksaveasfilename(defaultextension=".json", filetypes=[("Gesture trace", "*.json")])
+        if path:
+            with open(path, mode="w", encoding="utf-8") as fp:
+                json.dump(trace, fp, indent=1)
+
+    def toggle_instrumentation(self):
+        if self.log_timings.get():
+            instrumentation.enable(instrumentation.LoggingSink())
+        else:
+            instrumentation.disable()
 
 
 class Vec2:
@@ -169,7 +316,7 @@ class Vec2:
 
 class State(Recipes):
     def __init__(self, master: "NodeCanvas"):
-        super(State, self).__init__()
+        super(State, self).__init__(lazy=True)
 
         self.master = master
         self.gesture_manager = self.master.gesture_manager
@@ -179,6 +326,12 @@ class State(Recipes):
     def init(self):
         self.center = self.screencenter = self.master.dimensions() / 2
 
+    def to_screen(self, pos: Vec2) -> Vec2:
+        return (pos - self.center) * self.scale + self.screencenter
+
+    def to_model(self, pos: Vec2) -> Vec2:
+        return (pos - self.screencenter) / self.scale + self.center
+
 
 class BetterWidget(tk.Widget):
     def __init__(self, globalstate: State, **kwargs):
@@ -200,18 +353,93 @@ class BetterFrame(tk.Frame):
         super(BetterFrame, self).__init__(**kwargs)
 
 
+class SolveCancelled(Exception):
+    pass
+
+
+class Solve:
+    """A solve of a snapshot of the canvas, run on a worker thread so the canvas stays responsive"""
+    def __init__(self, generation: int, canvas: List[Dict[str, Any]], root: int):
+        self.generation = generation
+        self.canvas = canvas
+        self.root = root
+
+        # read by the Tk thread to show the progress
+        self.phase = "queued"
+        self.cancelled = threading.Event()
+        self.future: Optional[Future] = None
+
+    def check(self, phase: str):
+        # the solver itself can't be interrupted, so a cancel takes effect between phases
+        if self.cancelled.is_set():
+            raise SolveCancelled()
+
+        self.phase = phase
+
+    def run(self, recipes: Recipes):
+        self.check("building")
+        from headless import build_line
+        from tscca import circuits
+
+        models = build_line(self.canvas, recipes)
+
+        self.check("finding loops")
+        with instrumentation.active.timer("gui.sccs"):
+            groups = circuits(models)
+            make_groups(groups)
+
+        step = models[self.root]
+        if not isinstance(step, Step):
+            raise RuntimeError("?")
+
+        self.check("solving")
+        Buffer.global_reset()
+
+        # TODO low: report total failure
+        with instrumentation.active.timer("gui.propagate"):
+            step.propagate(rate=self.canvas[self.root]["rate"])
+
+        instrumentation.active.flush()
+
+        return models, groups, dict(Buffer.global_flow)
+
+
 # TODO low prio: canvas in foreground -> put the nodes in canvas.create_window's
 class NodeCanvas(BetterWidget, tk.Canvas):
-    def __init__(self, master: tk.Tk, **kwargs):
+    # nodes within this many pixels of the edge are kept mapped, anything further out is unmapped
+    VIEW_MARGIN = 100
+    # motion events are coalesced into one redraw per frame
+    FRAME_MS = 16
+    # below this scale nodes are drawn as labelled rectangles instead of widgets
+    LOD_SCALE = 0.4
+    # the widgets are only rescaled once the mouse wheel has been still this long
+    ZOOM_MS = 150
+    # nodes created per event loop iteration while loading
+    LOAD_BATCH = 200
+    # how often the autosave journal is compacted into a snapshot
+    AUTOSAVE_MS = 30000
+
+    def __init__(self, master: tk.Tk, autosave: Optional[str]=SAVE_FN, **kwargs):
         self.gesture_manager = GestureManager(self)
         super(NodeCanvas, self).__init__(globalstate=State(self), master=master, **kwargs)
         self.root = master
 
         self.menubar = NodeToolbar(self)
 
-        self.autosave = SAVE_FN
+        # None to neither load nor autosave, e.g. when replaying traces
+        self.autosave = autosave
         self.nodes: List[NodeFrame] = []
-
+        # bounding boxes in model coordinates, so panning and zooming leave them alone
+        self.node_index = Grid()
+        self.hatch_index = Grid()
+        # the nodes currently mapped
+        self.shown: Set[NodeFrame] = set()
+        # item_id -> hatches with that item, dicts as ordered sets
+        self.inputs_by_item: Dict[str, Dict[Hatch, None]] = {}
+        self.outputs_by_item: Dict[str, Dict[Hatch, None]] = {}
+        # steps on the same machine whose recipes can be confused
+        self.conflicts = ConflictIndex(self.globalstate, background=True)
+        self.conflicts_after = ""
 
         self.selection: List[NodeFrame] = []
         self.hatch: Optional[Hatch] = None
@@ -225,6 +453,40 @@ class NodeCanvas(BetterWidget, tk.Canvas):
         # self.to_move_right: List[Connection] = []
 
         self.selection_rectangle = 0
+        self.view_size = vzero
+
+        self.pending_drag = vzero
+        self.motion_after = ""
+        self.dirty_lines: Set[Connection] = set()
+        self.lines_after = ""
+        self.zoom_after = ""
+
+        # one worker, so solves never share Buffer.global_flow
+        self.solver = ThreadPoolExecutor(max_workers=1)
+        self.solve: Optional[Solve] = None
+        # bumped on every edit of the line, results of older solves are dropped
+        self.generation = 0
+        # net item flows of the last solve, None once the line has changed since
+        self.global_flow: Optional[Dict[str, float]] = None
+
+        # every edit is passed as a record (see apply_record) to these
+        self.listeners: List[Callable[[journal.Record], None]] = []
+        # set while loading or applying records, and inside edits that were recorded as a whole
+        self.replaying = False
+        self.record_depth = 0
+        self.moved: Dict[NodeFrame, Vec2] = {}
+        self.journal: Optional[journal.Journal] = None
+
+        self.history = undo.History(self)
+        self.listeners.append(self.history.append)
+
+        # see set_latency
+        self.latency: Optional[LatencyMonitor] = None
+        self.latency_overlay: Optional[tk.Label] = None
+
+        # gestures and commands since start_trace, see replay.py
+        self.trace: Optional[List[Dict[str, Any]]] = None
+        self.trace_start = 0.0
 
         self.pack(expand=1, fill="both")
         self.configure(background="#DDDDDD")
@@ -236,7 +498,12 @@ class NodeCanvas(BetterWidget, tk.Canvas):
             self.bind(e, lambda e: self.gesture_manager.on_event(e, self))
 
         self.bind("<Delete>", lambda e: self.delete_selection())
-        self.after(500, self.decode)
+        self.root.bind("<Control-z>", lambda e: self.run_command("undo"))
+        self.root.bind("<Control-y>", lambda e: self.run_command("redo"))
+        self.root.bind("<Control-Z>", lambda e: self.run_command("redo"))
+        self.bind("<Configure>", self.on_configure)
+        if self.autosave is not None:
+            self.after(500, self.decode)
 
         self.focus_set()
         self.globalstate.init()
@@ -244,6 +511,8 @@ class NodeCanvas(BetterWidget, tk.Canvas):
         # TODO mid prio: colour groups and group lines
 
     def run_sccs(self):
+        from tscca import circuits
+
         self.reconstruct()
 
         nodes = {node.model : node for node in self.nodes}
@@ -251,6 +520,9 @@ class NodeCanvas(BetterWidget, tk.Canvas):
         groups = circuits(nodes)
         make_groups(groups)
 
+        self.colour_groups(groups, nodes)
+
+    def colour_groups(self, groups, nodes):
         n = len(groups)
 
         for i, group in enumerate(groups):
@@ -266,34 +538,92 @@ class NodeCanvas(BetterWidget, tk.Canvas):
         #     if isinstance(node.model, Step):
         #         print(node, node.model.group, node.model.pull, node.model.push)
 
-    def propagate_flow(self, node: Optional["StepFrame"]):
-        self.run_sccs()
+    def changed(self):
+        """Call on every edit of the line, supersedes a running solve"""
+        self.generation += 1
+        self.global_flow = None
+        self.cancel_solve()
 
-        print("Propagating")
+    def cancel_solve(self):
+        if self.solve is not None:
+            self.solve.cancelled.set()
 
+            if self.solve.future is not None:
+                self.solve.future.cancel()
+
+            self.solve = None
+            self.menubar.set_status("")
+
+    def poll_conflicts(self):
+        # the steps of machines whose conflict data came in are rechecked
+        self.conflicts_after = ""
+
+        for node in self.conflicts.poll():
+            node.update_highlight()
+
+        if self.conflicts.loading:
+            self.conflicts_after = self.after(100, self.poll_conflicts)
+
+    def propagate_flow(self, node: Optional["StepFrame"]):
         if node is None:
             raise RuntimeError("?")
 
-        Buffer.global_reset()
-        for node_ in self.nodes:
-            if isinstance(node_, BufferFrame):
-                if node_.model is None:
-                    raise RuntimeError("Impossible")
+        self.cancel_solve()
 
-                node_.model.reset()
+        solve = Solve(self.generation, self.encode()["canvas"], self.nodes.index(node))
+        solve.future = self.solver.submit(solve.run, self.globalstate)
+        self.solve = solve
 
-        # TODO low: report total failure
-        node.propagate_flow()
+        self.poll_solve(solve)
+
+    def poll_solve(self, solve: Solve):
+        if solve is not self.solve or solve.future is None:
+            # cancelled or superseded
+            return
+
+        if not solve.future.done():
+            self.menubar.set_status(f"Solving: {solve.phase} (click to cancel)")
+            self.after(100, self.poll_solve, solve)
+            return
+
+        self.solve = None
+        self.menubar.set_status("")
+
+        if solve.generation != self.generation:
+            return
+
+        try:
+            models, groups, global_flow = solve.future.result()
+        except SolveCancelled:
+            return
+        except (RuntimeError, KeyError, IndexError, ValueError, RecursionError) as exc:
+            logger.warning("Solve failed: %s", exc)
+            return
+
+        self.apply_solve(models, groups, global_flow)
+
+    def apply_solve(self, models, groups, global_flow):
+        # the models are in the order of self.nodes, nothing changed since the snapshot
+        for node, model in zip(self.nodes, models):
+            node.model = model
+
+        self.global_flow = global_flow
+
+        self.colour_groups(groups, {node.model : node for node in self.nodes})
 
         summary = {}
         eut = 0
         surge_eut = 0
-        for step in self.nodes:
+        rates = []
+        for i, step in enumerate(self.nodes):
             if isinstance(step, StepFrame):
                 if step.model is None:
                     raise RuntimeError("Impossible")
                 else:
-                    step.set_rate(step.model.rate)
+                    # the solver's rates are not edits, they are journaled below as a whole
+                    with self.replay():
+                        step.set_rate(step.model.rate)
+                    rates.append([i, step.model.rate])
                     eut += step.eut
                     surge_eut += step.surge_eut
                     machine = step.machine.get()
@@ -304,23 +634,27 @@ class NodeCanvas(BetterWidget, tk.Canvas):
                 else:
                     step.display_flow()
 
+        if rates and self.journal is not None:
+            # past the undo history, but they must survive a restart
+            self.journal.append({"op": "rates", "rates": rates})
+
         amps, tier = powerTier(eut)
         surge_amps, surge_tier = powerTier(surge_eut)
-        print(f"Power usage: {eut:.1f} ({amps:.1f} {TIERS[tier]})")
-        print(f"Surge usage: {surge_eut:.1f} ({surge_amps:.1f} {TIERS[surge_tier]})")
+        logger.info("Power usage: %.1f (%.1f %s)", eut, amps, TIERS[tier])
+        logger.info("Surge usage: %.1f (%.1f %s)", surge_eut, surge_amps, TIERS[surge_tier])
 
-        flows = [(flow, item) for item, flow in Buffer.global_flow.items()]
+        flows = [(flow, item) for item, flow in global_flow.items()]
         flows.sort()
         
         for flow, item in flows:
             if abs(flow) < 1e-10:
-                print(f"{self.globalstate.item_name(item)}: Neutral?")
+                logger.info("%s: Neutral?", self.globalstate.item_name(item))
             else:
-                print(f"{self.globalstate.item_name(item)}: {flow}")
-        print("Summary:")
+                logger.info("%s: %s", self.globalstate.item_name(item), flow)
+        logger.info("Summary:")
         for machine, num in summary.items():
-            print(f"{num:>3}x {machine}")
-        print()
+            logger.info("%3dx %s", num, machine)
+        logger.info("")
 
     def reconstruct(self):
         for node in self.nodes:
@@ -351,28 +685,285 @@ class NodeCanvas(BetterWidget, tk.Canvas):
     def decode(self, _=None):
         self.unbind("<Visibility>")
 
+        snapshot, records = journal.read(self.autosave)
+        seq = records[-1]["seq"] if records else snapshot.get("seq", 0) if snapshot else 0
+
+        def replay():
+            if records:
+                logger.info("Replaying %d unsaved edits", len(records))
+
+            for record in records:
+                try:
+                    self.apply_record(record)
+                except (KeyError, IndexError, ValueError, RuntimeError) as exc:
+                    logger.warning("Could not replay %s: %s", record, exc)
+                    break
+
+            self.journal = journal.Journal(self.autosave, seq)
+            self.listeners.append(self.journal.append)
+
+            if records:
+                self.journal.snapshot(self.encode())
+
+            self.after(self.AUTOSAVE_MS, self.autosave_tick)
+
+        self.load(snapshot["canvas"] if snapshot else [], replay)
+
+    def autosave_tick(self):
+        if self.journal is not None and self.journal.since_snapshot:
+            self.journal.snapshot(self.encode())
+
+        self.after(self.AUTOSAVE_MS, self.autosave_tick)
+
+    @property
+    def recording(self) -> bool:
+        return bool(self.listeners) and not self.replaying and not self.record_depth
+
+    def record(self, record: journal.Record):
+        if record and self.recording:
+            for listener in self.listeners:
+                listener(record)
+
+    @contextmanager
+    def recorded(self, record: journal.Record):
+        """Records an edit as a whole, the edits it makes along the way are not recorded"""
+        self.record(record)
+        self.record_depth += 1
+        try:
+            yield
+        finally:
+            self.record_depth -= 1
+
+    @contextmanager
+    def replay(self):
+        replaying, self.replaying = self.replaying, True
+        try:
+            yield
+        finally:
+            self.replaying = replaying
+
+    def address(self, hatch: "Hatch") -> List[Any]:
+        # the same as in the line files, [node index, is output, hatch index]
+        return [self.nodes.index(hatch.node), not hatch.is_input, hatch.master.hatches.index(hatch)]
+
+    def encode_node(self, node: "NodeFrame") -> Dict[str, Any]:
+        """The encoding of a single node, with its connections"""
+        hatch_tl = {}
+        for hatch in node.input_hatches.hatches + node.output_hatches.hatches:
+            for other in hatch.connections:
+                hatch_tl[other] = self.address(other)
+
+        return node.encode(hatch_tl)
+
+    def insert_node(self, index: int, d: Dict[str, Any]) -> "NodeFrame":
+        node = NodeFrame._decode(self.globalstate, self, **d)
+        self.nodes.insert(index, node)
+        node.update_position()
+        self.connect_many(node.ties(self.nodes))
+        self.changed()
+
+        return node
+
+    def hatch_by_address(self, address: List[Any]) -> "Hatch":
+        i, x, j = address
+        node = self.nodes[i]
+
+        return (node.output_hatches if x else node.input_hatches).hatches[j]
+
+    def apply_record(self, record: journal.Record):
+        """Redoes an edit passed to the listeners"""
+        op = record["op"]
+
+        with self.replay():
+            if op == "add":
+                self.insert_node(record["index"], record["node"])
+            elif op == "delete":
+                self.nodes[record["index"]].delete()
+            elif op == "replace":
+                self.nodes[record["index"]].delete()
+                self.insert_node(record["index"], record["node"])
+            elif op == "move":
+                node = self.nodes[record["index"]]
+                node.pos = Vec2(*record["pos"])
+                node.reindex()
+                node.update_position()
+            elif op == "connect":
+                self.connect(self.hatch_by_address(record["a"]), self.hatch_by_address(record["b"]))
+            elif op == "disconnect":
+                self.disconnect(self.hatch_by_address(record["a"]), self.hatch_by_address(record["b"]))
+            elif op == "add_hatch":
+                node = self.nodes[record["index"]]
+                (node.output_hatches if record["output"] else node.input_hatches).add_hatch(record["item_id"])
+            elif op == "remove_hatch":
+                hatch = self.hatch_by_address([record["index"], record["output"], record["slot"]])
+                hatch.master.remove_hatch(hatch)
+            elif op == "item":
+                hatch = self.hatch_by_address([record["index"], record["output"], record["slot"]])
+                hatch.set_item(record["item_id"])
+            elif op == "machine":
+                step = self.nodes[record["index"]]
+                assert isinstance(step, StepFrame)
+                step.machine.set(record["machine"])
+                self.changed()
+            elif op == "recipe":
+                step = self.nodes[record["index"]]
+                assert isinstance(step, StepFrame)
+                step.machine.set(record["machine"])
+                step.set_recipe(self.globalstate.recipe_by_id(record["machine"], record["recipe"]))
+            elif op == "rate":
+                step = self.nodes[record["index"]]
+                assert isinstance(step, StepFrame)
+                step.set_rate(record["rate"])
+                self.changed()
+            elif op == "rates":
+                # the results of a solve
+                for index, rate in record["rates"]:
+                    step = self.nodes[index]
+                    assert isinstance(step, StepFrame)
+                    step.set_rate(rate)
+            else:
+                raise ValueError(f"Unknown edit {op}")
+
+    def load(self, canvas: List[Dict[str, Any]], done: Optional[Callable[[], None]]=None, record=False):
+        """Adds the nodes of a line in batches, so large lines render progressively, then connects them in one pass;
+        with `record` the nodes and connections are recorded as edits, once all are there"""
         try:
-            with open(SAVE_FN, mode="r", encoding="utf-8") as fp:
-                d = json.load(fp)
-                
-                self._decode(**d)
-                self.update()
+            from headless import build_line
+            models: List[Optional[Union[Step, Buffer]]] = list(build_line(canvas, self.globalstate))
+        except (RuntimeError, KeyError, IndexError):
+            # lines with unset recipes only get models when they are solved
+            models = [None] * len(canvas)
+
+        self.after_idle(self.load_batch, canvas, models, len(self.nodes), 0, done, record)
+
+    def load_batch(self, canvas: List[Dict[str, Any]], models, first: int, start: int, done: Optional[Callable[[], None]], record=False):
+        end = min(start + self.LOAD_BATCH, len(canvas))
+
+        with self.replay():
+            for d_child, model in zip(canvas[start:end], models[start:end]):
+                node = NodeFrame._decode(self.globalstate, self, **d_child)
+                node.model = model
+                # placed from the saved position, the widget geometry isn't known yet
+                node.update_position(lines=False)
+                self.nodes.append(node)
+
+        if end < len(canvas):
+            self.menubar.set_status(f"Loading: {end}/{len(canvas)} nodes")
+            self.after(1, self.load_batch, canvas, models, first, end, done, record)
+            return
 
-                for node in self.nodes:
-                    node.tie(self.nodes)
+        self.menubar.set_status("")
 
-                self.after_idle(self.drag_finish)
-        except OSError:
-            pass
+        # the connections in the file are relative to the nodes of the file
+        nodes = self.nodes[first:]
+        pairs = [pair for node in nodes for pair in node.ties(nodes)]
+
+        if record:
+            # in one event, so it is undone as a whole
+            for i, node in enumerate(nodes):
+                self.record({"op": "add", "index": first + i, "node": node.encode({})})
+
+            self.connect_many(pairs)
+        else:
+            with self.replay():
+                self.connect_many(pairs)
+
+        if done is not None:
+            done()
+
+    def insert_preset(self, path: str, pos: Vec2):
+        """Adds the nodes of a line file with their top left corner at pos"""
+        _, canvas = lineformat.read(path)
+
+        if not canvas:
+            return
+
+        origin = pos + self.globalstate.center - self.globalstate.screencenter
+        x0 = min(d_node["pos"][0] for d_node in canvas)
+        y0 = min(d_node["pos"][1] for d_node in canvas)
+
+        canvas = [dict(d_node, pos=[d_node["pos"][0] - x0 + origin.x, d_node["pos"][1] - y0 + origin.y]) for d_node in canvas]
+        self.load(canvas, record=True)
 
     def on_closing(self):
-        if self.autosave:
-            with open(self.autosave, mode="w", encoding="utf-8") as fp:
-                json.dump(self, fp, default=lambda x: x.encode())
+        self.cancel_solve()
+        self.solver.shutdown(wait=False)
+        self.conflicts.close()
+
+        # every edit is in the journal already, it is compacted on the next start
+        if self.journal is not None:
+            self.journal.close()
         
         self.master.destroy()
 
+    def start_trace(self):
+        self.trace = []
+        self.trace_start = time.perf_counter()
+
+    def stop_trace(self) -> Dict[str, Any]:
+        trace = {"version": 1, "events": self.trace or []}
+        self.trace = None
+
+        return trace
+
+    def source_ref(self, source: Union["NodeCanvas", "NodeFrame", "Hatch"]) -> Dict[str, Any]:
+        if isinstance(source, NodeFrame):
+            return {"node": self.nodes.index(source)}
+        elif isinstance(source, Hatch):
+            return {"hatch": self.address(source)}
+        else:
+            return {"canvas": True}
+
+    def source_by_ref(self, ref: Dict[str, Any]) -> Union["NodeCanvas", "NodeFrame", "Hatch"]:
+        if "node" in ref:
+            return self.nodes[ref["node"]]
+        elif "hatch" in ref:
+            return self.hatch_by_address(ref["hatch"])
+        else:
+            return self
+
+    COMMANDS = ("new_node", "new_buffer", "insert_preset", "propagate", "auto_connect_all", "select_all", "undo", "redo")
+
+    def run_command(self, command: str, **args):
+        """Runs a menu command, by name so that it can be traced"""
+        if self.trace is not None:
+            self.trace.append({"t": time.perf_counter() - self.trace_start, "command": command, "args": args})
+
+        if command == "new_node":
+            self.new_node(Vec2(*args["pos"]))
+        elif command == "new_buffer":
+            self.new_buffer(Vec2(*args["pos"]))
+        elif command == "insert_preset":
+            self.insert_preset(args["path"], Vec2(*args["pos"]))
+        elif command == "propagate":
+            node = self.nodes[args["node"]]
+            assert isinstance(node, StepFrame)
+            self.propagate_flow(node)
+        elif command == "auto_connect_all":
+            self.auto_connect_all()
+        elif command == "select_all":
+            self.deselect_all()
+            for node in self.nodes:
+                self.select(node)
+        elif command == "undo":
+            self.history.undo()
+        elif command == "redo":
+            self.history.redo()
+        else:
+            raise ValueError(f"Unknown command {command}")
+
     def gesture(self, pos: Vec2, posi: Vec2, mod: Gesture, source: Union["NodeCanvas", "NodeFrame", "Hatch"]):
+        if self.trace is not None:
+            self.trace.append({ "t": time.perf_counter() - self.trace_start
+                              , "gesture": { "pos": pos.encode(), "posi": posi.encode(), "mod": int(mod)
+                                           , "source": self.source_ref(source) } })
+
+        if source is self and not mod & (Gesture.DRAG | Gesture.DRAG_END | Gesture.SCROLL):
+            # unmapped nodes are drawn on the canvas, so clicks on them arrive here
+            hatch = self.hatch_at(posi)
+            node = self.node_at(posi) if hatch is None else None
+            source = hatch if hatch is not None else node if node is not None else self
+
         if mod == Gesture.PRESS:
             self.drag_start = pos
 
@@ -444,9 +1035,7 @@ class NodeCanvas(BetterWidget, tk.Canvas):
             delta *= 3
 
 
-            self.globalstate.scale = max(0.01, self.globalstate.scale * (1 + delta))
-            self.update_positions()
-            self.update_scales()
+            self.zoom(1 + delta)
 
         if not isinstance(source, Hatch):
             self.hatch = None
@@ -474,30 +1063,184 @@ class NodeCanvas(BetterWidget, tk.Canvas):
 
     def update_positions(self):        
         for child in self.nodes:
-            child.update_position()
+            child.update_position(lines=False)
+
+        self.update_lines(self.all_connections())
+
+    def all_connections(self) -> Set["Connection"]:
+        return {conn for conns in self.connections.values() for conn in conns.values()}
+
+    def update_lines(self, connections: Iterable["Connection"]):
+        for conn in connections:
+            self.coords(conn.line, *self.connection_coords(conn.start, conn.end))
+
+    def schedule_lines(self, connections: Iterable["Connection"]):
+        # redraw these connections once the event queue is empty
+        self.dirty_lines.update(connections)
+
+        if not self.lines_after:
+            self.lines_after = self.after_idle(self.flush_lines)
+
+    def redraw_timer(self, name: str):
+        return self.latency.timer("redraw", name) if self.latency is not None else instrumentation.NULL_TIMER
+
+    def set_latency(self, on: bool):
+        """Measures the gestures and redraws, and shows the measurements in an overlay"""
+        if on and self.latency is None:
+            self.latency = LatencyMonitor()
+            self.latency_overlay = tk.Label(self, font=("Consolas", 9), justify="left", anchor="nw", background="#FFFFE0")
+            self.latency_overlay.place(x=4, y=4)
+            self.update_latency_overlay()
+        elif not on and self.latency_overlay is not None:
+            self.latency_overlay.destroy()
+            self.latency_overlay = None
+            self.latency = None
+
+    def update_latency_overlay(self):
+        if self.latency is None or self.latency_overlay is None:
+            return
+
+        self.latency_overlay.configure(text=self.latency.summary())
+        self.latency_overlay.lift()
+        self.after(250, self.update_latency_overlay)
+
+    def flush_lines(self):
+        with self.redraw_timer("lines"):
+            self._flush_lines()
+
+    def _flush_lines(self):
+        self.lines_after = ""
+
+        # connections might have been removed in the meantime
+        lines = self.dirty_lines & self.all_connections()
+        self.dirty_lines = set()
+
+        self.update_lines(lines)
 
     def update_scales(self):
+        # the fonts are only updated as the nodes get placed, see NodeFrame.update_position
         for child in self.nodes:
-            child.update_scale()
+            child.scale_stale = True
+
+    def zoom(self, factor: float):
+        old = self.globalstate.scale
+        self.globalstate.scale = max(0.01, old * factor)
+        f = self.globalstate.scale / old
+
+        # a cheap preview while the wheel turns: scale the canvas items and resize the mapped nodes
+        x, y = self.globalstate.screencenter
+        self.scale("connection", x, y, f, f)
+        self.scale("placeholder", x, y, f, f)
+
+        for child in self.shown:
+            x0, y0, x1, y1 = child.screen_rect()
+            child.place(x=x0, y=y0, width=x1 - x0, height=y1 - y0)
+
+        if self.zoom_after:
+            self.after_cancel(self.zoom_after)
+
+        self.zoom_after = self.after(self.ZOOM_MS, self.settle_zoom)
+
+    def settle_zoom(self):
+        with self.redraw_timer("zoom"):
+            self._settle_zoom()
+
+    def _settle_zoom(self):
+        self.zoom_after = ""
+
+        self.update_scales()
+        self.update_positions()
+
+    def lod(self) -> bool:
+        return self.globalstate.scale < self.LOD_SCALE
+
+    def on_configure(self, e: tk.Event):
+        self.view_size = Vec2(e.width, e.height)
+        self.update_positions()
+
+    def view_rect(self) -> Optional[Rect]:
+        """The visible part of the canvas (plus margin) in model coordinates"""
+        if not self.view_size.x:
+            return None
+
+        m = Vec2(self.VIEW_MARGIN, self.VIEW_MARGIN)
+        x0, y0 = self.globalstate.to_model(vzero - m)
+        x1, y1 = self.globalstate.to_model(self.view_size + m)
+
+        return x0, y0, x1, y1
+
+    def in_view(self, x0, y0, x1, y1) -> bool:
+        if not self.view_size.x:
+            # not laid out yet
+            return True
+
+        m = self.VIEW_MARGIN
+        w, h = self.view_size
+        return x1 > -m and y1 > -m and x0 < w + m and y0 < h + m
 
     def drag(self, pos):
-        dp = (pos - self.drag_start) / self.globalstate.scale
-        
+        self.pending_drag += pos - self.drag_start
         self.drag_start = pos
 
-    
+        if not self.motion_after:
+            self.motion_after = self.after(self.FRAME_MS, self.flush_drag)
+
+    def flush_drag(self):
+        with self.redraw_timer("drag"):
+            self._flush_drag()
+
+    def _flush_drag(self):
+        if self.motion_after:
+            self.after_cancel(self.motion_after)
+            self.motion_after = ""
+
+        dp = self.pending_drag / self.globalstate.scale
+        self.pending_drag = vzero
+
+        if not (dp.x or dp.y):
+            return
+
         if self.selection:
+            lines = set()
             for child in self.selection:
-                child.move(dp)
+                self.moved.setdefault(child, child.pos)
+                child.pos += dp
+                child.reindex()
+                child.update_position(lines=False)
+                lines.update(child.connection_objects())
+
+            self.update_lines(lines)
         else:
+            before = self.globalstate.to_screen(vzero)
             self.globalstate.center -= dp
-            self.update_positions()
+            dx, dy = self.globalstate.to_screen(vzero) - before
+
+            # everything on the canvas shifts by the same amount, let Tk do that in one go
+            self.move("connection", dx, dy)
+            self.move("placeholder", dx, dy)
+
+            # only the nodes that are or become mapped need to be placed, the rest are placeholders
+            view = self.view_rect()
+            children = self.nodes if view is None else self.shown | self.node_index.query(view)
+
+            for child in children:
+                child.update_position(lines=False)
 
     def drag_finish(self):
         # if not self.to_move:
         #     # just get all connections loaded
         #     self.drag_init(False)
 
+        self.flush_drag()
+        # panning moves the lines by rounded amounts, put them back where they belong
+        self.update_lines(self.all_connections())
+
+        for child, start in self.moved.items():
+            if child in self.nodes:
+                self.record({"op": "move", "index": self.nodes.index(child), "pos": child.pos.encode(), "from": start.encode()})
+
+        self.moved = {}
+
         self.update_idletasks()
 
         # for child in self.to_move:
@@ -514,31 +1257,41 @@ class NodeCanvas(BetterWidget, tk.Canvas):
         # self.to_move_right = []
 
     def select_region(self, pos):
-        x0, y0 = self.drag_starti
-        x1, y1 = pos
+        x0, y0 = self.globalstate.to_model(self.drag_starti)
+        x1, y1 = self.globalstate.to_model(pos)
 
         x0, x1 = min(x0, x1), max(x0, x1)
         y0, y1 = min(y0, y1), max(y0, y1)
         
-        for child in self.winfo_children():
-            if not isinstance(child, NodeFrame):
-                continue
-
-            x = child.winfo_x()
-            y = child.winfo_y()
+        for child in self.node_index.query((x0, y0, x1, y1)):
+            x, y = child.pos
             
             if x0 < x < x1 and y0 < y < y1 and child not in self.selection:
                 self.select(child)    
 
+    def node_at(self, pos: Vec2) -> Optional["NodeFrame"]:
+        """The topmost node under the screen position pos"""
+        x, y = self.globalstate.to_model(pos)
+        found = self.node_index.at(x, y)
+
+        return max(found, key=self.nodes.index) if found else None
+
+    def hatch_at(self, pos: Vec2) -> Optional["Hatch"]:
+        """The hatch under the screen position pos, also on nodes drawn as placeholders"""
+        x, y = self.globalstate.to_model(pos)
+        found = self.hatch_index.at(x, y)
+
+        return found[0] if found else None
+
     def change_region_selection(self, posi):
         xint, yint = posi
         self.coords(self.selection_rectangle, *self.drag_starti, xint, yint)
 
     def deselect_all(self):
-        for child in self.selection:
+        selection, self.selection = self.selection, []
+
+        for child in selection:
             child.deselect()
-        
-        self.selection = []
 
     def select(self, child: "NodeFrame"):
         self.selection.append(child)
@@ -561,11 +1314,23 @@ class NodeCanvas(BetterWidget, tk.Canvas):
 
         node = StepFrame(master=self, globalstate=self.globalstate, pos=pos_)
         self.nodes.append(node)
+        node.update_position()
+        self.changed()
+        self.record({"op": "add", "index": len(self.nodes) - 1, "node": node.encode({})})
         node.drag_init()
 
         return node
 
+    def delete_record(self, child: "NodeFrame") -> journal.Record:
+        # with the connections, for undo
+        return {"op": "delete", "index": self.nodes.index(child), "node": self.encode_node(child)} \
+            if self.recording else {}
+
     def delete_node(self, child):
+        with self.recorded(self.delete_record(child)):
+            self._delete_node(child)
+
+    def _delete_node(self, child):
         if child in self.selection:
             self.selection.remove(child)
 
@@ -578,6 +1343,21 @@ class NodeCanvas(BetterWidget, tk.Canvas):
                 self.disconnect(hatch, conn)
 
         self.nodes.remove(child)
+        self.changed()
+        self.shown.discard(child)
+
+        for node in self.conflicts.remove(child):
+            if node is not child:
+                node.update_highlight()
+        self.node_index.remove(child)
+
+        for hatch in child.input_hatches.hatches + child.output_hatches.hatches:
+            self.hatch_index.remove(hatch)
+            self.unindex_item(hatch)
+
+        if child.placeholder:
+            self.delete(child.placeholder, child.placeholder_label)
+
         child.destroy()
 
     def delete_selection(self):
@@ -589,61 +1369,127 @@ class NodeCanvas(BetterWidget, tk.Canvas):
 
         node = BufferFrame(master=self, globalstate=self.globalstate, pos=pos_)
         self.nodes.append(node)
+        node.update_position()
+        self.changed()
+        self.record({"op": "add", "index": len(self.nodes) - 1, "node": node.encode({})})
         node.drag_init()
 
         return node
 
+    def index_item(self, hatch: "Hatch"):
+        if hatch.item_id:
+            by_item = self.inputs_by_item if hatch.is_input else self.outputs_by_item
+            by_item.setdefault(hatch.item_id, {})[hatch] = None
+
+    def unindex_item(self, hatch: "Hatch"):
+        by_item = self.inputs_by_item if hatch.is_input else self.outputs_by_item
+        hatches = by_item.get(hatch.item_id)
+
+        if hatches is not None:
+            hatches.pop(hatch, None)
+
+            if not hatches:
+                del by_item[hatch.item_id]
+
+    def auto_connect(self, hatches: Iterable["Hatch"]):
+        """Connects each unconnected hatch to every hatch on the other side with the same item"""
+        for hatch in hatches:
+            if not hatch.connections and hatch.item_id:
+                by_item = self.outputs_by_item if hatch.is_input else self.inputs_by_item
+
+                for other in list(by_item.get(hatch.item_id, ())):
+                    self.connect(hatch, other)
+
+    def auto_connect_all(self):
+        # only items with hatches on both sides can match
+        for item_id in list(self.inputs_by_item):
+            if item_id in self.outputs_by_item:
+                self.auto_connect(list(self.inputs_by_item[item_id]))
+                self.auto_connect(list(self.outputs_by_item.get(item_id, ())))
+
     def connect(self, a: "Hatch", b: "Hatch"):
-        if a == b:
-            return
+        self.connect_many([(a, b)])
 
-        if a.is_input == b.is_input:
-            return
-        
-        if self.connections.get(a, {}).get(b) is None:
-            if a.is_input:
-                a, b = b, a
+    def connect_many(self, pairs: Iterable[Tuple["Hatch", "Hatch"]]):
+        # the hatch bars are recoloured once per node at the end rather than once per connection
+        touched: Set[Hatches] = set()
+
+        for a, b in pairs:
+            if a == b:
+                continue
 
-            if not a.connect(b):
-                return
-            b.connect(a)
+            if a.is_input == b.is_input:
+                continue
+            
+            if self.connections.get(a, {}).get(b) is None:
+                if a.is_input:
+                    a, b = b, a
+
+                self.record_depth += 1
+                try:
+                    connected = a.connect(b, recolour=False)
+                    if connected:
+                        b.connect(a, recolour=False)
+                finally:
+                    self.record_depth -= 1
 
-            x1, y1 = a.relative_position(self)
-            x2, y2 = b.relative_position(self)
+                if not connected:
+                    continue
 
-            x1, y1 = x1 + a.winfo_width() // 2, y1 + a.winfo_height()
-            x2, y2 = x2 + b.winfo_width() // 2, y2 + b.winfo_height()
+                # only once it is known to work, a refused connection is not an edit
+                if self.recording:
+                    self.record({"op": "connect", "a": self.address(a), "b": self.address(b)})
 
-            dx = self.winfo_rootx()
-            dy = self.winfo_rootx()
+                conn = Connection(self, self.create_line(*self.connection_coords(a, b), fill="#00FF00", width=3, tags=("connection",)), a, b)
 
-            conn = Connection(self, self.create_line(x1 - dx, y1 - dy, x2 - dx, y2 - dy, fill="#00FF00", width=3), a, b)
+                self.connections.setdefault(a, {})[b] = conn
+                self.connections.setdefault(b, {})[a] = conn
 
-            self.connections.setdefault(a, {})[b] = conn
-            self.connections.setdefault(b, {})[a] = conn
+                touched.add(a.node)
+                touched.add(b.node)
+
+        for node in touched:
+            node.update_connected_colour()
+
+        if touched:
+            self.changed()
     
     def update_connection(self, a: "Hatch", b: "Hatch"):
         connection = self.connections[a][b] 
 
-        x1, y1 = a.relative_position(self)
-        x2, y2 = b.relative_position(self)
+        self.coords(connection.line, *self.connection_coords(a, b))
 
-        x1, y1 = x1 + a.winfo_width() // 2, y1 + a.winfo_height()
-        x2, y2 = x2 + b.winfo_width() // 2, y2 + b.winfo_height()
+    def hatch_anchor(self, hatch: "Hatch") -> Tuple[int, int]:
+        # computed from the model position and the cached hatch offset, querying the geometry is too slow while dragging
+        node = hatch.node
 
-        dx = self.winfo_rootx()
-        dy = self.winfo_rootx()
+        if hatch.anchor_offset is None:
+            return node.hatch_anchor(hatch)
 
-        self.coords(connection.line, x1 - dx, y1 - dy, x2 - dx, y2 - dy)
+        x, y = self.globalstate.to_screen(node.pos)
+        ox, oy = hatch.anchor_offset
+        s = self.globalstate.scale
+
+        return int(x + ox * s), int(y + oy * s)
+
+    def connection_coords(self, a: "Hatch", b: "Hatch") -> Tuple[int, int, int, int]:
+        x1, y1 = self.hatch_anchor(a)
+        x2, y2 = self.hatch_anchor(b)
+
+        return x1, y1, x2, y2
 
     def disconnect(self, a: "Hatch", b: "Hatch"):
         if self.connections.get(a, {}).get(b) is not None:
+            if self.recording:
+                self.record({"op": "disconnect", "a": self.address(a), "b": self.address(b)})
+
             self.delete(self.connections[a][b].line)
             del self.connections[a][b]
             del self.connections[b][a]
             
             a._disconnect(b)
             b._disconnect(a)
+            self.changed()
 
     def toggle_connect(self, a: "Hatch", b: "Hatch"):
         if self.connections.get(a, {}).get(b) is None:
@@ -682,8 +1528,7 @@ class Position(BetterWidget):
 
     def update_position(self):
         if self.force:
-            p = (self.pos - self.globalstate.center) * self.globalstate.scale + self.globalstate.screencenter
-            x, y = p
+            x, y = self.globalstate.to_screen(self.pos)
             self.place(x=x, y=y)
 
     def init(self):
@@ -705,6 +1550,9 @@ class Hatches(Position, BetterFrame, ABC):
         super(Hatches, self).__init__(globalstate=globalstate, master=master, **kwargs)
         self.master: NodeCanvas
 
+        # the labels, entries and buttons are only created once the node is first shown, see NodeFrame.build
+        self.built = False
+
         self.input_hatches  = inputs if inputs else \
             HatchBar(master=self, globalstate=globalstate, is_input=True)
         self.output_hatches = outputs if outputs else \
@@ -753,34 +1601,33 @@ class Hatches(Position, BetterFrame, ABC):
         self.output_hatches.update_hatches()
         
 
-    def move(self, dp):
-        super(Hatches, self).move(dp)
-        self.input_hatches.update_hatches()
-        self.output_hatches.update_hatches()
-
-        #     for c in h.connections:
-
-        #     x1, y1, x2, y2 = conn.drag_start
-
-        #     if conn in self.to_move_right:
-        #         self.coords(conn.line, x1 + dx, y1 + dy, x2 + dx, y2 + dy)
-        #     else:
-        #         self.coords(conn.line, x1 + dx, y1 + dy, x2, y2)
-
-        # for conn in self.to_move_right:
-        #     x1, y1, x2, y2 = conn.drag_start
+    def connection_objects(self) -> Set["Connection"]:
+        conns = set()
+        for hatch in self.input_hatches.hatches + self.output_hatches.hatches:
+            conns.update(hatch.connection_objects())
 
-        #     if conn not in self.to_move_left:
-        #         self.coords(conn.line, x1, y1, x2 + dx, y2 + dy)
+        return conns
 
 
 class NodeFrame(Hatches, ABC):
+    # the fraction of the height taken by the input hatches, to draw connections while unmapped
+    INPUT_BAR = 1 / 3
+    # placeholder labels are left out on rectangles narrower than this
+    LABEL_MIN_WIDTH = 48
+
     def __init__(self, master: NodeCanvas, **kwargs):
         super(NodeFrame, self).__init__(master=master, parent=None, force=True, **kwargs)
         self.master: NodeCanvas
 
         self.model: Union[None, Step, Buffer] = None
 
+        # nodes far off-screen or zoomed out are unmapped and drawn as a canvas rectangle,
+        # they start out that way until update_position places them
+        self.visible = False
+        self.placeholder = 0
+        self.placeholder_label = 0
+        self.scale_stale = False
+
         self.input_hatches.grid(row=0, column=0, sticky="nesw")
         self.output_hatches.grid(row=2, column=0, sticky="nesw")
 
@@ -791,25 +1638,142 @@ class NodeFrame(Hatches, ABC):
         self.drag_start: Tuple[int, int] = 0, 0
 
         self.nwidth = self.nheight = 200
-        self.place(width=self.nwidth, height=self.nheight)
         self.configure(background="#FFFFFF", highlightbackground="#000000", highlightcolor="#0000FF", highlightthickness=1)
+
+        self.reindex()
     
         self.bind("<Delete>", lambda e: self.master.delete_selection())
 
     # TODO low: disconnect all button
     def encode(self, hatch_tl):
         return super(NodeFrame, self).encode(hatch_tl)
+
+    def init(self):
+        # placed at its screen position by update_position
+        ...
+
+    def build(self):
+        """Creates the widgets inside the node, on the first show"""
+        self.built = True
+        self.input_hatches.build()
+        self.output_hatches.build()
     
     def update_scale(self):
         super(NodeFrame, self).update_scale()
 
         s = self.globalstate.scale
         self.place(width=s * self.nwidth, height=s * self.nheight)
+        self.scale_stale = False
         # self.input_hatches.update_scale()
         # self.output_hatches.update_scale()
 
+    def rect(self) -> Rect:
+        x, y = self.pos
+        return x, y, x + self.nwidth, y + self.nheight
+
+    def reindex(self):
+        self.master.node_index.move(self, self.rect())
+
+        for hatch in self.input_hatches.hatches + self.output_hatches.hatches:
+            hatch.reindex()
+
+    def move(self, dp):
+        self.pos += dp
+        self.reindex()
+        self.update_position()
+
+    def screen_rect(self) -> Tuple[int, int, int, int]:
+        x, y = self.globalstate.to_screen(self.pos)
+        s = self.globalstate.scale
+
+        return x, y, int(x + s * self.nwidth), int(y + s * self.nheight)
+
+    def update_position(self, lines=True):
+        x0, y0, x1, y1 = self.screen_rect()
+
+        if self.master.in_view(x0, y0, x1, y1) and not self.master.lod():
+            if not self.visible:
+                self.show()
+            elif self.scale_stale:
+                self.update_scale()
+
+            self.place(x=x0, y=y0)
+        else:
+            if self.visible or not self.placeholder:
+                self.hide()
+
+            self.master.coords(self.placeholder, x0, y0, x1, y1)
+            self.master.coords(self.placeholder_label, (x0 + x1) / 2, (y0 + y1) / 2)
+            self.master.itemconfigure(self.placeholder_label, state="normal" if x1 - x0 >= self.LABEL_MIN_WIDTH else "hidden")
+
+        if lines:
+            self.input_hatches.update_hatches()
+            self.output_hatches.update_hatches()
+
+    def show(self):
+        if not self.built:
+            self.build()
+            self.scale_stale = True
+
+        self.visible = True
+        self.master.shown.add(self)
+
+        s = self.globalstate.scale
+        self.place(width=s * self.nwidth, height=s * self.nheight)
+
+        if self.scale_stale:
+            self.update_scale()
+
+        if self.placeholder:
+            self.master.itemconfigure(self.placeholder, state="hidden")
+            self.master.itemconfigure(self.placeholder_label, state="hidden")
+
+    def hide(self):
+        self.visible = False
+        self.master.shown.discard(self)
+        self.place_forget()
+
+        if not self.placeholder:
+            self.placeholder = self.master.create_rectangle(0, 0, 0, 0, outline="#000000", tags=("placeholder",))
+            self.placeholder_label = self.master.create_text(0, 0, font=("Segoe UI", 8), tags=("placeholder",))
+            self.master.tag_lower(self.placeholder)
+
+        self.master.itemconfigure(self.placeholder, state="normal", fill=self.cget("background"))
+        self.master.itemconfigure(self.placeholder_label, text=self.short_label())
+
+    def short_label(self) -> str:
+        return ""
+
+    def set_placeholder_colour(self, colour):
+        if self.placeholder:
+            self.master.itemconfigure(self.placeholder, fill=colour)
+
+    def hatch_anchor(self, hatch: "Hatch") -> Tuple[int, int]:
+        # estimates where NodeCanvas.hatch_anchor would be, for hatches that were never laid out
+        bar = hatch.master
+        x0, y0, x1, y1 = self.screen_rect()
+
+        i = bar.hatches.index(hatch) + 1
+        n = len(bar.hatches) + 1
+
+        x = x0 + (x1 - x0) * (i + 0.5) / n
+        y = y0 + (y1 - y0) * self.INPUT_BAR if bar.is_input else y1
+
+        return int(x), int(y)
+
+    def hatch_rect(self, hatch: "Hatch") -> Rect:
+        # where the hatch will be laid out, relative to pos, for hatches that were not measured (yet)
+        bar = hatch.master
+
+        i = bar.hatches.index(hatch) + 1
+        n = len(bar.hatches) + 1
+        y0, y1 = (0, self.INPUT_BAR) if bar.is_input else (1 - self.INPUT_BAR, 1)
+
+        return self.nwidth * i / n, self.nheight * y0, self.nwidth * (i + 1) / n, self.nheight * y1
+
     def decode(self, **d):
         super(NodeFrame, self).decode(**d)
+        self.reindex()
 
     @classmethod
     def _decode(cls, globalstate, master, type, **d):
@@ -846,14 +1810,26 @@ class NodeFrame(Hatches, ABC):
                 self.model.push.setdefault(hatch.item_id, []).append(conn.node.model) # type: ignore
 
     def tie(self, nodes: List["NodeFrame"]):
-        self.input_hatches.tie(self.master, nodes)
-        self.output_hatches.tie(self.master, nodes)
+        self.master.connect_many(self.ties(nodes))
+
+    def ties(self, nodes: List["NodeFrame"]) -> List[Tuple["Hatch", "Hatch"]]:
+        return self.input_hatches.ties(nodes) + self.output_hatches.ties(nodes)
 
     def select(self):
-        self.configure(highlightbackground="#0000FF")
+        self.update_highlight()
 
     def deselect(self):
-        self.configure(highlightbackground="#000000")
+        self.update_highlight()
+
+    def update_highlight(self):
+        if self in self.master.selection:
+            colour = "#0000FF"
+        elif self.master.conflicts.conflicts_of(self):
+            colour = "#FF0000"
+        else:
+            colour = "#000000"
+
+        self.configure(highlightbackground=colour)
 
     def delete(self):
         self.master.delete_node(self)
@@ -888,45 +1864,100 @@ def ask_multiple_choice_question(master, prompt, options):
         return options[v.get()]
 
 
-TIERS = [ "LV", "MV", "HV", "EV"
-        , "IV", "LuV", "ZPM", "UV"
-        , "UHV", "UEV", "UIV", "UMV"]
-def powerTier(eut):
+class PresetBrowser(tk.Toplevel):
+    """Searches the preset library, and inserts the chosen preset at pos"""
+
+    def __init__(self, canvas: "NodeCanvas", pos: Vec2):
+        super().__init__(canvas)
+        self.title("Insert preset")
+
+        import library
+
+        self.canvas = canvas
+        self.pos = pos
+        self.library = library.Library()
+        self.describe = library.describe
+        self.results: List[Dict[str, Any]] = []
 
-    m = eut / 32
-    e = min(math.ceil(math.log(max(m, 1), 4)), len(TIERS) - 1)
+        self.query = tk.StringVar()
+        self.query.trace_add("write", lambda *_: self.search())
 
-    m /= 4 ** e
+        entry = tk.Entry(self, textvariable=self.query)
+        entry.pack(fill="x")
+        entry.focus_set()
 
-    return (m, e)
+        self.listbox = tk.Listbox(self, width=120, height=20)
+        self.listbox.pack(expand=1, fill="both")
+
+        self.listbox.bind("<Double-Button-1>", lambda _: self.insert())
+        self.bind("<Return>", lambda _: self.insert())
+        self.bind("<Escape>", lambda _: self.destroy())
+
+        self.search()
+
+    def search(self):
+        self.results = self.library.search(self.query.get())
+
+        self.listbox.delete(0, "end")
+        for entry in self.results:
+            self.listbox.insert("end", self.describe(entry))
+
+        if self.results:
+            self.listbox.selection_set(0)
+
+    def insert(self):
+        selection = self.listbox.curselection()
+        if not selection:
+            return
+
+        path = self.library.path(self.results[selection[0]])
+        self.destroy()
+        self.canvas.run_command("insert_preset", path=path, pos=self.pos.encode())
 
 
 class StepFrame(NodeFrame):
+    INPUT_BAR = 1 / 6
+
     def __init__(self, **kwargs):
         super(StepFrame, self).__init__(**kwargs)
 
         self.model: Optional[Step]
 
-        self.settings = tk.Frame(self, background="#FFFFFF", highlightbackground="#000000", highlightthickness=1)
-        self.settings.grid(row=1, column=0, sticky="nesw")
-        self.settings.configure()
         self.grid_rowconfigure(index=1, weight=4)
         self.machine = tk.StringVar()
         self.recipe_name = tk.StringVar()
         self.recipe: Optional[Recipe] = None
         self.recipe_id: Optional[int] = None
         self.rate   = tk.DoubleVar()
+        self.power_text = tk.StringVar()
+
+        self.var_values: Dict[str, Any] = {"machine": "", "rate": 0.0}
+        self.machine.trace_add("write", lambda *_: self.record_var("machine", self.machine))
+        self.rate.trace_add("write", lambda *_: self.record_var("rate", self.rate))
         self.eut = self.surge_eut = 0
 
+        self.bind("<Control-r>", lambda _: self.refine())
+        self.bind("<Control-a>", lambda _: self.auto())
+
+        self.update_connected_colour()
+
+    def build(self):
+        super(StepFrame, self).build()
+
+        self.settings = tk.Frame(self, background=self.cget("background"), highlightbackground="#000000", highlightthickness=1)
+        self.settings.grid(row=1, column=0, sticky="nesw")
+
         invalidate_machine = self.register(self.invalidate_machine)
         validate_rate = self.register(self.validate_rate)
 
         # TODO high: list valid machines
+        from ttkwidgets.autocomplete import AutocompleteEntry
+
         self.machinebox = AutocompleteEntry(self.settings, completevalues=list(self.globalstate.recipes_by_machine.keys()), textvariable=self.machine, validatecommand=(invalidate_machine,))
         self.recipebox  = tk.Label(self.settings, textvariable=self.recipe_name)
         self.recipebox.configure(background="white", borderwidth=2, relief="groove")
         self.ratebox    = tk.Entry(self.settings, textvariable=self.rate, validatecommand=(validate_rate,))
-        self.powerlabel = tk.Label(self.settings)
+        self.powerlabel = tk.Label(self.settings, textvariable=self.power_text)
 
         self.machinebox.grid(column=0, row=0)
         self.recipebox.grid(column=0, row=1)
@@ -938,14 +1969,10 @@ class StepFrame(NodeFrame):
         self.settings.grid_rowconfigure(3, weight=1)
         self.settings.grid_columnconfigure(0, weight=1)
         
-        self.bind("<Control-r>", lambda _: self.refine())
-        self.bind("<Control-a>", lambda _: self.auto())
         self.recipebox.bind("<Button-1>", lambda _: self.select_recipe())
 
         for e in MOUSE_EVENTS:
             self.settings.bind(e, lambda e: self.master.gesture_manager.on_event(e, self))
-        
-        self.update_connected_colour()
 
     def update_scale(self):
         super(StepFrame, self).update_scale()
@@ -955,27 +1982,23 @@ class StepFrame(NodeFrame):
 
     def set_background(self, colour):
         self.configure(background=colour)
-        self.settings.configure(background=colour)
+        if self.built:
+            self.settings.configure(background=colour)
+        self.set_placeholder_colour(colour)
+
+    def short_label(self) -> str:
+        machine = self.machine.get()
+        return machine if len(machine) <= 16 else machine[:15] + "…"
 
     def delete(self):
-        self.invalidate_machine()
-        super(StepFrame, self).delete()
+        # one record for all of it, taken while the hatches are still there
+        with self.master.recorded(self.master.delete_record(self)):
+            self.invalidate_machine()
+            super(StepFrame, self).delete()
 
     def auto(self):
         if self.recipe is not None:
-            for hatch1 in self.input_hatches.hatches:
-                if not hatch1.connections:
-                    for node in self.master.nodes:
-                        for hatch2 in node.output_hatches.hatches:
-                            if hatch1.item_id == hatch2.item_id:
-                                self.globalstate.master.connect(hatch1, hatch2)
-
-            for hatch1 in self.output_hatches.hatches:
-                if not hatch1.connections:
-                    for node in self.master.nodes:
-                        for hatch2 in node.input_hatches.hatches:
-                            if hatch1.item_id == hatch2.item_id:
-                                self.globalstate.master.connect(hatch1, hatch2)
+            self.master.auto_connect(self.input_hatches.hatches + self.output_hatches.hatches)
 
     def refine(self):
         p = self.position()
@@ -998,6 +2021,7 @@ class StepFrame(NodeFrame):
         self.recipe_id = None
         self.recipe_name.set("")
         self.invalidate_recipe()
+        self.check_conflicts()
 
     def invalidate_recipe(self):
         # TODO high: keep valid hatches
@@ -1022,19 +2046,42 @@ class StepFrame(NodeFrame):
 
     def set_recipe(self, recipe: Optional[Recipe]=None, recipe_id=None):
         if recipe is not None:
-            self.recipe = recipe
-            recipe_id = self.globalstate.recipe_id(self.machine.get(), recipe.raw)
-            self.recipe_name.set(str(self.recipe))
+            canvas = self.master
+            machine = self.machine.get()
+            recipe_id = self.globalstate.recipe_id(machine, recipe.raw)
+            record = {"op": "recipe", "index": canvas.nodes.index(self), "machine": machine, "recipe": recipe_id, "before": canvas.encode_node(self)} \
+                if canvas.recording else {}
 
-            if True: # recipe_id != self.recipe_id:
-                self.invalidate_recipe()
+            with canvas.recorded(record):
+                self.recipe = recipe
+                self.recipe_name.set(str(self.recipe))
 
-            self.recipe_id = recipe_id
+                if True: # recipe_id != self.recipe_id:
+                    self.invalidate_recipe()
+
+                self.recipe_id = recipe_id
         elif recipe_id is not None:
             self.recipe = self.globalstate.recipe_by_id(self.machine.get(), recipe_id)
             self.recipe_id = recipe_id
             self.recipe_name.set(str(self.recipe))
 
+        self.check_conflicts()
+
+    def check_conflicts(self):
+        """Flags this step and the steps on the same machine whose recipes can be confused with its recipe"""
+        conflicts = self.master.conflicts
+
+        if self.recipe is None:
+            changed = conflicts.remove(self)
+        else:
+            changed = conflicts.set(self, self.machine.get(), self.recipe.raw)
+
+        for node in changed:
+            node.update_highlight()
+
+        if conflicts.loading and not self.master.conflicts_after:
+            self.master.conflicts_after = self.master.after(100, self.master.poll_conflicts)
+
     def select_recipe(self):
         # TODO low: validate
         inputs  = [hatch.item_id for hatch in self.input_hatches.hatches if hatch.item_id]
@@ -1131,7 +2178,26 @@ class StepFrame(NodeFrame):
             #else:
             #    text = f"{eut:.1f} ({amps:.1f} {TIERS[tier]})"
 
-            self.powerlabel.configure(text=text)
+            self.power_text.set(text)
+
+    def record_var(self, op: str, var: tk.Variable):
+        try:
+            value = var.get()
+        except tk.TclError:
+            # half-typed
+            return
+
+        # the previous value, for undo
+        before = self.var_values.get(op)
+        self.var_values[op] = value
+
+        canvas = self.master
+        if not canvas.replaying and value != before:
+            # a solve that is running was started from the old value
+            canvas.changed()
+
+        if canvas.recording and self in canvas.nodes:
+            canvas.record({"op": op, "index": canvas.nodes.index(self), op: value, "from": before})
 
     def set_rate(self, rate):
         self.rate.set(rate)
@@ -1152,11 +2218,15 @@ class BufferFrame(NodeFrame):
         super(BufferFrame, self).__init__(**kwargs)
 
         self.model: Optional[Buffer]
-        self.label = tk.Label(self, text="AE")
-       
+        self.flow_text = tk.StringVar(value="AE")
+        self.grid_rowconfigure(index=1, weight=1)
+
+    def build(self):
+        super(BufferFrame, self).build()
+
+        self.label = tk.Label(self, textvariable=self.flow_text)
         self.label.grid(row=1, column=0, sticky="nesw")
         self.label.configure(background="white")
-        self.grid_rowconfigure(index=1, weight=1)
         
         for e in MOUSE_EVENTS:
             self.label.bind(e, lambda e: self.master.gesture_manager.on_event(e, self))
@@ -1170,7 +2240,7 @@ class BufferFrame(NodeFrame):
             ...
         else:
             text = "\n".join(f"{self.globalstate.item_name(item)}: {flow}" for item, flow in self.model.flow.items())
-            self.label.config(text=text)
+            self.flow_text.set(text)
 
     def encode(self, hatch_tl: Dict["Hatch", Tuple[int, bool, int]]):
         d = super(BufferFrame, self).encode(hatch_tl)
@@ -1186,6 +2256,10 @@ class BufferFrame(NodeFrame):
 
     def set_background(self, colour):
         self.configure(background=colour)
+        self.set_placeholder_colour(colour)
+
+    def short_label(self) -> str:
+        return "buffer"
 
 
 class HatchBar(Position, BetterFrame):
@@ -1196,13 +2270,25 @@ class HatchBar(Position, BetterFrame):
         self.configure(background="#FFFFFF", highlightbackground="#000000", highlightthickness=1)
 
         self.is_input = is_input
-        self.plus = tk.Button(self, text="+", command=self.add_hatch)
+        self.plus: Optional[tk.Button] = None
         self.hatches: List[Hatch] = []
 
+        # the hatches do not get a <Configure> when only the bar moves
+        self.bind("<Configure>", lambda e: self.measure())
+
+        self.space()
+
+    def build(self):
+        self.plus = tk.Button(self, text="+", command=self.add_hatch)
+
+        for hatch in self.hatches:
+            hatch.build()
+
         self.space()
 
     def update_scale(self):
-        self.plus.configure(font=("Segoe UI",  int(1 + 8 * self.globalstate.scale)))
+        if self.plus is not None:
+            self.plus.configure(font=("Segoe UI",  int(1 + 8 * self.globalstate.scale)))
 
         for h in self.hatches:
             h.update_scale()
@@ -1218,7 +2304,11 @@ class HatchBar(Position, BetterFrame):
         for d_hatch in d:
             hatch = Hatch(master=self, item_id="", globalstate=self.globalstate, is_input=self.is_input)
             hatch.decode(**d_hatch)
-            self.insert_hatch(len(self.hatches), hatch)
+            self.hatches.append(hatch)
+
+        # laid out once for all of them
+        self.space()
+        self.update_colour()
 
         return self
 
@@ -1236,20 +2326,29 @@ class HatchBar(Position, BetterFrame):
         while self.hatches:
             self.remove_hatch(self.hatches[0])
 
-    def tie(self, canvas: "NodeCanvas", nodes: List["NodeFrame"]):
-        for hatch in self.hatches:
-            hatch.tie(canvas, nodes)
+    def ties(self, nodes: List["NodeFrame"]) -> List[Tuple["Hatch", "Hatch"]]:
+        return [pair for hatch in self.hatches for pair in hatch.ties(nodes)]
 
     def update_hatches(self):
         for hatch in self.hatches:
             hatch.update_connections()
 
+    def measure(self):
+        for hatch in self.hatches:
+            hatch.measure()
+
     def add_hatch(self, item_id=None):
-        # TODO low: adding hatches should move connections on the canvas
-        x = Hatch(master=self, globalstate=self.globalstate, is_input=self.is_input, item_id=item_id)
-        self.hatches.append(x)
-        self.update_colour()
-        self.space()
+        canvas = self.globalstate.master
+        record = {"op": "add_hatch", "index": canvas.nodes.index(self.master), "output": not self.is_input, "slot": len(self.hatches), "item_id": item_id} \
+            if canvas.recording else {}
+
+        with canvas.recorded(record):
+            # TODO low: adding hatches should move connections on the canvas
+            x = Hatch(master=self, globalstate=self.globalstate, is_input=self.is_input, item_id=item_id)
+            self.hatches.append(x)
+            canvas.changed()
+            self.update_colour()
+            self.space()
 
         return x
 
@@ -1259,17 +2358,32 @@ class HatchBar(Position, BetterFrame):
         self.update_colour()
 
     def remove_hatch(self, hatch):
-        self.hatches.remove(hatch)
-        hatch.remove()
-        self.space()
+        canvas = self.globalstate.master
+        record = { "op": "remove_hatch", "index": canvas.nodes.index(self.master), "output": not self.is_input, "slot": self.hatches.index(hatch)
+                 , "before": canvas.encode_node(self.master) } if canvas.recording else {}
+
+        with canvas.recorded(record):
+            self.hatches.remove(hatch)
+            canvas.changed()
+            hatch.remove()
+            self.space()
 
     def space(self):
-        xs = [self.plus] + self.hatches
-        n = len(xs)
+        # the first slot is the plus button, once there is one
+        n = len(self.hatches) + 1
+
+        if self.plus is not None:
+            self.plus.place(relx=0, rely=0, relwidth=1 / n, relheight=1)
 
-        for i, x in enumerate(xs):
+        for i, x in enumerate(self.hatches, 1):
             x.place(relx=i / n, rely=0, relwidth=1 / n, relheight=1)
 
+        if self.hatches and not self.master.visible:
+            # not measured until the node is shown, indexed where they will be laid out
+            for hatch in self.hatches:
+                hatch.rect_offset = None
+                hatch.reindex()
+
         self.update_hatches()
 
 
@@ -1291,39 +2405,57 @@ class Hatch(Position, BetterFrame):
         self.master: "HatchBar"
 
         self.description = tk.StringVar()
-        self.label = tk.Label(self, textvariable=self.description)
+        self.label: Optional[tk.Label] = None
 
-        self.label.configure(background=Hatch.DISCONNECTED)
         self.configure(background=Hatch.DISCONNECTED)
-        
-        self.label.pack(expand=1, fill="both")
 
         self.node: Hatches = master.master
         self.item_name = ""
         self.item_id   = ""
+        self.is_input = is_input
 
         if item_id is not None:
             self.set_item(item_id)
-
-        self.is_input = is_input
         self.connections: List[Hatch] = []
 
         self.d_connections = {}
+        # offset of the line anchor from the node position, in unscaled canvas units (see NodeCanvas.hatch_anchor)
+        self.anchor_offset: Optional[Tuple[float, float]] = None
+        # likewise, the bounding box relative to the node position
+        self.rect_offset: Optional[Rect] = None
 
         self.configure(highlightcolor="#00AAFF")
+        self.bind("<Configure>", lambda e: self.measure())
 
     
         for e in MOUSE_EVENTS:
             self.bind(e, lambda e: self.globalstate.gesture_manager.on_event(e, self))
-            self.label.bind(e, lambda e: self.globalstate.gesture_manager.on_event(e, self))
 
         self.bind("<Delete>", lambda e: self.master.remove_hatch(self))
 
+        if self.node.built:
+            self.build()
+
+    def build(self):
+        self.label = tk.Label(self, textvariable=self.description, background=self.cget("background"))
+        self.label.pack(expand=1, fill="both")
+
+        for e in MOUSE_EVENTS:
+            self.label.bind(e, lambda e: self.globalstate.gesture_manager.on_event(e, self))
+
+    def set_background(self, colour):
+        self.configure(background=colour)
+        if self.label is not None:
+            self.label.configure(background=colour)
+
     def update_scale(self):
-        self.label.configure(font=("Segoe UI",  int(1 + 8 * self.globalstate.scale)))
+        if self.label is not None:
+            self.label.configure(font=("Segoe UI",  int(1 + 8 * self.globalstate.scale)))
 
     def remove(self):
         self.disconnect_all()
+        self.globalstate.master.hatch_index.remove(self)
+        self.globalstate.master.unindex_item(self)
         self.destroy()
 
     def encode(self, hatch_tl: Dict["Hatch", Tuple[int, bool, int]]):
@@ -1337,11 +2469,19 @@ class Hatch(Position, BetterFrame):
     
     def set_item(self, item_id):
         # , item_name):
+        canvas = self.globalstate.master
+
+        canvas.unindex_item(self)
         self.item_id = item_id
+        canvas.index_item(self)
+
         self.item_name = self.globalstate.item_name(item_id)
         self.description.set(self.item_name)
+        canvas.changed()
 
-    def tie(self, canvas: "NodeCanvas", nodes: List["NodeFrame"]):
+    def ties(self, nodes: List["NodeFrame"]) -> List[Tuple["Hatch", "Hatch"]]:
+        """The connections stored by decode, between this hatch and the hatches of `nodes`"""
+        pairs = []
         for [i, x, j] in self.d_connections:
             i: int
             x: bool
@@ -1349,11 +2489,13 @@ class Hatch(Position, BetterFrame):
 
             node = nodes[i]
             hatchbar = node.output_hatches if x else node.input_hatches
-            canvas.connect(self, hatchbar.hatches[j])
+            pairs.append((self, hatchbar.hatches[j]))
+
+        return pairs
 
     # TODO low: def revalidate(self): invalid hatches get marked red
 
-    def connect(self, target: "Hatch"):        
+    def connect(self, target: "Hatch", recolour=True):        
         if bool(self.item_name) > bool(target.item_name):
             target.set_item(self.item_id)
         elif bool(self.item_name) < bool(target.item_name):
@@ -1364,10 +2506,10 @@ class Hatch(Position, BetterFrame):
 
         if target not in self.connections:
             self.connections.append(target)
+            self.set_background(Hatch.CONNECTED)
 
-            self.label.configure(background=Hatch.CONNECTED)
-            self.configure(background=Hatch.CONNECTED)
-            self.master.update_colour()
+            if recolour:
+                self.master.update_colour()
 
         return True
 
@@ -1376,8 +2518,7 @@ class Hatch(Position, BetterFrame):
             self.connections.remove(target)
 
             if not self.connections:    
-                self.label.configure(background=Hatch.DISCONNECTED)
-                self.configure(background=Hatch.DISCONNECTED)
+                self.set_background(Hatch.DISCONNECTED)
                 self.master.update_colour()
 
     def disconnect_all(self):
@@ -1393,7 +2534,12 @@ class Hatch(Position, BetterFrame):
 
         try:
             item_id = self.globalstate.itemlist[item_name][0] # TODO low: lol
-            self.set_item(item_id) # bit inefficient but ok
+            canvas = self.globalstate.master
+            i, x, j = canvas.address(self)
+            before = canvas.encode_node(self.node)
+
+            with canvas.recorded({"op": "item", "index": i, "output": x, "slot": j, "item_id": item_id, "before": before}):
+                self.set_item(item_id) # bit inefficient but ok
         except:
             print("Warning:", item_name, "is an invalid item name")
 
@@ -1404,16 +2550,51 @@ class Hatch(Position, BetterFrame):
         for c in self.connections:
             self.globalstate.master.update_connection(self, c)
 
+    def reindex(self):
+        x, y = self.node.pos
+        x0, y0, x1, y1 = self.rect_offset if self.rect_offset is not None else self.node.hatch_rect(self)
+        self.globalstate.master.hatch_index.move(self, (x + x0, y + y0, x + x1, y + y1))
+
+    def connection_objects(self) -> List[Connection]:
+        canvas = self.globalstate.master
+        return [canvas.connections[self][c] for c in self.connections]
+
+    def measure(self):
+        # only called when the geometry actually changed, so the lines can be drawn without asking Tk
+        if not self.node.visible:
+            return
+
+        bar = self.master
+        x = bar.winfo_x() + self.winfo_x()
+        y = bar.winfo_y() + self.winfo_y()
+        w, h = self.winfo_width(), self.winfo_height()
 
-def main():
-    root = tk.Tk()
+        s = self.globalstate.scale
+        self.anchor_offset = (x + w // 2) / s, (y + h) / s
+        self.rect_offset = x / s, y / s, (x + w) / s, (y + h) / s
+        self.reindex()
 
-    the_canvas = NodeCanvas(root)
+        if self.connections:
+            self.globalstate.master.schedule_lines(self.connection_objects())
+
+
+def main(mainloop=True):
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    with instrumentation.active.timer("startup.tk"):
+        root = tk.Tk()
+
+    with instrumentation.active.timer("startup.canvas"):
+        the_canvas = NodeCanvas(root)
 
     root.protocol("WM_DELETE_WINDOW", the_canvas.on_closing)
     root.geometry("1080x1080+0+0")
+
+    with instrumentation.active.timer("startup.first frame"):
+        root.update()
     
-    root.mainloop()
+    if mainloop:
+        root.mainloop()
 
     return root, the_canvas
 
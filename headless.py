@@ -0,0 +1,310 @@
+"""headless.py
+
+Solves line files (as saved by gui.py, e.g. presets/*.json) without a display.
+
+    python headless.py presets/*.json --json --jobs 4
+"""
+
+import argparse
+import json
+import os
+import sys
+
+from multiprocessing import Pool
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import lineformat
+from recipes import Recipes, database_digest
+import instrumentation
+from throughput import TIERS, Buffer, Node, Step, make_groups, powerTier
+from tscca import circuits
+
+
+def hatch_item(d_hatch: Dict[str, Any]) -> str:
+    # older line files (see example_line.json) use "id" instead of "item_id"
+    return d_hatch["item_id"] if "item_id" in d_hatch else d_hatch["id"]
+
+
+def load_line(path: str) -> List[Dict[str, Any]]:
+    """The nodes of a line file of either version, see lineformat.py"""
+    return lineformat.read(path)[1]
+
+
+def build_line(canvas: Iterable[Dict[str, Any]], recipes: Recipes, keep: Optional[List[Dict[str, Any]]]=None) -> List[Node]:
+    """The headless counterpart of NodeFrame.reconstruct and NodeFrame.reconstruct_reconnect. Goes over canvas
+    once, so it can be a stream of nodes (see lineformat.iter_nodes); the type, machine, recipe and rate of
+    every node are appended to keep, which is all summarise and export.py need"""
+    models: List[Node] = []
+    # per node, (item, node) for its inputs and outputs; the nodes connected to might come later
+    links: List[Tuple[List[Tuple[str, int]], List[Tuple[str, int]]]] = []
+
+    for d_node in canvas:
+        if d_node["type"] == "step":
+            if d_node["recipe"] is None:
+                raise RuntimeError("Can't reconstruct when recipe is unspecified")
+
+            models.append(Step(recipes.recipe_by_id(d_node["machine"], d_node["recipe"])))
+        elif d_node["type"] == "buffer":
+            models.append(Buffer("AE"))
+        else:
+            raise RuntimeError(f"Unknown node type {d_node['type']}")
+
+        links.append(( [(hatch_item(d_hatch), i) for d_hatch in d_node["inputs"] for [i, _, _] in d_hatch["connections"]]
+                     , [(hatch_item(d_hatch), i) for d_hatch in d_node["outputs"] for [i, _, _] in d_hatch["connections"]] ))
+
+        if keep is not None:
+            keep.append({key: d_node.get(key) for key in ("type", "machine", "recipe", "rate")})
+
+    for model, (pulls, pushes) in zip(models, links):
+        for item, i in pulls:
+            model.pull.setdefault(item, []).append(models[i])
+
+        for item, i in pushes:
+            model.push.setdefault(item, []).append(models[i])
+
+    return models
+
+
+def default_root(canvas: List[Dict[str, Any]]) -> int:
+    for i, d_node in enumerate(canvas):
+        if d_node["type"] == "step" and d_node["rate"]:
+            return i
+
+    raise RuntimeError("No step with a stored rate to propagate from")
+
+
+def propagate_line(models: List[Node], root: int, rate: float):
+    make_groups(circuits(models))
+
+    Buffer.global_reset()
+
+    step = models[root]
+    if not isinstance(step, Step):
+        raise RuntimeError(f"Node {root} is not a step")
+
+    step.propagate(rate=rate)
+
+
+def solve_line(canvas: List[Dict[str, Any]], recipes: Recipes, root: Optional[int]=None) -> List[Node]:
+    """Propagates the stored rate of step `root` (like "Propagate from here") through the line"""
+    if root is None:
+        root = default_root(canvas)
+
+    models = build_line(canvas, recipes)
+    propagate_line(models, root, canvas[root]["rate"])
+
+    return models
+
+
+def step_power(step: Step):
+    # see StepFrame.validate_rate
+    eut = step.recipe.power * step.rate
+    _, tier = powerTier(eut)
+    _, min_tier = powerTier(step.recipe.power)
+
+    return eut, 32 * (4 ** max(tier, min_tier))
+
+
+def summarise(canvas: List[Dict[str, Any]], models: List[Node], recipes: Recipes, root: int, rows=True) -> Dict[str, Any]:
+    """The power, net flows and machine counts of a solved line; with rows also a row per step and buffer"""
+    steps = []
+    buffers = []
+    machines: Dict[str, int] = {}
+    eut = surge_eut = 0.0
+
+    for i, (d_node, model) in enumerate(zip(canvas, models)):
+        if isinstance(model, Step):
+            eut_, surge_eut_ = step_power(model)
+            eut += eut_
+            surge_eut += surge_eut_
+            machines[d_node["machine"]] = 1 + machines.get(d_node["machine"], 0)
+
+            if not rows:
+                continue
+
+            steps.append({ "node": i
+                         , "machine": d_node["machine"]
+                         , "recipe": d_node["recipe"]
+                         , "rate": model.rate
+                         , "stored_rate": d_node["rate"]
+                         , "eut": eut_ })
+        elif rows:
+            buffers.append({ "node": i
+                           , "flow": dict(model.flow) })
+
+    amps, tier = powerTier(eut)
+    surge_amps, surge_tier = powerTier(surge_eut)
+
+    flows = sorted((flow, item) for item, flow in Buffer.global_flow.items())
+
+    result = { "root": root
+             , "power": { "eut": eut, "amps": amps, "tier": TIERS[tier]
+                        , "surge_eut": surge_eut, "surge_amps": surge_amps, "surge_tier": TIERS[surge_tier] }
+             , "flows": [{"item": item, "name": recipes.item_name(item), "flow": flow} for flow, item in flows]
+             , "machines": machines }
+
+    if rows:
+        result["steps"] = steps
+        result["buffers"] = buffers
+
+    return result
+
+
+_recipes: Optional[Recipes] = None
+
+def _init_worker():
+    global _recipes
+    _recipes = Recipes()
+
+
+def solve_file(path: str, root: Optional[int]=None, instrument=False, export: Optional[str]=None, fmt="csv") -> Dict[str, Any]:
+    """Solves one line file; with `instrument` the solver records end up in result["instrumentation"],
+    with `export` the result tables are written to that directory (see export.py) instead of
+    result["steps"] and result["buffers"], and the line is read one node at a time"""
+    if _recipes is None:
+        _init_worker()
+
+    assert _recipes is not None
+
+    if instrument:
+        sink = instrumentation.MemorySink()
+        instrumentation.enable(sink)
+
+    try:
+        if export is None:
+            canvas = load_line(path)
+            root_ = default_root(canvas) if root is None else root
+            models = solve_line(canvas, _recipes, root_)
+            result = summarise(canvas, models, _recipes, root_)
+        else:
+            import export as export_
+
+            # only what the tables need is kept of the nodes
+            nodes: List[Dict[str, Any]] = []
+            models = build_line(lineformat.iter_nodes(path), _recipes, keep=nodes)
+            root_ = default_root(nodes) if root is None else root
+            propagate_line(models, root_, nodes[root_]["rate"])
+            result = summarise(nodes, models, _recipes, root_, rows=False)
+
+            prefix = os.path.join(export, os.path.splitext(os.path.basename(path))[0])
+            # the rows are generated from the models as they are written
+            result["exported"] = export_.export(prefix, fmt, nodes, models, Buffer.global_flow, _recipes.item_name)
+    except (OSError, ValueError, KeyError, IndexError, RuntimeError, RecursionError) as exc:
+        result = {"error": f"{type(exc).__name__}: {exc}"}
+    finally:
+        if instrument:
+            instrumentation.disable()
+
+    result["file"] = path
+
+    if instrument:
+        result["instrumentation"] = sink.records
+
+    return result
+
+
+def solve_files(paths: List[str], root: Optional[int]=None, jobs: Optional[int]=None, instrument=False, export: Optional[str]=None, fmt="csv"):
+    """Yields the results of solve_file in order, over a process pool if there is more than one file"""
+    jobs = min(jobs or os.cpu_count() or 1, len(paths))
+
+    if jobs <= 1:
+        for path in paths:
+            yield solve_file(path, root, instrument, export, fmt)
+    else:
+        with Pool(jobs, initializer=_init_worker) as pool:
+            yield from pool.imap(_solve_file_star, [(path, root, instrument, export, fmt) for path in paths])
+
+
+def _solve_file_star(args):
+    return solve_file(*args)
+
+
+def print_result(result: Dict[str, Any], fp=sys.stdout):
+    print(result["file"], file=fp)
+
+    if "error" in result:
+        print(f"  failed: {result['error']}", file=fp)
+        print(file=fp)
+        return
+
+    power = result["power"]
+    print(f"Power usage: {power['eut']:.1f} ({power['amps']:.1f} {power['tier']})", file=fp)
+    print(f"Surge usage: {power['surge_eut']:.1f} ({power['surge_amps']:.1f} {power['surge_tier']})", file=fp)
+
+    for flow in result["flows"]:
+        if abs(flow["flow"]) < 1e-10:
+            print(f"{flow['name']}: Neutral?", file=fp)
+        else:
+            print(f"{flow['name']}: {flow['flow']}", file=fp)
+
+    print("Summary:", file=fp)
+    for machine, num in result["machines"].items():
+        print(f"{num:>3}x {machine}", file=fp)
+    print(file=fp)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Solve line files without the GUI")
+    parser.add_argument("files", nargs="+", help="line files, e.g. presets/*.json")
+    parser.add_argument("--root", type=int, default=None, help="index of the step to propagate from (default: the first step with a rate)")
+    parser.add_argument("--jobs", "-j", type=int, default=None, help="number of worker processes (default: one per cpu)")
+    parser.add_argument("--json", action="store_true", help="emit one JSON object per file (JSON lines)")
+    parser.add_argument("--trace", default=None, help="append the solver instrumentation records to this JSON lines file")
+    parser.add_argument("--stats", action="store_true", help="print a summary of the solver instrumentation to stderr")
+    parser.add_argument("--memory", action="store_true", help="solve in this process and print a memory report of the recipe database to stderr")
+    parser.add_argument("--export", default=None, metavar="DIR", help="write the steps, buffers, flows and machines of every file as tables to this directory (--json then leaves out the steps and buffers)")
+    parser.add_argument("--format", default="csv", choices=("csv", "jsonl", "parquet"), help="table format for --export (default: csv, parquet needs pyarrow)")
+    args = parser.parse_args(argv)
+
+    try:
+        # before any worker starts, a pool whose initializer fails would restart it forever
+        database_digest()
+    except FileNotFoundError as exc:
+        print(f"Cannot solve: {exc}", file=sys.stderr)
+        return 1
+
+    if args.export:
+        os.makedirs(args.export, exist_ok=True)
+
+    instrument = bool(args.trace or args.stats)
+    trace = instrumentation.JsonLinesSink.open(args.trace) if args.trace else None
+    stats = instrumentation.MemorySink()
+
+    failed = 0
+    jobs = 1 if args.memory else args.jobs
+    try:
+        for result in solve_files(args.files, args.root, jobs, instrument, args.export, args.format):
+            failed += "error" in result
+
+            for record in result.pop("instrumentation", []):
+                record["file"] = result["file"]
+                stats.emit(record)
+
+                if trace:
+                    trace.emit(record)
+
+            if args.json:
+                print(json.dumps(result))
+            else:
+                print_result(result)
+    except FileNotFoundError as exc:
+        # the recipe cache is there but cannot be used, and recipes.json is not
+        print(f"Cannot solve: {exc}", file=sys.stderr)
+        return 1
+
+    if trace:
+        trace.close()
+
+    if args.stats:
+        for (kind, name), s in sorted(stats.summary().items()):
+            print(f"{kind:<8} {name:<16} n={s['count']:<6} total={s['total']:.6g} max={s['max']:.6g}", file=sys.stderr)
+
+    if args.memory and _recipes is not None:
+        import memreport
+        print(memreport.format_report(memreport.report(_recipes)), file=sys.stderr)
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,250 @@
+"""instrumentation.py
+
+Timers and counters for the solver. Disabled by default; while disabled every
+probe is a no-op, so the hot paths pay at most an attribute lookup and a call,
+and methods decorated with nested are not wrapped at all.
+
+    import instrumentation
+    sink = instrumentation.MemorySink()
+    instrumentation.enable(sink)
+    ...
+    instrumentation.active.flush()
+    print(sink.records)
+"""
+
+import functools
+import json
+import logging
+import time
+
+from abc import ABC, abstractmethod
+from typing import Any, Callable, Dict, List, Optional, TextIO, Tuple
+
+
+Record = Dict[str, Any]
+
+
+class Sink(ABC):
+    @abstractmethod
+    def emit(self, record: Record):
+        ...
+
+    def close(self):
+        pass
+
+
+class MemorySink(Sink):
+    def __init__(self):
+        self.records: List[Record] = []
+
+    def emit(self, record: Record):
+        self.records.append(record)
+
+    def summary(self) -> Dict[Tuple[str, str], Dict[str, float]]:
+        """Aggregates the records by (kind, name): count, total and max of the values"""
+        summary: Dict[Tuple[str, str], Dict[str, float]] = {}
+
+        for record in self.records:
+            key = record["kind"], record["name"]
+            s = summary.setdefault(key, {"count": 0, "total": 0.0, "max": float("-inf")})
+            s["count"] += 1
+            s["total"] += record["value"]
+            s["max"] = max(s["max"], record["value"])
+
+        return summary
+
+
+class LoggingSink(Sink):
+    def __init__(self, logger: Optional[logging.Logger]=None, level=logging.INFO):
+        self.logger = logger if logger else logging.getLogger("procline.instrumentation")
+        self.level = level
+
+    def emit(self, record: Record):
+        fields = " ".join(f"{k}={v}" for k, v in record.items() if k not in ("kind", "name", "value"))
+        self.logger.log(self.level, "%s %s %s %s", record["kind"], record["name"], record["value"], fields)
+
+
+class JsonLinesSink(Sink):
+    def __init__(self, fp: TextIO):
+        self.fp = fp
+
+    @classmethod
+    def open(cls, path: str) -> "JsonLinesSink":
+        return cls(open(path, mode="a", encoding="utf-8"))
+
+    def emit(self, record: Record):
+        self.fp.write(json.dumps(record) + "\n")
+
+    def close(self):
+        self.fp.close()
+
+
+class _Timer:
+    __slots__ = ("instrument", "name", "fields", "start")
+
+    def __init__(self, instrument: "Instrument", name: str, fields: Dict[str, Any]):
+        self.instrument = instrument
+        self.name = name
+        self.fields = fields
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *_):
+        self.instrument.emit("timer", self.name, time.perf_counter() - self.start, **self.fields)
+
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        pass
+
+
+NULL_TIMER = _NullTimer()
+
+
+class Instrument:
+    enabled = True
+
+    def __init__(self, sink: Sink):
+        self.sink = sink
+        self.counters: Dict[str, int] = {}
+        self.depth: Dict[str, int] = {}
+        self.max_depth: Dict[str, int] = {}
+
+    def emit(self, kind: str, name: str, value: float, **fields):
+        record = {"kind": kind, "name": name, "value": value, "t": time.time()}
+        record.update(fields)
+        self.sink.emit(record)
+
+    def timer(self, name: str, **fields):
+        return _Timer(self, name, fields)
+
+    def count(self, name: str, n: int=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def value(self, name: str, value: float, **fields):
+        self.emit("value", name, value, **fields)
+
+    def enter(self, name: str):
+        depth = self.depth[name] = self.depth.get(name, 0) + 1
+        if depth > self.max_depth.get(name, 0):
+            self.max_depth[name] = depth
+
+    def leave(self, name: str):
+        self.depth[name] -= 1
+
+    def flush(self):
+        """Emits (and resets) the counters and the maximal depths reached since the last flush"""
+        for name, n in self.counters.items():
+            self.emit("counter", name, n)
+
+        for name, depth in self.max_depth.items():
+            self.emit("depth", name, depth)
+
+        self.counters = {}
+        self.max_depth = {}
+
+
+class Disabled:
+    enabled = False
+
+    def timer(self, name: str, **fields):
+        return NULL_TIMER
+
+    def count(self, name: str, n: int=1):
+        pass
+
+    def value(self, name: str, value: float, **fields):
+        pass
+
+    def enter(self, name: str):
+        pass
+
+    def leave(self, name: str):
+        pass
+
+    def flush(self):
+        pass
+
+
+active: Any = Disabled()
+
+
+def enable(sink: Sink) -> Instrument:
+    global active
+    active = Instrument(sink)
+    _swap_nested(True)
+    return active
+
+
+def disable():
+    global active
+    active.flush()
+
+    if isinstance(active, Instrument):
+        active.sink.close()
+
+    active = Disabled()
+    _swap_nested(False)
+
+
+def timed(name: str):
+    """Decorator: time every call of the function"""
+    def decorator(f):
+        @functools.wraps(f)
+        def wrapper(*args, **kwargs):
+            if not active.enabled:
+                return f(*args, **kwargs)
+
+            with active.timer(name):
+                return f(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class _Nested:
+    """A method decorated with nested: the class gets the undecorated method while instrumentation is
+    disabled, enable and disable swap the counting one in and out"""
+
+    def __init__(self, name: str, f: Callable):
+        self.name = name
+        self.f = f
+
+    def __set_name__(self, owner: type, attr: str):
+        f, name = self.f, self.name
+
+        @functools.wraps(f)
+        def wrapper(*args, **kwargs):
+            active.count(name)
+            active.enter(name)
+            try:
+                return f(*args, **kwargs)
+            finally:
+                active.leave(name)
+
+        _nested.append((owner, attr, f, wrapper))
+        setattr(owner, attr, wrapper if active.enabled else f)
+
+
+# (class, attribute, method, counting method) of every nested method
+_nested: List[Tuple[type, str, Callable, Callable]] = []
+
+
+def _swap_nested(enabled: bool):
+    for owner, attr, f, wrapper in _nested:
+        setattr(owner, attr, wrapper if enabled else f)
+
+
+def nested(name: str):
+    """Decorator for methods: count the calls of a recursive method and track its recursion depth,
+    at no cost at all while disabled"""
+    def decorator(f):
+        return _Nested(name, f)
+    return decorator
@@ -0,0 +1,117 @@
+"""journal.py
+
+Autosave for the canvas. Every edit is appended to a journal as a small JSON
+record, and every so often the journal is compacted into a snapshot of the
+whole line (a line file, see lineformat.py) that is written next to it and
+atomically renamed into place. On startup the snapshot is loaded and the
+journal records newer than it are replayed on top.
+
+All file access happens on a writer thread, so neither edits nor snapshots
+wait for the disk.
+"""
+
+import json
+import os
+import queue
+import threading
+
+from typing import Any, Dict, List, Optional, Tuple
+
+import lineformat
+
+
+Record = Dict[str, Any]
+
+
+def journal_path(path: str) -> str:
+    return path + ".journal"
+
+
+def read(path: str) -> Tuple[Optional[Dict[str, Any]], List[Record]]:
+    """The snapshot at path (None if there is none) and the journal records that came after it"""
+    snapshot = None
+    try:
+        header, canvas = lineformat.read(path)
+        snapshot = dict(header, canvas=canvas)
+    except OSError:
+        pass
+
+    seq = snapshot.get("seq", 0) if snapshot else 0
+    records = []
+
+    try:
+        with open(journal_path(path), mode="r", encoding="utf-8") as fp:
+            for line in fp:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # the tail of a journal that was being written during a crash
+                    break
+
+                if record["seq"] > seq:
+                    records.append(record)
+    except OSError:
+        pass
+
+    return snapshot, records
+
+
+class Journal:
+    def __init__(self, path: str, seq=0):
+        self.path = path
+        # sequence number of the last record, snapshots store the one they include
+        self.seq = seq
+        self.since_snapshot = 0
+
+        self.queue: "queue.Queue[Optional[Tuple[str, Dict[str, Any]]]]" = queue.Queue()
+        self.thread = threading.Thread(target=self.run, name="journal", daemon=True)
+        self.thread.start()
+
+    def append(self, record: Record):
+        self.seq += 1
+        self.since_snapshot += 1
+        self.queue.put(("record", dict(record, seq=self.seq)))
+
+    def snapshot(self, line: Dict[str, Any]):
+        """Queues line (as NodeCanvas.encode returns it) to replace the snapshot and the journal so far"""
+        self.since_snapshot = 0
+        self.queue.put(("snapshot", dict(line, seq=self.seq)))
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+
+    def run(self):
+        fp = open(journal_path(self.path), mode="a", encoding="utf-8")
+
+        while True:
+            item = self.queue.get()
+
+            if item is None:
+                break
+
+            kind, data = item
+
+            if kind == "record":
+                fp.write(json.dumps(data) + "\n")
+            else:
+                self.write_snapshot(data)
+
+                # everything up to here is in the snapshot
+                fp.close()
+                fp = open(journal_path(self.path), mode="w", encoding="utf-8")
+
+            if self.queue.empty():
+                fp.flush()
+
+        fp.close()
+
+    def write_snapshot(self, line: Dict[str, Any]):
+        tmp = self.path + ".tmp"
+
+        with open(tmp, mode="w", encoding="utf-8") as fp:
+            lineformat.dump(fp, line["canvas"], seq=line["seq"])
+            fp.flush()
+            os.fsync(fp.fileno())
+
+        os.replace(tmp, self.path)
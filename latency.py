@@ -0,0 +1,117 @@
+"""latency.py
+
+Opt-in latency measurements for the gesture pipeline of the canvas: the time
+spent in the handler of each gesture, how long its event waited in the Tk
+queue, and the time of the redraws deferred to a later frame.
+
+The queue delay compares the event timestamp (milliseconds on the clock of the
+window system) with our clock; the offset between the two is calibrated as the
+smallest difference seen so far, i.e. assuming the fastest event waited about 0 ms.
+"""
+
+import statistics
+import time
+
+from collections import deque
+from typing import Deque, Dict, List, Optional
+
+import instrumentation
+from instrumentation import Record
+
+
+# upper bounds of the histogram buckets in ms, the last bucket is everything above
+BUCKETS_MS = (2, 4, 8, 16, 33, 66, 133)
+
+
+class _LatencyTimer:
+    __slots__ = ("monitor", "kind", "name", "queue", "start")
+
+    def __init__(self, monitor: "LatencyMonitor", kind: str, name: str, queue: float):
+        self.monitor = monitor
+        self.kind = kind
+        self.name = name
+        self.queue = queue
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *_):
+        self.monitor.record(self.kind, self.name, time.perf_counter() - self.start, self.queue)
+
+
+class LatencyMonitor:
+    # records kept for the trace
+    KEEP = 100000
+    # seconds of records summarised by the overlay
+    WINDOW = 2.0
+
+    def __init__(self):
+        self.records: Deque[Record] = deque(maxlen=self.KEEP)
+        # ms, our clock minus the event clock
+        self.offset: Optional[float] = None
+
+    def queue_delay(self, event_time: int) -> float:
+        """Seconds between the event with this timestamp (e.time) happening and now"""
+        now = time.monotonic() * 1000
+        delay = now - event_time - self.offset if self.offset is not None else -1
+
+        if delay < 0 or delay > 60000:
+            # first event, a faster one than before, or the event clock wrapped around
+            self.offset = now - event_time
+            return 0.0
+
+        return delay / 1000
+
+    def timer(self, kind: str, name: str, queue=0.0) -> _LatencyTimer:
+        return _LatencyTimer(self, kind, name, queue)
+
+    def record(self, kind: str, name: str, handler: float, queue=0.0):
+        self.records.append({"kind": kind, "name": name, "value": handler, "queue": queue, "t": time.monotonic()})
+
+    def recent(self) -> List[Record]:
+        since = time.monotonic() - self.WINDOW
+        recent = []
+
+        for record in reversed(self.records):
+            if record["t"] < since:
+                break
+            recent.append(record)
+
+        recent.reverse()
+        return recent
+
+    def summary(self) -> str:
+        """The text of the overlay: latency (queue + handler) per gesture and redraw, and a histogram"""
+        recent = self.recent()
+
+        by_name: Dict[str, List[float]] = {}
+        for record in recent:
+            by_name.setdefault(f"{record['kind']} {record['name']}", []).append(1000 * (record["value"] + record["queue"]))
+
+        lines = [f"{'last ' + str(self.WINDOW) + ' s':<28} {'n':>4} {'p50':>6} {'p95':>6} {'max':>6}"]
+        for name, ms in sorted(by_name.items()):
+            p95 = statistics.quantiles(ms, n=20, method="inclusive")[-1] if len(ms) > 1 else ms[0]
+            lines.append(f"{name[:28]:<28} {len(ms):>4} {statistics.median(ms):>6.1f} {p95:>6.1f} {max(ms):>6.1f}")
+
+        counts = [0] * (len(BUCKETS_MS) + 1)
+        for ms in (1000 * (record["value"] + record["queue"]) for record in recent):
+            counts[next((i for i, bound in enumerate(BUCKETS_MS) if ms <= bound), len(BUCKETS_MS))] += 1
+
+        most = max(counts) or 1
+        lines.append("")
+        for i, count in enumerate(counts):
+            label = f"<= {BUCKETS_MS[i]} ms" if i < len(BUCKETS_MS) else f" > {BUCKETS_MS[-1]} ms"
+            lines.append(f"{label:>10} {'#' * round(20 * count / most):<20} {count}")
+
+        return "\n".join(lines)
+
+    def dump(self, path: str):
+        """Appends all kept records to a JSON lines file"""
+        sink = instrumentation.JsonLinesSink.open(path)
+        try:
+            for record in self.records:
+                sink.emit(record)
+        finally:
+            sink.close()
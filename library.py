@@ -0,0 +1,164 @@
+"""library.py
+
+An index of the preset line files: per file the number of nodes, the machines,
+and the items it takes in and puts out (its buffers and loose hatches). The index
+is kept in a manifest next to the presets and a file is only read again when its
+size or modification time changed, so searching does not parse the presets.
+
+    library = Library("presets")
+    for entry in library.search("polyethylene chemical"):
+        print(entry["file"], entry["nodes"])
+"""
+
+import argparse
+import json
+import os
+
+from typing import Any, Dict, List, Optional
+
+import lineformat
+
+
+MANIFEST_FN = ".manifest.json"
+# bump when the entries change shape
+MANIFEST_VERSION = 1
+
+Entry = Dict[str, Any]
+
+
+def is_preset(fn: str) -> bool:
+    return not fn.startswith(".") and (fn.endswith(".json") or fn.endswith(".json.gz"))
+
+
+def index_file(path: str) -> Entry:
+    """The manifest entry of a line file, without the stat fields"""
+    nodes = 0
+    machines: Dict[str, int] = {}
+    # item -> name, for what goes into and comes out of the line
+    consumes: Dict[str, str] = {}
+    produces: Dict[str, str] = {}
+
+    for d_node in lineformat.iter_nodes(path):
+        nodes += 1
+
+        if d_node["type"] == "step" and d_node.get("machine"):
+            machines[d_node["machine"]] = 1 + machines.get(d_node["machine"], 0)
+
+        for key in ("inputs", "outputs"):
+            for d_hatch in d_node[key]:
+                item_id, item_name = lineformat.hatch_item(d_hatch)
+
+                if not item_id:
+                    continue
+
+                if d_node["type"] == "buffer":
+                    # buffers are where the line starts and ends
+                    (produces if key == "inputs" else consumes)[item_id] = item_name
+                elif not d_hatch["connections"]:
+                    (consumes if key == "inputs" else produces)[item_id] = item_name
+
+    # items buffered on the way are neither
+    through = consumes.keys() & produces.keys()
+
+    return { "nodes": nodes
+           , "machines": machines
+           , "consumes": sorted(item for item in consumes.items() if item[0] not in through)
+           , "produces": sorted(item for item in produces.items() if item[0] not in through) }
+
+
+class Library:
+    def __init__(self, directory="presets"):
+        self.directory = directory
+        self.manifest_path = os.path.join(directory, MANIFEST_FN)
+
+        self.entries: List[Entry] = []
+        # lowercased text searched per entry
+        self.haystacks: List[str] = []
+
+        self.refresh()
+
+    def read_manifest(self) -> Dict[str, Entry]:
+        try:
+            with open(self.manifest_path, mode="r", encoding="utf-8") as fp:
+                manifest = json.load(fp)
+        except (OSError, ValueError):
+            return {}
+
+        if manifest.get("version") != MANIFEST_VERSION:
+            return {}
+
+        return {entry["file"]: entry for entry in manifest["entries"]}
+
+    def refresh(self):
+        """Re-indexes the presets that are new or changed since the manifest was written"""
+        known = self.read_manifest()
+        entries = []
+        changed = False
+
+        for fn in sorted(os.listdir(self.directory)):
+            path = os.path.join(self.directory, fn)
+            if not is_preset(fn) or not os.path.isfile(path):
+                continue
+
+            stat = os.stat(path)
+            entry = known.pop(fn, None)
+
+            if entry is None or entry["mtime"] != stat.st_mtime or entry["size"] != stat.st_size:
+                try:
+                    entry = dict(index_file(path), file=fn, mtime=stat.st_mtime, size=stat.st_size)
+                except (OSError, ValueError, KeyError) as exc:
+                    print(f"Warning: skipping preset {fn}: {exc}")
+                    continue
+
+                changed = True
+
+            entries.append(entry)
+
+        # known now only holds presets that were removed
+        if changed or known:
+            try:
+                with open(self.manifest_path, mode="w", encoding="utf-8") as fp:
+                    json.dump({"version": MANIFEST_VERSION, "entries": entries}, fp)
+            except OSError as exc:
+                print(f"Warning: could not write {self.manifest_path}: {exc}")
+
+        self.entries = entries
+        self.haystacks = [self.haystack(entry) for entry in entries]
+
+    @staticmethod
+    def haystack(entry: Entry) -> str:
+        words = [entry["file"]] + list(entry["machines"])
+        for item_id, item_name in entry["consumes"] + entry["produces"]:
+            words += (item_id, item_name)
+
+        return "\n".join(words).lower()
+
+    def search(self, query="") -> List[Entry]:
+        """The entries matching every word of query, in the file, machine or item names"""
+        words = query.lower().split()
+
+        return [entry for entry, haystack in zip(self.entries, self.haystacks) if all(word in haystack for word in words)]
+
+    def path(self, entry: Entry) -> str:
+        return os.path.join(self.directory, entry["file"])
+
+
+def describe(entry: Entry) -> str:
+    machines = ", ".join(f"{n}x {machine}" for machine, n in sorted(entry["machines"].items(), key=lambda x: -x[1]))
+    produces = ", ".join(name or item_id for item_id, name in entry["produces"])
+
+    return f"{entry['file']}: {entry['nodes']} nodes; makes {produces or 'nothing'}; {machines}"
+
+
+def main(argv: Optional[List[str]]=None):
+    parser = argparse.ArgumentParser(description="Search the preset library")
+    parser.add_argument("query", nargs="*", help="words to look for in the file, machine and item names")
+    parser.add_argument("--directory", default="presets", help="preset directory (default: presets)")
+    args = parser.parse_args(argv)
+
+    for entry in Library(args.directory).search(" ".join(args.query)):
+        print(describe(entry))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+"""lineformat.py
+
+Reading and writing line files. Version 1 is a single JSON object, {"canvas": [node, ...]},
+with every hatch spelling out its item and its connections as [node, is_output, hatch].
+Version 2 is JSON lines: a header with the item table, then one line per node in which
+every hatch is a flat list of ints, [item, node, hatch, node, hatch, ...], where the
+hatch numbers carry is_output in their lowest bit. Either may be gzipped.
+
+    header, canvas = lineformat.read("presets/PBI.json")
+    lineformat.write("line.json.gz", canvas)
+
+Both return and take nodes in the version 1 layout, which is what the rest of the code uses.
+"""
+
+import argparse
+import gzip
+import json
+import time
+
+from typing import IO, Any, Dict, Iterator, List, Tuple
+
+
+VERSION = 2
+MAGIC = "procline"
+GZIP_MAGIC = b"\x1f\x8b"
+
+Node = Dict[str, Any]
+
+# written by encode, the rest of a header is up to the caller
+HEADER_KEYS = ("format", "version", "items", "nodes")
+
+
+def open_text(path: str) -> IO[str]:
+    """Opens path for reading, gzipped or not"""
+    with open(path, mode="rb") as fp:
+        compressed = fp.read(2) == GZIP_MAGIC
+
+    if compressed:
+        return gzip.open(path, mode="rt", encoding="utf-8")
+
+    return open(path, mode="r", encoding="utf-8")
+
+
+def read_header(fp: IO[str]) -> Tuple[Dict[str, Any], List[Node]]:
+    """The header of a line file, and for version 1 all of the nodes as well"""
+    first = fp.readline()
+
+    try:
+        header = json.loads(first)
+    except ValueError:
+        # version 1, usually indented over many lines
+        header = json.loads(first + fp.read())
+
+    if header.get("format") == MAGIC:
+        if header["version"] > VERSION:
+            raise ValueError(f"Line file version {header['version']} is newer than this program ({VERSION})")
+
+        return header, []
+
+    canvas = header.pop("canvas")
+    header["version"] = 1
+
+    return header, canvas
+
+
+def decode_node(d: Dict[str, Any], items: List[Dict[str, str]]) -> Node:
+    node = dict(d)
+
+    for key in ("inputs", "outputs"):
+        hatches = []
+        for packed in d[key]:
+            it = iter(packed)
+            hatch = dict(items[next(it)])
+            hatch["connections"] = [[i, j & 1 == 1, j >> 1] for i, j in zip(it, it)]
+            hatches.append(hatch)
+
+        node[key] = hatches
+
+    return node
+
+
+def item_table(header: Dict[str, Any]) -> List[Dict[str, str]]:
+    return [{"item_id": item_id, "item_name": item_name} for item_id, item_name in header["items"]]
+
+
+def iter_nodes(path: str) -> Iterator[Node]:
+    """The nodes of a line file in the version 1 layout, one at a time for version 2"""
+    with open_text(path) as fp:
+        header, canvas = read_header(fp)
+
+        if header["version"] == 1:
+            yield from canvas
+            return
+
+        items = item_table(header)
+        for line in fp:
+            if line.strip():
+                yield decode_node(json.loads(line), items)
+
+
+def read(path: str) -> Tuple[Dict[str, Any], List[Node]]:
+    """The header and the nodes of a line file of either version"""
+    with open_text(path) as fp:
+        header, canvas = read_header(fp)
+
+        if header["version"] == 1:
+            return header, canvas
+
+        items = item_table(header)
+        # one call into the parser for all of the nodes
+        nodes = json.loads("[" + ",".join(line for line in fp if line.strip()) + "]")
+
+        return header, [decode_node(d, items) for d in nodes]
+
+
+def hatch_item(d_hatch: Dict[str, Any]) -> Tuple[str, str]:
+    # older line files (see example_line.json) use "id" and "name"
+    if "item_id" in d_hatch:
+        return d_hatch["item_id"], d_hatch.get("item_name", "")
+
+    return d_hatch["id"], d_hatch.get("name", "")
+
+
+def encode(canvas: List[Node], **meta) -> Iterator[str]:
+    """The lines of the version 2 file of canvas, meta goes into the header"""
+    refs: Dict[Tuple[str, str], int] = {}
+    nodes = []
+
+    for node in canvas:
+        d = dict(node)
+
+        for key in ("inputs", "outputs"):
+            hatches = []
+            for d_hatch in node[key]:
+                packed = [refs.setdefault(hatch_item(d_hatch), len(refs))]
+                for i, is_output, j in d_hatch["connections"]:
+                    packed += (i, j << 1 | bool(is_output))
+
+                hatches.append(packed)
+
+            d[key] = hatches
+
+        nodes.append(d)
+
+    header = dict(meta, format=MAGIC, version=VERSION, items=[list(item) for item in refs], nodes=len(nodes))
+    yield json.dumps(header) + "\n"
+
+    for d in nodes:
+        yield json.dumps(d, separators=(",", ":")) + "\n"
+
+
+def dump(fp: IO[str], canvas: List[Node], **meta):
+    fp.writelines(encode(canvas, **meta))
+
+
+def write(path: str, canvas: List[Node], compress=None, **meta):
+    """Writes canvas as a version 2 file, gzipped if compress (by default: if path ends in .gz)"""
+    if compress is None:
+        compress = path.endswith(".gz")
+
+    if compress:
+        with gzip.open(path, mode="wt", encoding="utf-8") as fp:
+            dump(fp, canvas, **meta)
+    else:
+        with open(path, mode="w", encoding="utf-8") as fp:
+            dump(fp, canvas, **meta)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Convert line files to version 2")
+    parser.add_argument("src", help="line file of either version")
+    parser.add_argument("dst", help="version 2 line file to write")
+    parser.add_argument("--gzip", action="store_true", help="compress (default: if dst ends in .gz)")
+    args = parser.parse_args(argv)
+
+    t = time.perf_counter()
+    header, canvas = read(args.src)
+    t_read = time.perf_counter() - t
+
+    meta = {key: value for key, value in header.items() if key not in HEADER_KEYS}
+
+    t = time.perf_counter()
+    write(args.dst, canvas, compress=True if args.gzip else None, **meta)
+    t_write = time.perf_counter() - t
+
+    print(f"{len(canvas)} nodes, read {1000 * t_read:.1f} ms, written {1000 * t_write:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
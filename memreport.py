@@ -0,0 +1,148 @@
+"""memreport.py
+
+Where the memory of the recipe database goes: deep sizes of its structures,
+the proxies and Recipe objects alive in this session, and (when tracemalloc
+is tracing) the allocation sites.
+
+    python memreport.py --top 15
+"""
+
+import argparse
+import gc
+import sys
+import tracemalloc
+
+from types import FunctionType, ModuleType
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from dictproxy import DictProxy, ListProxy
+from recipes import Recipes
+from throughput import Recipe
+
+
+Report = Dict[str, Any]
+
+
+def deep_sizeof(obj: Any, seen: Optional[Set[int]]=None) -> int:
+    """The size of obj and everything reachable from it that is not in `seen` (which is updated)"""
+    if seen is None:
+        seen = set()
+
+    size = 0
+    stack = [obj]
+
+    while stack:
+        x = stack.pop()
+
+        if id(x) in seen or isinstance(x, (type, ModuleType, FunctionType)):
+            continue
+
+        seen.add(id(x))
+        size += sys.getsizeof(x)
+
+        if isinstance(x, dict):
+            stack.extend(x.keys())
+            stack.extend(x.values())
+        elif isinstance(x, (list, tuple, set, frozenset)):
+            stack.extend(x)
+        elif isinstance(x, (DictProxy, ListProxy)):
+            stack.append(x.obj)
+        elif hasattr(x, "__dict__"):
+            stack.append(x.__dict__)
+
+    return size
+
+
+def structures(recipes: Recipes) -> List[Tuple[str, Any]]:
+    # in order: everything after the raw tree is accounted exclusive of it
+    raw_tree = [recs.unwrap() if isinstance(recs, ListProxy) else recs for recs in recipes.recipes_by_machine.values()]
+
+    return [ ("raw tree", raw_tree)
+           , ("recipes_by_machine", recipes.recipes_by_machine)
+           , ("recipes_by_machine_by_input", recipes.recipes_by_machine_by_input)
+           , ("recipes_by_machine_by_output", recipes.recipes_by_machine_by_output)
+           , ("itemlist", recipes.itemlist)
+           , ("id_to_item", recipes.id_to_item) ]
+
+
+def live_objects(types: Iterable[type], seen: Set[int]) -> Dict[str, Dict[str, int]]:
+    """Count and size of the live instances of `types`, the size excluding what is in `seen` (which is updated)"""
+    live: Dict[str, Dict[str, int]] = {t.__name__: {"count": 0, "bytes": 0} for t in types}
+    types = tuple(types)
+
+    for obj in gc.get_objects():
+        if isinstance(obj, types):
+            entry = live[type(obj).__name__]
+            entry["count"] += 1
+            entry["bytes"] += deep_sizeof(obj, seen)
+
+    return live
+
+
+def report(recipes: Recipes, snapshot: Optional[tracemalloc.Snapshot]=None, top=10) -> Report:
+    # snapshot first, the bookkeeping below allocates a lot itself
+    if snapshot is None and tracemalloc.is_tracing():
+        snapshot = tracemalloc.take_snapshot()
+
+    seen: Set[int] = set()
+    sizes = []
+
+    for name, structure in structures(recipes):
+        total = deep_sizeof(structure)
+        exclusive = deep_sizeof(structure, seen)
+        sizes.append({"structure": name, "exclusive": exclusive, "total": total})
+
+    d: Report = { "structures": sizes
+                , "live": live_objects([DictProxy, ListProxy, Recipe], seen) }
+
+    if snapshot is not None:
+        stats = snapshot.statistics("lineno")
+        d["traced"] = sum(stat.size for stat in stats)
+        d["allocations"] = [ {"site": str(stat.traceback), "bytes": stat.size, "count": stat.count}
+                             for stat in stats[:top] ]
+
+    return d
+
+
+def mib(x: int) -> str:
+    return f"{x / 2 ** 20:9.2f} MiB"
+
+
+def format_report(d: Report) -> str:
+    lines = [f"{'structure':<30} {'exclusive':>13} {'total':>13}"]
+    for s in d["structures"]:
+        lines.append(f"{s['structure']:<30} {mib(s['exclusive'])} {mib(s['total'])}")
+    lines.append(f"{'sum':<30} {mib(sum(s['exclusive'] for s in d['structures']))}")
+
+    lines.append("")
+    lines.append(f"{'live objects':<30} {'count':>13} {'own size':>13}")
+    for name, entry in d["live"].items():
+        lines.append(f"{name:<30} {entry['count']:>13} {mib(entry['bytes'])}")
+
+    if "allocations" in d:
+        lines.append("")
+        lines.append(f"traced by tracemalloc: {mib(d['traced'])}, top allocation sites:")
+        for alloc in d["allocations"]:
+            lines.append(f"{mib(alloc['bytes'])} {alloc['count']:>9}x {alloc['site']}")
+    else:
+        lines.append("")
+        lines.append("tracemalloc is not tracing, start with `python -X tracemalloc` for allocation sites")
+
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Report the memory used by the recipe database")
+    parser.add_argument("--top", type=int, default=10, help="number of allocation sites to show")
+    args = parser.parse_args(argv)
+
+    tracemalloc.start()
+    recipes = Recipes()
+    snapshot = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+
+    print(format_report(report(recipes, snapshot, args.top)))
+
+
+if __name__ == "__main__":
+    main()
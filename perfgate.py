@@ -0,0 +1,217 @@
+"""perfgate.py
+
+Performance regression gate for the recipe database and the solver. Records
+timings (median and percentiles) and peak memory of the core operations in a
+baseline file, and fails when a later run is slower or larger beyond a threshold.
+
+    python perfgate.py record
+    python perfgate.py check --threshold 0.2
+
+With --no-database only the synthetic lines (see synthetic.py) are timed, so the
+gate also runs where the recipe database is not around, e.g. in CI.
+"""
+
+import argparse
+import glob
+import json
+import math
+import os
+import sys
+import tracemalloc
+
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from benchmark import measure, preset_name, report, run_deep, run_searches, search_queries
+from headless import build_line, default_root, load_line, solve_line
+from recipes import Recipes
+from throughput import Buffer, Node, Step, make_groups
+from tscca import circuits
+import synthetic
+
+
+BASELINE_FN = "perf_baseline.json"
+# peak memory differences below this many bytes are noise
+MEMORY_SLACK = 64 * 1024
+# synthetic line sizes gated, the larger ones of synthetic.SIZES take too long for a gate
+SYNTHETIC_SIZES = (100, 1000)
+
+Result = Dict[str, Any]
+
+
+def percentile(samples: List[float], q: float) -> float:
+    xs = sorted(samples)
+    k = (len(xs) - 1) * q
+    lo, hi = math.floor(k), math.ceil(k)
+
+    return xs[lo] + (xs[hi] - xs[lo]) * (k - lo)
+
+
+def peak_memory(fn: Callable[[], Any]) -> int:
+    """Peak traced memory in bytes during one call of fn, on top of what was allocated before"""
+    tracemalloc.start()
+    try:
+        before, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return peak - before
+
+
+def profile(fn: Callable[[], Any], repeat: int, budget: float) -> Result:
+    samples = measure(fn, repeat=repeat, budget=budget)
+
+    return { "samples": samples
+           , "median": percentile(samples, 0.5)
+           , "p90": percentile(samples, 0.9)
+           , "p99": percentile(samples, 0.99)
+           , "peak_bytes": peak_memory(fn) }
+
+
+def propagate(models: List[Node], root: int):
+    """Solves a line built without the recipe database"""
+    for model in models:
+        if isinstance(model, Step):
+            model.group = None
+
+    make_groups(circuits(models))
+    Buffer.global_reset()
+
+    step = models[root]
+    assert isinstance(step, Step)
+    step.propagate(rate=1.0)
+
+
+def operations(recipes: Optional[Recipes], presets: List[str]) -> List[Tuple[str, Callable[[], Any]]]:
+    ops: List[Tuple[str, Callable[[], Any]]] = []
+
+    for shape in synthetic.SHAPES:
+        for size in SYNTHETIC_SIZES:
+            models, root = synthetic.line(shape, size)
+
+            name = f"synthetic/{shape}/{size}"
+            ops.append((f"{name}/scc", lambda models=models: circuits(models)))
+            ops.append((f"{name}/solve", lambda models=models, root=root: propagate(models, root)))
+
+    if recipes is None:
+        return ops
+
+    ops.append(("recipes/load", recipes.load))
+
+    queries = search_queries(recipes)
+    ops.append(("recipes/search", lambda: run_searches(recipes, queries)))
+
+    for path in presets:
+        canvas = load_line(path)
+        root = default_root(canvas)
+        models = build_line(canvas, recipes)
+
+        name = preset_name(path)
+        ops.append((f"preset/{name}/scc", lambda models=models: circuits(models)))
+        ops.append((f"preset/{name}/solve", lambda canvas=canvas, root=root: solve_line(canvas, recipes, root)))
+
+    return ops
+
+
+def run(presets: List[str], repeat=7, budget=5.0, database=True, log=sys.stderr) -> Dict[str, Result]:
+    recipes = Recipes() if database else None
+    results = {}
+
+    for name, fn in operations(recipes, presets):
+        print(name, file=log)
+        results[name] = profile(fn, repeat, budget)
+
+    return results
+
+
+def regressions(results: Dict[str, Result], baseline: Dict[str, Result], threshold: float, memory_threshold: float) \
+        -> List[Tuple[str, str, float, float]]:
+    """(benchmark, metric, baseline, current) for every metric that got worse by more than the threshold"""
+    worse = []
+    for name, old in baseline.items():
+        new = results.get(name)
+        if new is None:
+            continue
+
+        if new["median"] > old["median"] * (1 + threshold):
+            worse.append((name, "median", old["median"], new["median"]))
+
+        if new["peak_bytes"] > old["peak_bytes"] * (1 + memory_threshold) + MEMORY_SLACK:
+            worse.append((name, "peak_bytes", old["peak_bytes"], new["peak_bytes"]))
+
+    return worse
+
+
+def print_diff(results: Dict[str, Result], baseline: Dict[str, Result], worse, fp=sys.stdout):
+    flagged = {(name, metric) for name, metric, _, _ in worse}
+
+    def row(name, metric, old, new, fmt):
+        ratio = new / old if old else float("inf")
+        mark = "!!" if (name, metric) in flagged else ""
+        print(f"{mark:<2} {name:<40} {metric:<10} {fmt(old):>12} {fmt(new):>12} {ratio:>6.2f}x", file=fp)
+
+    def ms(x):
+        return f"{1000 * x:.3f} ms"
+
+    def kib(x):
+        return f"{x / 1024:.1f} KiB"
+
+    print(f"{'':<2} {'benchmark':<40} {'metric':<10} {'baseline':>12} {'current':>12} {'ratio':>7}", file=fp)
+    for name, old in baseline.items():
+        new = results.get(name)
+        if new is None:
+            print(f"   {name:<40} missing from this run", file=fp)
+            continue
+
+        row(name, "median", old["median"], new["median"], ms)
+        row(name, "p90", old["p90"], new["p90"], ms)
+        row(name, "peak_bytes", old["peak_bytes"], new["peak_bytes"], kib)
+
+    for name in results:
+        if name not in baseline:
+            print(f"   {name:<40} not in the baseline", file=fp)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Record or check performance baselines")
+    parser.add_argument("mode", choices=["record", "check"])
+    parser.add_argument("--baseline", default=BASELINE_FN, help=f"the baseline file (default: {BASELINE_FN})")
+    parser.add_argument("--presets", nargs="*", default=None, help="line files to solve (default: presets/*.json)")
+    parser.add_argument("--no-database", action="store_true", help="only time the synthetic lines, without the recipe database and the presets")
+    parser.add_argument("--repeat", type=int, default=7)
+    parser.add_argument("--budget", type=float, default=5.0, help="stop sampling an operation after this many seconds")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed relative slowdown of the median (default: 0.2)")
+    parser.add_argument("--memory-threshold", type=float, default=0.2, help="allowed relative growth of the peak memory (default: 0.2)")
+    args = parser.parse_args(argv)
+
+    presets = sorted(glob.glob(os.path.join("presets", "*.json"))) if args.presets is None else args.presets
+    results = run_deep(lambda: run(presets, args.repeat, args.budget, not args.no_database))
+
+    if args.mode == "record":
+        with open(args.baseline, mode="w", encoding="utf-8") as fp:
+            json.dump(report(results), fp, indent=1)
+
+        print(f"Recorded {len(results)} baselines in {args.baseline}")
+        return 0
+
+    with open(args.baseline, mode="r", encoding="utf-8") as fp:
+        baseline = json.load(fp)["results"]
+
+    worse = regressions(results, baseline, args.threshold, args.memory_threshold)
+    print_diff(results, baseline, worse)
+
+    if worse:
+        print(f"\n{len(worse)} regression(s) beyond the threshold:")
+        for name, metric, old, new in worse:
+            growth = f"+{100 * (new / old - 1):.0f}%" if old else "new"
+            print(f"  {name} {metric}: {old:.6g} -> {new:.6g} ({growth})")
+        return 1
+
+    print("\nNo regressions")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,15 +1,8 @@
-import pickle
-
 from dictproxy import wrap
+from recipes import Recipes
 
 
-recipes = wrap({})
-with open("recipes.pickle", mode="rb") as fp:
-    recipes_by_machine = wrap(pickle.load(fp)).sources[0]["machines"]
-
-    for machine in recipes_by_machine:
-        recipes[machine.n] = machine.recs
+_db = Recipes()
 
-items = wrap({})
-with open("items.pickle", mode="rb") as fp:
-    items = wrap(pickle.load(fp))
+recipes = wrap(_db.recipes_by_machine)
+items = wrap((_db.itemlist.unwrap(), _db.id_to_item))
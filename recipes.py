@@ -2,56 +2,109 @@
 
 import json
 import os
-import pickle
+import threading
 
-from typing import List, Dict
+from typing import Any, List, Dict, Tuple
 
+import cache
 from dictproxy import DictProxy, wrap
 from throughput import Recipe, Machine
 
 
+DATABASE_FN = "recipes.json"
+RECIPES_CACHE = "recipes.pickle"
+ITEMS_CACHE = "items.pickle"
+
+# bump when what is cached changes
+RECIPES_VERSION = 1
+ITEMS_VERSION = 1
+
+
+# (size, mtime) -> digest of recipes.json, so it is hashed once per process rather than once per cache
+_digests: Dict[Tuple[int, int], str] = {}
+
+
+def database_digest() -> str:
+    """Hash of the recipe database, to key caches derived from it"""
+    if os.path.exists(DATABASE_FN):
+        stat = os.stat(DATABASE_FN)
+        key = stat.st_size, stat.st_mtime_ns
+
+        if key not in _digests:
+            _digests[key] = cache.digest(DATABASE_FN)
+
+        return _digests[key]
+
+    try:
+        # only the cache is around, it was built from this one
+        return cache.read_header(RECIPES_CACHE)["source"]
+    except (OSError, cache.CacheError, KeyError) as exc:
+        raise FileNotFoundError(f"No recipe database, looked for {DATABASE_FN} and {RECIPES_CACHE}") from exc
+
+
+def load_database() -> Any:
+    """The raw recipe database, from the cache if it was built from the current recipes.json"""
+    source = database_digest() if os.path.exists(DATABASE_FN) else None
+
+    def build():
+        if source is None:
+            raise FileNotFoundError(f"{RECIPES_CACHE} cannot be used and there is no {DATABASE_FN} to rebuild it from")
+
+        with open(DATABASE_FN, mode="r", encoding="utf-8") as fp:
+            return json.load(fp)
+
+    return cache.load(RECIPES_CACHE, "recipes", RECIPES_VERSION, source, build)
+
+
 class Recipes:
     """Recipes"""
 
-    def __init__(self):
-        self.recipes_by_input = {}
-        self.recipes_by_output = {}
-        self.recipes_by_machine = {}
-        self.recipes_by_machine_by_input = {}
-        self.recipes_by_machine_by_output = {}
-        self.itemlist = {}
-        self.id_to_item = {}
-        self.load()
-
-    def load(self):
-        """load"""
-        if os.path.exists("recipes.pickle"):
-            with open("recipes.pickle", mode="rb") as fp:
-                recipes = pickle.load(fp)
-        else:
-            with open("recipes.json", mode="r", encoding="utf-8") as fp:
-                recipes = json.load(fp)
+    # loaded on first access when lazy
+    TABLES = ( "recipes_by_input", "recipes_by_output", "recipes_by_machine"
+             , "recipes_by_machine_by_input", "recipes_by_machine_by_output", "itemlist", "id_to_item" )
+
+    def __init__(self, lazy=False):
+        # the GUI can touch the tables from the Tk thread and the solve worker at once
+        self.load_lock = threading.Lock()
+
+        if not lazy:
+            self.load()
+
+    def __getattr__(self, name):
+        # only called for missing attributes, so only before the first load
+        if name in Recipes.TABLES:
+            self.load(reload=False)
+            return getattr(self, name)
 
-            with open("recipes.pickle", mode="wb") as fp:
-                pickle.dump(recipes, fp)
+        raise AttributeError(name)
 
-        recipes = wrap(recipes)
-        recipes_by_machine = recipes.sources[0]["machines"]
+    @property
+    def loaded(self) -> bool:
+        return "recipes_by_machine" in self.__dict__
 
-        for machine in recipes_by_machine:
-            self.recipes_by_machine[machine.n] = machine.recs
+    def load(self, reload=True):
+        """Reads the tables, they are only set once all of them are, so a failed load can be retried"""
+        with self.load_lock:
+            if reload or not self.loaded:
+                self.__dict__.update(self.read_tables())
 
-        self.recipes_by_machine["None"] = []
+    @staticmethod
+    def read_tables() -> Dict[str, Any]:
+        recipes_by_machine = {}
 
-        self.recipes_by_machine_by_input = {}
-        self.recipes_by_machine_by_output = {}
+        recipes = wrap(load_database())
 
-        self.recipes_by_input = {}
-        self.recipes_by_output = {}
+        for machine in recipes.sources[0]["machines"]:
+            recipes_by_machine[machine.n] = machine.recs
 
-        for machine, recipes in self.recipes_by_machine.items():
-            by_input = self.recipes_by_machine_by_input[machine] = {}
-            by_output = self.recipes_by_machine_by_output[machine] = {}
+        recipes_by_machine["None"] = []
+
+        recipes_by_machine_by_input = {}
+        recipes_by_machine_by_output = {}
+
+        for machine, recipes in recipes_by_machine.items():
+            by_input = recipes_by_machine_by_input[machine] = {}
+            by_output = recipes_by_machine_by_output[machine] = {}
 
             for recipe in recipes:
                 for item in recipe.iI:
@@ -63,47 +116,36 @@ class Recipes:
                 for item in recipe.fO:
                     by_output.setdefault(item.uN, []).append(recipe)
 
-        try:
-            with open("items.pickle", mode="rb") as fp:
-                self.itemlist, self.id_to_item = wrap(pickle.load(fp))
-        except (OSError, KeyError, ValueError, TypeError):
-            items = {}
-            id_to_item = {}
-
-            for _, recipes in self.recipes_by_machine.items():
-                for recipe in recipes:
-                    for item in recipe.iI:
-                        ids = items.setdefault(item.lN, [])
-                        id_to_item.setdefault(item.uN, item.lN)
-                        if item.uN not in ids:
-                            ids.append(item.uN)
+        items, id_to_item = cache.load(ITEMS_CACHE, "items", ITEMS_VERSION, database_digest(), lambda: Recipes.build_items(recipes_by_machine))
+        itemlist = wrap(items)
 
-                    for item in recipe.iO:
-                        ids = items.setdefault(item.lN, [])
-                        id_to_item.setdefault(item.uN, item.lN)
-                        if item.uN not in ids:
-                            ids.append(item.uN)
+        itemlist[""] = "null"
+        id_to_item[""] = ""
 
-                    for item in recipe.fI:
-                        ids = items.setdefault(item.lN, [])
-                        id_to_item.setdefault(item.uN, item.lN)
-                        if item.uN not in ids:
-                            ids.append(item.uN)
+        return { "recipes_by_input": {}
+               , "recipes_by_output": {}
+               , "recipes_by_machine": recipes_by_machine
+               , "recipes_by_machine_by_input": recipes_by_machine_by_input
+               , "recipes_by_machine_by_output": recipes_by_machine_by_output
+               , "itemlist": itemlist
+               , "id_to_item": id_to_item }
 
-                    for item in recipe.fO:
+    @staticmethod
+    def build_items(recipes_by_machine) -> Tuple[Dict[str, List[str]], Dict[str, str]]:
+        """Item names to their ids, and ids to their names"""
+        items: Dict[str, List[str]] = {}
+        id_to_item: Dict[str, str] = {}
+
+        for _, recipes in recipes_by_machine.items():
+            for recipe in recipes:
+                for key in ("iI", "iO", "fI", "fO"):
+                    for item in recipe[key]:
                         ids = items.setdefault(item.lN, [])
                         id_to_item.setdefault(item.uN, item.lN)
                         if item.uN not in ids:
                             ids.append(item.uN)
 
-            self.id_to_item = id_to_item
-            self.itemlist = wrap(items)
-
-            with open("items.pickle", mode="wb") as fp:
-                pickle.dump((items, id_to_item), fp)
-
-        self.itemlist[""] = "null"
-        self.id_to_item[""] = ""
+        return items, id_to_item
 
     def item_name(self, item_id):
         """load"""
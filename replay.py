@@ -0,0 +1,213 @@
+"""replay.py
+
+Replays gesture traces (recorded with Debug > Record gesture trace) on a line
+file, and times every step: the gesture or command itself and the redraws it
+leaves for later. Needs a display, so on a server run it under a virtual one:
+
+    xvfb-run -a python replay.py run drag.json --line presets/PBI.json
+
+Traces for the usual stress cases can also be generated:
+
+    python replay.py generate drag --steps 300 -o drag.json
+"""
+
+import argparse
+import json
+import statistics
+import sys
+import time
+import tkinter as tk
+
+from typing import Any, Dict, List, Optional
+
+import gui
+import lineformat
+from gui import Gesture, NodeCanvas, Vec2
+
+
+Trace = Dict[str, Any]
+
+
+def read_trace(path: str) -> Trace:
+    with open(path, mode="r", encoding="utf-8") as fp:
+        trace = json.load(fp)
+
+    if trace.get("version") != 1:
+        raise ValueError(f"{path}: unknown trace version {trace.get('version')}")
+
+    return trace
+
+
+def gesture(t: float, pos, posi, mod: Gesture, source: Optional[Dict[str, Any]]=None) -> Dict[str, Any]:
+    return {"t": t, "gesture": {"pos": list(pos), "posi": list(posi), "mod": int(mod), "source": source or {"canvas": True}}}
+
+
+def command(t: float, name: str, **args) -> Dict[str, Any]:
+    return {"t": t, "command": name, "args": args}
+
+
+def generate_drag(steps: int, dx=4.0, dy=2.0, frame=1/60) -> Trace:
+    """Selects everything and drags it by its first node"""
+    x, y = 400.0, 400.0
+    events = [ command(0.0, "select_all")
+             , gesture(frame, (x, y), (x, y), Gesture.PRESS, {"node": 0}) ]
+
+    for i in range(1, steps + 1):
+        events.append(gesture((i + 1) * frame, (x + i * dx, y + i * dy), (x, y), Gesture.DRAG, {"node": 0}))
+
+    events.append(gesture((steps + 2) * frame, (x + steps * dx, y + steps * dy), (x, y), Gesture.DRAG_END, {"node": 0}))
+    return {"version": 1, "events": events}
+
+
+def generate_zoom(steps: int, frame=1/60) -> Trace:
+    """Scrolls out and back in again"""
+    events = []
+    for i in range(steps):
+        delta = -120 if i < steps // 2 else 120
+        events.append(gesture(i * frame, (delta, 0), (500, 500), Gesture.SCROLL))
+
+    return {"version": 1, "events": events}
+
+
+GENERATORS = {"drag": generate_drag, "zoom": generate_zoom}
+
+
+class Replay:
+    # seconds to wait for a solve started by the trace
+    SOLVE_TIMEOUT = 60
+
+    def __init__(self, root: tk.Tk, canvas: NodeCanvas, trace: Trace, speed: float):
+        self.root = root
+        self.canvas = canvas
+        self.events: List[Dict[str, Any]] = trace["events"]
+        self.speed = speed
+
+        self.steps: List[Dict[str, Any]] = []
+        self.start = 0.0
+        self.index = 0
+
+    def begin(self):
+        self.start = time.perf_counter()
+        self.next()
+
+    def next(self):
+        if self.index >= len(self.events):
+            # let the last deferred redraws happen before stopping
+            self.canvas.after(2 * gui.NodeCanvas.ZOOM_MS, self.root.quit)
+            return
+
+        event = self.events[self.index]
+        delay = self.start + event["t"] / self.speed - time.perf_counter() if self.speed > 0 else 0
+
+        self.canvas.after(max(0, round(1000 * delay)), self.step)
+
+    def step(self):
+        event = self.events[self.index]
+        self.index += 1
+
+        t = time.perf_counter()
+        if "gesture" in event:
+            g = event["gesture"]
+            name = "|".join(flag.name for flag in Gesture if flag in Gesture(g["mod"]) and flag.name)
+            self.canvas.gesture(Vec2(*g["pos"]), Vec2(*g["posi"]), Gesture(g["mod"]), self.canvas.source_by_ref(g["source"]))
+        else:
+            name = event["command"]
+            self.canvas.run_command(name, **event["args"])
+        handler = time.perf_counter() - t
+
+        self.canvas.update_idletasks()
+        total = time.perf_counter() - t
+
+        self.steps.append({"step": self.index - 1, "name": name, "handler": handler, "total": total, "late": t - self.start - event["t"] / self.speed if self.speed > 0 else 0.0})
+
+        if name == "propagate":
+            self.wait_solve(time.perf_counter())
+        else:
+            self.next()
+
+    def wait_solve(self, since: float):
+        if self.canvas.solve is not None and time.perf_counter() - since < self.SOLVE_TIMEOUT:
+            self.canvas.after(10, self.wait_solve, since)
+            return
+
+        self.steps[-1]["solve"] = time.perf_counter() - since
+        self.next()
+
+
+def run(trace_path: str, line_path: Optional[str], speed: float, output: Optional[str]) -> List[Dict[str, Any]]:
+    trace = read_trace(trace_path)
+
+    line: List[Dict[str, Any]] = []
+    if line_path:
+        line = lineformat.read(line_path)[1]
+
+    root = tk.Tk()
+    root.geometry("1080x1080+0+0")
+    canvas = NodeCanvas(root, autosave=None)
+    canvas.set_latency(True)
+
+    replay = Replay(root, canvas, trace, speed)
+    canvas.load(line, done=replay.begin)
+
+    root.mainloop()
+
+    canvas.cancel_solve()
+    redraws = [record for record in canvas.latency.records if record["kind"] == "redraw"] if canvas.latency else []
+    root.destroy()
+
+    if output:
+        with open(output, mode="w", encoding="utf-8") as fp:
+            json.dump({"trace": trace_path, "line": line_path, "nodes": len(line), "steps": replay.steps, "redraws": redraws}, fp, indent=1)
+
+    print_summary(replay.steps, redraws)
+    return replay.steps
+
+
+def print_summary(steps: List[Dict[str, Any]], redraws: List[Dict[str, Any]]):
+    by_name: Dict[str, List[float]] = {}
+    for s in steps:
+        by_name.setdefault(s["name"], []).append(1000 * s["total"])
+    for r in redraws:
+        by_name.setdefault("redraw " + r["name"], []).append(1000 * r["value"])
+
+    print(f"{'step':<28} {'n':>6} {'p50 ms':>8} {'p95 ms':>8} {'max ms':>8}")
+    for name, ms in sorted(by_name.items()):
+        p95 = statistics.quantiles(ms, n=20)[-1] if len(ms) > 1 else ms[0]
+        print(f"{name[:28]:<28} {len(ms):>6} {statistics.median(ms):>8.2f} {p95:>8.2f} {max(ms):>8.2f}")
+
+    late = [s["late"] for s in steps]
+    if late:
+        print(f"\nsteps ran up to {1000 * max(late):.1f} ms behind the trace")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay or generate gesture traces of the GUI")
+    sub = parser.add_subparsers(dest="action", required=True)
+
+    run_parser = sub.add_parser("run", help="replay a trace and time every step")
+    run_parser.add_argument("trace", help="trace file")
+    run_parser.add_argument("--line", default=None, help="line file to load first, e.g. presets/PBI.json")
+    run_parser.add_argument("--speed", type=float, default=1.0, help="replay speed relative to the recording, 0 for as fast as possible")
+    run_parser.add_argument("--output", "-o", default=None, help="write the per-step timings to this JSON file")
+
+    gen_parser = sub.add_parser("generate", help="generate a synthetic trace")
+    gen_parser.add_argument("kind", choices=sorted(GENERATORS))
+    gen_parser.add_argument("--steps", type=int, default=200, help="number of drag or scroll events")
+    gen_parser.add_argument("--output", "-o", required=True, help="trace file to write")
+
+    args = parser.parse_args(argv)
+
+    if args.action == "generate":
+        with open(args.output, mode="w", encoding="utf-8") as fp:
+            json.dump(GENERATORS[args.kind](args.steps), fp, indent=1)
+        return
+
+    try:
+        run(args.trace, args.line, args.speed, args.output)
+    except tk.TclError as exc:
+        print(f"No display ({exc}), try xvfb-run -a python replay.py ...", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""spatial.py
+
+A uniform grid over axis-aligned boxes, to find the nodes and hatches near a
+point or inside a rectangle without walking the widget tree.
+
+    grid = Grid()
+    grid.insert(node, (x0, y0, x1, y1))
+    grid.query((0, 0, 500, 500))
+"""
+
+import math
+
+from typing import Dict, Hashable, Iterator, List, Set, Tuple
+
+
+Rect = Tuple[float, float, float, float]
+Cell = Tuple[int, int]
+
+
+def overlaps(a: Rect, b: Rect) -> bool:
+    return a[0] <= b[2] and b[0] <= a[2] and a[1] <= b[3] and b[1] <= a[3]
+
+
+class Grid:
+    def __init__(self, cell=256.0):
+        self.cell = cell
+        self.cells: Dict[Cell, Set[Hashable]] = {}
+        self.rects: Dict[Hashable, Rect] = {}
+
+    def __len__(self):
+        return len(self.rects)
+
+    def __contains__(self, obj: Hashable):
+        return obj in self.rects
+
+    def span(self, rect: Rect) -> Tuple[int, int, int, int]:
+        x0, y0, x1, y1 = rect
+        c = self.cell
+
+        return math.floor(x0 / c), math.floor(y0 / c), math.floor(x1 / c), math.floor(y1 / c)
+
+    def keys(self, rect: Rect) -> Iterator[Cell]:
+        i0, j0, i1, j1 = self.span(rect)
+
+        if (i1 - i0 + 1) * (j1 - j0 + 1) > len(self.cells):
+            # a huge rectangle (zoomed far out), cheaper to go over the occupied cells
+            for i, j in list(self.cells):
+                if i0 <= i <= i1 and j0 <= j <= j1:
+                    yield i, j
+        else:
+            for i in range(i0, i1 + 1):
+                for j in range(j0, j1 + 1):
+                    yield i, j
+
+    def insert(self, obj: Hashable, rect: Rect):
+        if obj in self.rects:
+            self.remove(obj)
+
+        self.rects[obj] = rect
+
+        i0, j0, i1, j1 = self.span(rect)
+        for i in range(i0, i1 + 1):
+            for j in range(j0, j1 + 1):
+                self.cells.setdefault((i, j), set()).add(obj)
+
+    def remove(self, obj: Hashable):
+        rect = self.rects.pop(obj, None)
+        if rect is None:
+            return
+
+        i0, j0, i1, j1 = self.span(rect)
+        for i in range(i0, i1 + 1):
+            for j in range(j0, j1 + 1):
+                objs = self.cells[i, j]
+                objs.discard(obj)
+
+                if not objs:
+                    del self.cells[i, j]
+
+    def move(self, obj: Hashable, rect: Rect):
+        old = self.rects.get(obj)
+
+        if old is not None and self.span(old) == self.span(rect):
+            # still in the same cells
+            self.rects[obj] = rect
+        else:
+            self.insert(obj, rect)
+
+    def query(self, rect: Rect) -> Set[Hashable]:
+        """Everything overlapping rect"""
+        found = set()
+        for key in self.keys(rect):
+            for obj in self.cells.get(key, ()):
+                if overlaps(self.rects[obj], rect):
+                    found.add(obj)
+
+        return found
+
+    def at(self, x: float, y: float) -> List[Hashable]:
+        """Everything containing the point (x, y)"""
+        c = self.cell
+        objs = self.cells.get((math.floor(x / c), math.floor(y / c)), ())
+
+        return [obj for obj in objs if overlaps(self.rects[obj], (x, y, x, y))]
@@ -0,0 +1,85 @@
+"""startup.py
+
+Where the start-up time of the GUI goes: the import time per module (as
+reported by python -X importtime) and the time per initialisation phase, up to
+the first frame and then for the parts that are loaded on first use.
+
+    python startup.py --top 20
+"""
+
+import argparse
+import subprocess
+import sys
+import time
+
+from typing import List, Tuple
+
+import instrumentation
+
+
+def import_times(module="gui") -> List[Tuple[str, float, float]]:
+    """(module, self, cumulative) import times in seconds, from a fresh interpreter importing `module`"""
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], capture_output=True, text=True, check=True)
+
+    times = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+
+        own, cumulative, name = line[len("import time:"):].split("|")
+        times.append((name.strip(), int(own) / 1e6, int(cumulative) / 1e6))
+
+    return times
+
+
+def phases() -> List[Tuple[str, float]]:
+    sink = instrumentation.MemorySink()
+    instrumentation.enable(sink)
+
+    try:
+        with instrumentation.active.timer("startup.import gui"):
+            import gui
+
+        root, canvas = gui.main(mainloop=False)
+
+        # everything below is deferred until it is first needed
+        with instrumentation.active.timer("startup.recipe database"):
+            try:
+                canvas.globalstate.load()
+            except OSError as exc:
+                print(f"skipping the recipe database: {exc}", file=sys.stderr)
+
+        with instrumentation.active.timer("startup.solver stack"):
+            import headless # pylint: disable=unused-import
+            import numpy.linalg # pylint: disable=unused-import
+
+        with instrumentation.active.timer("startup.widgets"):
+            import ttkwidgets.autocomplete # pylint: disable=unused-import
+
+        root.destroy()
+    finally:
+        instrumentation.disable()
+
+    return [(record["name"][len("startup."):], record["value"]) for record in sink.records if record["name"].startswith("startup.")]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Profile the start-up of the GUI")
+    parser.add_argument("--top", type=int, default=15, help="number of modules to show")
+    args = parser.parse_args(argv)
+
+    t = time.perf_counter()
+    times = import_times()
+    print(f"import gui in a fresh interpreter: {time.perf_counter() - t:.3f} s (including interpreter start-up)")
+
+    print(f"\n{'module':<48} {'self ms':>10} {'cumulative ms':>14}")
+    for name, own, cumulative in sorted(times, key=lambda x: -x[2])[:args.top]:
+        print(f"{name:<48} {1000 * own:>10.1f} {1000 * cumulative:>14.1f}")
+
+    print(f"\n{'phase':<48} {'ms':>10}")
+    for name, value in phases():
+        print(f"{name:<48} {1000 * value:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
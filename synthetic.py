@@ -0,0 +1,187 @@
+"""synthetic.py
+
+Parametric synthetic production lines for benchmarking. The lines are built
+directly as Step/Buffer models with made-up recipes, so they do not need the
+recipe database.
+
+    models, root = synthetic.line("loops", 1000)
+"""
+
+import random
+
+from typing import Callable, Dict, List, Optional, Tuple
+
+from dictproxy import wrap
+from throughput import Buffer, Node, Recipe, Step
+
+
+SHAPES = ("chain", "loops", "fan", "buffers")
+SIZES  = (10, 100, 1000, 10000, 50000)
+
+
+def make_recipe(consume: Dict[str, int], produce: Dict[str, int], duration=20, power=30) -> Recipe:
+    def qtys(items):
+        return [{"uN": item, "lN": item, "a": a} for item, a in items.items()]
+
+    return Recipe(wrap({ "iI": [], "fI": qtys(consume)
+                       , "iO": [], "fO": qtys(produce)
+                       , "dur": duration, "eut": power }))
+
+
+class LineBuilder:
+    def __init__(self, seed=0):
+        self.models: List[Node] = []
+        self.random = random.Random(seed)
+        self.items = 0
+        self.n_steps = 0
+
+    def item(self) -> str:
+        self.items += 1
+        return f"fluid.synthetic.{self.items}"
+
+    def step(self, consume: Dict[str, int], produce: Dict[str, int]) -> Step:
+        step = Step(make_recipe(consume, produce, self.random.choice([20, 40, 100]), self.random.choice([30, 120, 480])))
+        self.models.append(step)
+        self.n_steps += 1
+        return step
+
+    def buffer(self) -> Buffer:
+        buffer = Buffer("AE")
+        self.models.append(buffer)
+        return buffer
+
+    def connect(self, source: Node, target: Node, item: str):
+        source.push.setdefault(item, []).append(target)
+        target.pull.setdefault(item, []).append(source)
+
+
+def chain(n: int, seed=0) -> LineBuilder:
+    """A single long chain: buffer -> step -> step -> ... -> buffer"""
+    line = LineBuilder(seed)
+
+    item = line.item()
+    previous: Node = line.buffer()
+    for _ in range(n):
+        next_item = line.item()
+        step = line.step({item: 1}, {next_item: 1})
+        line.connect(previous, step, item)
+        previous, item = step, next_item
+
+    line.connect(previous, line.buffer(), item)
+    return line
+
+
+def loops(n: int, seed=0, block=8) -> LineBuilder:
+    """A chain of blocks of `block` steps, each with an outer recycling loop around an inner one"""
+    line = LineBuilder(seed)
+
+    item = line.item()
+    previous: Node = line.buffer()
+
+    while line.n_steps < n:
+        k = min(block, max(n - line.n_steps, 4))
+        outer, inner = line.item(), line.item()
+
+        items = [line.item() for _ in range(k)]
+        steps = []
+        for i in range(k):
+            consume = {item if i == 0 else items[i - 1]: 2}
+            produce = {items[i]: 2}
+
+            if i == 0:
+                consume[outer] = 1
+            if i == 1:
+                consume[inner] = 1
+            if i == k - 2:
+                produce[inner] = 1
+            if i == k - 1:
+                produce[outer] = 1
+
+            steps.append(line.step(consume, produce))
+
+        line.connect(previous, steps[0], item)
+        for a, b, item_ in zip(steps, steps[1:], items):
+            line.connect(a, b, item_)
+
+        line.connect(steps[-1], steps[0], outer)
+        line.connect(steps[-2], steps[1], inner)
+
+        previous, item = steps[-1], items[-1]
+
+    line.connect(previous, line.buffer(), item)
+    return line
+
+
+def fan(n: int, seed=0, width=64) -> LineBuilder:
+    """Hubs with wide fan-in from producers and wide fan-out to consumers, one hub feeding the next"""
+    line = LineBuilder(seed)
+
+    link: Optional[Tuple[Step, str]] = None
+
+    while line.n_steps < n:
+        w = max(1, min(width, (n - line.n_steps - 1) // 2))
+
+        ins  = [line.item() for _ in range(w)]
+        outs = [line.item() for _ in range(w)]
+        hub = line.step({item: 1 for item in ins}, {item: 1 for item in outs})
+
+        for item in ins:
+            if link is None:
+                raw = line.item()
+                producer = line.step({raw: 1}, {item: 1})
+                line.connect(line.buffer(), producer, raw)
+            else:
+                consumer, raw = link
+                producer = line.step({raw: 1}, {item: 1})
+                line.connect(consumer, producer, raw)
+                link = None
+
+            line.connect(producer, hub, item)
+
+        for item in outs:
+            product = line.item()
+            consumer = line.step({item: 1}, {product: 1})
+            line.connect(hub, consumer, item)
+
+            if link is None:
+                link = consumer, product
+            else:
+                line.connect(consumer, line.buffer(), product)
+
+    if link is not None:
+        consumer, product = link
+        line.connect(consumer, line.buffer(), product)
+
+    return line
+
+
+def buffers(n: int, seed=0) -> LineBuilder:
+    """A chain where every step also draws from and dumps into its own buffers"""
+    line = LineBuilder(seed)
+
+    item = line.item()
+    previous: Node = line.buffer()
+    for _ in range(n):
+        raw, waste, next_item = line.item(), line.item(), line.item()
+        step = line.step({item: 1, raw: 1}, {next_item: 1, waste: 1})
+        line.connect(previous, step, item)
+        line.connect(line.buffer(), step, raw)
+        line.connect(step, line.buffer(), waste)
+        previous, item = step, next_item
+
+    line.connect(previous, line.buffer(), item)
+    return line
+
+
+GENERATORS: Dict[str, Callable[..., LineBuilder]] = { "chain": chain
+                                                    , "loops": loops
+                                                    , "fan": fan
+                                                    , "buffers": buffers }
+
+
+def line(shape: str, n: int, seed=0) -> Tuple[List[Node], int]:
+    """Returns the models of a synthetic line of about `n` steps and the index of a step to propagate from"""
+    models = GENERATORS[shape](n, seed).models
+    root = next(i for i, model in enumerate(models) if isinstance(model, Step))
+
+    return models, root
@@ -0,0 +1,120 @@
+import itertools
+import random
+
+import pytest
+
+import buses
+import confusion
+
+
+def random_graph(rng, n, p):
+    graph = [set() for _ in range(n)]
+    for i, j in itertools.combinations(range(n), 2):
+        if rng.random() < p:
+            graph[i].add(j)
+            graph[j].add(i)
+
+    return graph
+
+
+def chromatic_number(graph):
+    n = len(graph)
+    for k in range(1, n + 1):
+        for colours in itertools.product(range(k), repeat=n):
+            if not buses.check(graph, list(colours)):
+                return k
+
+    return 0
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_colourings(seed):
+    rng = random.Random(seed)
+    graph = random_graph(rng, rng.randint(1, 7), rng.random())
+
+    colours = buses.dsatur(graph)
+    assert not buses.check(graph, colours)
+
+    best, proven = buses.exact(graph, colours)
+    assert proven
+    assert not buses.check(graph, best)
+    assert max(best) + 1 == chromatic_number(graph)
+    assert max(best) <= max(colours)
+
+
+def test_large_graph_is_coloured():
+    rng = random.Random(0)
+    graph = random_graph(rng, buses.EXACT_MAX + 10, 0.3)
+
+    colours, proven = buses.assign(graph)
+    assert not buses.check(graph, colours)
+    assert not proven
+
+    assert buses.assign([]) == ([], True)
+
+
+def test_check():
+    graph = [{1}, {0, 2}, {1}]
+    assert buses.check(graph, [0, 0, 1]) == [(0, 1)]
+    assert buses.check(graph, [0, 1, 0]) == []
+
+
+ITEMS = ["a", "b", "c", "d", "e", "f"]
+
+
+def recipe(circuit, items):
+    return {"iI": [{"uN": confusion.CIRCUIT, "cfg": circuit}] + [{"uN": item} for item in items], "fI": []}
+
+
+def random_recipes(rng, count):
+    return [recipe(rng.randint(1, 4), rng.sample(ITEMS, rng.randint(0, 3))) for _ in range(count)]
+
+
+def runs_on(recipe_, items):
+    """Brute force: the inputs of recipe_, leaving out the circuit, are all among items"""
+    return all(item["uN"] in items for item in recipe_["iI"] if item["uN"] != confusion.CIRCUIT)
+
+
+def brute_conflict(machine_recipes, a, b):
+    (ca, ia), (cb, ib) = a, b
+
+    if ca == cb:
+        return set(ia) <= set(ib) or set(ib) <= set(ia)
+
+    return any(runs_on(r, ib) for r in machine_recipes if confusion.circuit_of(r) == ca) \
+        or any(runs_on(r, ia) for r in machine_recipes if confusion.circuit_of(r) == cb)
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_signature_conflict_matches_brute_force(seed):
+    rng = random.Random(seed)
+    machine_recipes = random_recipes(rng, 30)
+
+    matrix = confusion.Matrix(confusion.analyse(machine_recipes))
+    containment = confusion.Containment(machine_recipes)
+
+    def step(r):
+        return confusion.circuit_of(r), [item["uN"] for item in r["iI"] if item["uN"] != confusion.CIRCUIT]
+
+    # the matrix only speaks for recipes of the machine, which is what steps run
+    for a, b in itertools.product(machine_recipes, repeat=2):
+        sa, sb = (confusion.signature(r, containment.ids) for r in (a, b))
+        assert buses.signature_conflict(sa, sb, matrix, containment) == brute_conflict(machine_recipes, step(a), step(b))
+
+    # the containment index alone for any items
+    steps = [(rng.randint(1, 4), rng.sample(ITEMS, rng.randint(0, 4))) for _ in range(40)]
+    sigs = [confusion.signature(recipe(c, items), containment.ids) for c, items in steps]
+
+    for (a, sa), (b, sb) in itertools.product(zip(steps, sigs), repeat=2):
+        assert buses.signature_conflict(sa, sb, None, containment) == brute_conflict(machine_recipes, a, b)
+
+
+def test_conflict_graph():
+    machine_recipes = [recipe(1, ["a", "b"]), recipe(2, ["a"]), recipe(3, ["c"])]
+    containment = confusion.Containment(machine_recipes)
+
+    steps = [recipe(1, ["a", "b"]), recipe(2, ["a"]), recipe(3, ["c"]), recipe(1, ["a", "b"])]
+    graph = buses.conflict_graph(steps, None, containment)
+
+    # circuit 2 runs on the items of the circuit 1 step; the same recipe twice is fine
+    assert graph == [{1}, {0, 3}, set(), {1}]
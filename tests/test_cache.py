@@ -0,0 +1,86 @@
+import os
+
+import pytest
+
+import cache
+
+
+OBJ = {"recipes": list(range(1000)), "name": "test"}
+
+
+@pytest.fixture
+def path(tmp_path):
+    path = str(tmp_path / "test.pickle")
+    cache.write(path, OBJ, "test", 1, "abc")
+    return path
+
+
+def test_round_trip(path):
+    assert cache.read(path, "test", 1, "abc") == OBJ
+    assert cache.read(path, "test", 1) == OBJ
+
+    header, obj = cache.read_with_header(path, "test", 1, "abc")
+    assert obj == OBJ
+    assert header["source"] == "abc"
+    assert not os.path.exists(path + ".tmp")
+
+
+@pytest.mark.parametrize("schema, version, source", [("other", 1, "abc"), ("test", 2, "abc"), ("test", 1, "def")])
+def test_mismatch(path, schema, version, source):
+    with pytest.raises(cache.CacheError):
+        cache.read(path, schema, version, source)
+
+
+def test_bad_magic(path):
+    with open(path, mode="r+b") as fp:
+        fp.write(b"\x80\x04")
+
+    with pytest.raises(cache.CacheError):
+        cache.read(path, "test", 1, "abc")
+
+
+def test_truncated(path):
+    with open(path, mode="r+b") as fp:
+        fp.truncate(os.path.getsize(path) - 10)
+
+    with pytest.raises(cache.CacheError):
+        cache.read(path, "test", 1, "abc")
+
+
+def test_corrupt(path):
+    with open(path, mode="r+b") as fp:
+        fp.seek(-10, os.SEEK_END)
+        byte = fp.read(1)
+        fp.seek(-10, os.SEEK_END)
+        fp.write(bytes([byte[0] ^ 0xFF]))
+
+    with pytest.raises(cache.CacheError):
+        cache.read(path, "test", 1, "abc")
+
+
+def test_load_rebuilds_once(path):
+    builds = []
+
+    def build():
+        builds.append(1)
+        return {"rebuilt": True}
+
+    # fine as it is
+    assert cache.load(path, "test", 1, "abc", build) == OBJ
+    assert not builds
+
+    # another source, rebuilt and written back
+    assert cache.load(path, "test", 1, "def", build) == {"rebuilt": True}
+    assert cache.load(path, "test", 1, "def", build) == {"rebuilt": True}
+    assert len(builds) == 1
+
+
+def test_digest_follows_the_contents(tmp_path):
+    a, b = tmp_path / "a.json", tmp_path / "b.json"
+    a.write_bytes(b"[1, 2, 3]")
+    b.write_bytes(b"[1, 2, 3]")
+
+    assert cache.digest(str(a)) == cache.digest(str(b))
+
+    b.write_bytes(b"[1, 2, 4]")
+    assert cache.digest(str(a)) != cache.digest(str(b))
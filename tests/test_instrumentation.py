@@ -0,0 +1,33 @@
+import instrumentation
+
+
+class Tree:
+    def __init__(self, *children):
+        self.children = children
+
+    @instrumentation.nested("walk")
+    def walk(self):
+        return 1 + sum(child.walk() for child in self.children)
+
+
+def test_nested_costs_nothing_while_disabled():
+    assert not hasattr(Tree.walk, "__wrapped__")
+
+
+def test_nested_counts_calls_and_depth():
+    tree = Tree(Tree(Tree(), Tree()), Tree())
+
+    sink = instrumentation.MemorySink()
+    instrumentation.enable(sink)
+    try:
+        assert tree.walk() == 5
+        instrumentation.active.flush()
+    finally:
+        instrumentation.disable()
+
+    values = {(record["kind"], record["name"]): record["value"] for record in sink.records}
+    assert values == {("counter", "walk"): 5, ("depth", "walk"): 3}
+
+    # back to the plain method
+    assert not hasattr(Tree.walk, "__wrapped__")
+    assert tree.walk() == 5
@@ -0,0 +1,58 @@
+import json
+
+import journal
+import lineformat
+
+
+CANVAS = [
+    {"type": "step", "pos": [0, 0], "machine": "Mixer", "recipe": 1, "rate": 1.0,
+     "inputs": [{"item_id": "a", "item_name": "A", "connections": [[1, True, 0]]}], "outputs": []},
+    {"type": "buffer", "pos": [100, 0], "inputs": [],
+     "outputs": [{"item_id": "a", "item_name": "A", "connections": [[0, False, 0]]}]},
+]
+
+
+def test_read_replays_only_records_after_the_snapshot(tmp_path):
+    path = str(tmp_path / "line.json")
+    lineformat.write(path, CANVAS, seq=2)
+
+    with open(journal.journal_path(path), mode="w", encoding="utf-8") as fp:
+        for seq in range(1, 6):
+            fp.write(json.dumps({"op": "move", "index": 0, "pos": [seq, 0], "from": [0, 0], "seq": seq}) + "\n")
+        # cut short by a crash
+        fp.write('{"op": "move", "ind')
+
+    snapshot, records = journal.read(path)
+
+    assert snapshot["canvas"] == CANVAS
+    assert snapshot["seq"] == 2
+    assert [record["seq"] for record in records] == [3, 4, 5]
+
+
+def test_read_without_files(tmp_path):
+    assert journal.read(str(tmp_path / "missing.json")) == (None, [])
+
+
+def test_journal_round_trip(tmp_path):
+    path = str(tmp_path / "line.json")
+
+    log = journal.Journal(path)
+    log.append({"op": "rate", "index": 0, "rate": 2.0, "from": 1.0})
+    log.snapshot({"canvas": CANVAS})
+    log.append({"op": "rate", "index": 0, "rate": 3.0, "from": 2.0})
+    log.append({"op": "move", "index": 1, "pos": [5, 5], "from": [100, 0]})
+    log.close()
+
+    snapshot, records = journal.read(path)
+
+    assert snapshot["canvas"] == CANVAS
+    assert snapshot["seq"] == 1
+    assert [(record["op"], record["seq"]) for record in records] == [("rate", 2), ("move", 3)]
+
+    # picking up where it left off keeps the numbering going
+    log = journal.Journal(path, seq=records[-1]["seq"])
+    log.append({"op": "rate", "index": 0, "rate": 4.0, "from": 3.0})
+    log.close()
+
+    _, records = journal.read(path)
+    assert [record["seq"] for record in records] == [2, 3, 4]
@@ -0,0 +1,114 @@
+import json
+
+import pytest
+
+import latency
+from latency import BUCKETS_MS, LatencyMonitor
+
+
+class Clock:
+    def __init__(self, t=1000.0):
+        self.t = t
+
+    def __call__(self):
+        return self.t
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(latency.time, "monotonic", clock)
+    return clock
+
+
+def test_queue_delay_is_calibrated_on_the_fastest_event(clock):
+    monitor = LatencyMonitor()
+    # the event clock runs 500 s behind ours
+    event = lambda ms_ago: round(clock.t * 1000) - 500000 - ms_ago
+
+    # the first event sets the offset
+    assert monitor.queue_delay(event(20)) == 0.0
+
+    clock.t += 1
+    assert monitor.queue_delay(event(20)) == pytest.approx(0.0)
+    clock.t += 1
+    assert monitor.queue_delay(event(50)) == pytest.approx(0.030)
+
+    # a faster event than the first moves the offset
+    clock.t += 1
+    assert monitor.queue_delay(event(5)) == 0.0
+    clock.t += 1
+    assert monitor.queue_delay(event(20)) == pytest.approx(0.015)
+
+
+def test_queue_delay_survives_the_event_clock_wrapping(clock):
+    monitor = LatencyMonitor()
+    monitor.queue_delay(4294967000)
+
+    clock.t += 1
+    assert monitor.queue_delay(100) == 0.0
+    clock.t += 1
+    assert monitor.queue_delay(1100 - 10) == pytest.approx(0.010)
+
+
+def test_timer_records_handler_and_queue(clock):
+    monitor = LatencyMonitor()
+
+    with monitor.timer("gesture", "drag", queue=0.004):
+        pass
+
+    (record,) = monitor.records
+    assert record["kind"] == "gesture"
+    assert record["name"] == "drag"
+    assert record["queue"] == 0.004
+    assert 0 <= record["value"] < 1
+    assert record["t"] == clock.t
+
+
+def test_summary(clock):
+    monitor = LatencyMonitor()
+
+    # outside the window
+    monitor.record("gesture", "drag", 1.0)
+    clock.t += monitor.WINDOW + 1
+
+    for ms in (1, 3, 3, 10):
+        monitor.record("gesture", "drag", ms / 1000)
+    monitor.record("redraw", "zoom", 0.100, queue=0.100)
+
+    lines = monitor.summary().splitlines()
+
+    drag = next(line for line in lines if line.startswith("gesture drag")).split()
+    n, p50, p95, most = drag[2:]
+    assert (n, p50, most) == ("4", "3.0", "10.0")
+    # interpolated between the samples, never above the slowest
+    assert 3.0 < float(p95) <= 10.0
+
+    zoom = next(line for line in lines if line.startswith("redraw zoom")).split()
+    assert zoom[2:] == ["1", "200.0", "200.0", "200.0"]
+
+    histogram = lines[-len(BUCKETS_MS) - 1:]
+    counts = [int(line.split()[-1]) for line in histogram]
+    # 1 ms, 3 ms twice, 10 ms, and 200 ms above the last bucket
+    assert counts == [1, 2, 0, 1, 0, 0, 0, 1]
+    assert histogram[1].count("#") == 20
+
+
+def test_summary_of_nothing(clock):
+    lines = LatencyMonitor().summary().splitlines()
+    assert [int(line.split()[-1]) for line in lines[-len(BUCKETS_MS) - 1:]] == [0] * (len(BUCKETS_MS) + 1)
+
+
+def test_dump_appends_every_record(clock, tmp_path):
+    monitor = LatencyMonitor()
+    monitor.record("gesture", "click", 0.002, queue=0.001)
+    monitor.record("redraw", "drag", 0.010)
+
+    path = str(tmp_path / "latency.jsonl")
+    monitor.dump(path)
+    monitor.dump(path)
+
+    with open(path, encoding="utf-8") as fp:
+        records = [json.loads(line) for line in fp]
+
+    assert records == list(monitor.records) * 2
@@ -0,0 +1,63 @@
+import glob
+import json
+import os
+
+import pytest
+
+import lineformat
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LINES = sorted(glob.glob(os.path.join(ROOT, "presets", "*.json"))) + [os.path.join(ROOT, "example_line.json")]
+
+
+def normalise(canvas):
+    """Version 2 always writes item_id and item_name, older files may say id and name"""
+    nodes = []
+    for node in canvas:
+        node = dict(node)
+        for key in ("inputs", "outputs"):
+            hatches = []
+            for d_hatch in node[key]:
+                item_id, item_name = lineformat.hatch_item(d_hatch)
+                hatch = {k: v for k, v in d_hatch.items() if k not in ("id", "name", "item_id", "item_name")}
+                hatches.append(dict(hatch, item_id=item_id, item_name=item_name, connections=[list(c) for c in d_hatch["connections"]]))
+            node[key] = hatches
+        nodes.append(node)
+
+    return nodes
+
+
+@pytest.mark.parametrize("path", LINES, ids=os.path.basename)
+@pytest.mark.parametrize("suffix", [".json", ".json.gz"])
+def test_version_1_round_trip(path, suffix, tmp_path):
+    with open(path, encoding="utf-8") as fp:
+        original = json.load(fp)["canvas"]
+
+    header, canvas = lineformat.read(path)
+    assert header["version"] == 1
+    assert canvas == original
+
+    dst = str(tmp_path / ("line" + suffix))
+    lineformat.write(dst, canvas, title="test")
+
+    header, again = lineformat.read(dst)
+    assert header["version"] == lineformat.VERSION
+    assert header["title"] == "test"
+    assert header["nodes"] == len(original)
+    assert normalise(again) == normalise(original)
+
+    assert list(lineformat.iter_nodes(dst)) == again
+
+    # and written again it is the same file
+    dst2 = str(tmp_path / ("again" + suffix))
+    lineformat.write(dst2, again, title="test")
+    assert lineformat.read(dst2) == lineformat.read(dst)
+
+
+def test_newer_version_is_refused(tmp_path):
+    path = tmp_path / "line.json"
+    path.write_text(json.dumps({"format": lineformat.MAGIC, "version": lineformat.VERSION + 1, "items": [], "nodes": 0}) + "\n")
+
+    with pytest.raises(ValueError):
+        lineformat.read(str(path))
@@ -0,0 +1,50 @@
+import random
+
+import pytest
+
+from spatial import Grid, overlaps
+
+
+def random_rect(rng, size=300):
+    x, y = rng.uniform(-1000, 1000), rng.uniform(-1000, 1000)
+    return x, y, x + rng.uniform(0, size), y + rng.uniform(0, size)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_queries_match_brute_force(seed):
+    rng = random.Random(seed)
+    grid = Grid(cell=rng.choice([50.0, 256.0]))
+    rects = {}
+
+    for obj in range(200):
+        rects[obj] = random_rect(rng)
+        grid.insert(obj, rects[obj])
+
+    for obj in rng.sample(sorted(rects), 50):
+        rects[obj] = random_rect(rng)
+        grid.move(obj, rects[obj])
+
+    for obj in rng.sample(sorted(rects), 30):
+        del rects[obj]
+        grid.remove(obj)
+
+    assert len(grid) == len(rects)
+    assert all(obj in grid for obj in rects)
+
+    for _ in range(100):
+        rect = random_rect(rng, size=rng.choice([10, 500, 5000]))
+        assert grid.query(rect) == {obj for obj, r in rects.items() if overlaps(r, rect)}
+
+        x, y = rng.uniform(-1000, 1300), rng.uniform(-1000, 1300)
+        assert set(grid.at(x, y)) == {obj for obj, r in rects.items() if overlaps(r, (x, y, x, y))}
+
+
+def test_remove_leaves_no_empty_cells():
+    grid = Grid(cell=10.0)
+    grid.insert("a", (0, 0, 95, 95))
+    grid.move("a", (200, 200, 201, 201))
+    grid.remove("a")
+    grid.remove("a")
+
+    assert len(grid) == 0
+    assert not grid.cells
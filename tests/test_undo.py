@@ -0,0 +1,195 @@
+import copy
+import random
+
+import pytest
+
+import undo
+from undo import History, inverse
+
+
+NODE = {"type": "step", "pos": [0, 0], "machine": "Assembler", "recipe": 1, "rate": 1.0, "inputs": [], "outputs": []}
+
+
+@pytest.mark.parametrize("record", [
+    {"op": "move", "index": 3, "pos": [10, 20], "from": [1, 2]},
+    {"op": "connect", "a": [0, True, 1], "b": [2, False, 0]},
+    {"op": "disconnect", "a": [0, True, 1], "b": [2, False, 0]},
+    {"op": "machine", "index": 1, "machine": "Mixer", "from": "Assembler"},
+    {"op": "rate", "index": 1, "rate": 2.5, "from": 1.0},
+])
+def test_inverse_is_an_involution(record):
+    assert inverse(inverse(record)) == record
+    assert inverse(record) != record
+
+
+def test_inverse_of_add_and_delete():
+    add = {"op": "add", "index": 4, "node": NODE}
+    delete = {"op": "delete", "index": 4, "node": NODE}
+
+    assert inverse(add) == {"op": "delete", "index": 4}
+    assert inverse(delete) == add
+
+
+@pytest.mark.parametrize("op", ["remove_hatch", "item", "recipe", "replace"])
+def test_inverse_puts_back_the_node(op):
+    before = dict(NODE, recipe=7)
+    record = {"op": op, "index": 2, "node": NODE, "before": before}
+
+    assert inverse(record) == {"op": "replace", "index": 2, "node": before}
+
+
+def test_inverse_of_add_hatch():
+    record = {"op": "add_hatch", "index": 2, "output": True, "slot": 1, "item": "gt.metaitem"}
+    assert inverse(record) == {"op": "remove_hatch", "index": 2, "output": True, "slot": 1}
+
+
+def test_unknown_edit():
+    with pytest.raises(ValueError):
+        inverse({"op": "frobnicate"})
+
+
+class Canvas:
+    """Just enough of NodeCanvas: a list of nodes that the records are applied to"""
+
+    def __init__(self):
+        self.nodes = []
+        self.history = History(self)
+        self.journal = []
+
+    def after_idle(self, callback):
+        pass
+
+    def record(self, record):
+        self.journal.append(record)
+        self.history.append(record)
+
+    def apply_record(self, record):
+        op = record["op"]
+
+        if op == "add":
+            self.nodes.insert(record["index"], copy.deepcopy(record["node"]))
+        elif op == "delete":
+            del self.nodes[record["index"]]
+        elif op == "replace":
+            self.nodes[record["index"]] = copy.deepcopy(record["node"])
+        elif op == "move":
+            self.nodes[record["index"]]["pos"] = record["pos"]
+        elif op in ("machine", "rate"):
+            self.nodes[record["index"]][op] = record[op]
+        elif op == "recipe":
+            self.nodes[record["index"]].update(machine=record["machine"], recipe=record["recipe"])
+
+    def edit(self, record):
+        self.apply_record(record)
+        self.record(record)
+        self.history.commit()
+
+
+def random_edit(rng, nodes):
+    if not nodes or rng.random() < 0.2:
+        return {"op": "add", "index": rng.randint(0, len(nodes)), "node": dict(NODE, pos=[rng.randint(0, 99), 0])}
+
+    index = rng.randrange(len(nodes))
+    node = nodes[index]
+    kind = rng.choice(["delete", "move", "machine", "rate", "recipe"])
+
+    if kind == "delete":
+        return {"op": "delete", "index": index, "node": copy.deepcopy(node)}
+    elif kind == "move":
+        return {"op": "move", "index": index, "pos": [rng.randint(0, 99), rng.randint(0, 99)], "from": node["pos"]}
+    elif kind == "recipe":
+        return {"op": "recipe", "index": index, "machine": node["machine"], "recipe": rng.randint(0, 9), "before": copy.deepcopy(node)}
+    elif kind == "machine":
+        return {"op": "machine", "index": index, "machine": rng.choice(["Mixer", "Assembler", "Centrifuge"]), "from": node["machine"]}
+    else:
+        return {"op": "rate", "index": index, "rate": rng.random(), "from": node["rate"]}
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_undo_all_then_redo_all(seed):
+    rng = random.Random(seed)
+    canvas = Canvas()
+    states = [copy.deepcopy(canvas.nodes)]
+
+    for _ in range(60):
+        canvas.edit(random_edit(rng, canvas.nodes))
+        states.append(copy.deepcopy(canvas.nodes))
+
+    final = states[-1]
+
+    while canvas.history.undo() is not None:
+        pass
+    # typing coalesces, so not every state is an entry, but undoing everything gets back to the start
+    assert canvas.nodes == states[0]
+
+    while canvas.history.redo() is not None:
+        pass
+    assert canvas.nodes == final
+
+
+def test_typing_coalesces_into_one_entry():
+    canvas = Canvas()
+    canvas.edit({"op": "add", "index": 0, "node": NODE})
+
+    rate = NODE["rate"]
+    for value in (2.0, 25.0, 250.0):
+        canvas.edit({"op": "rate", "index": 0, "rate": value, "from": rate})
+        rate = value
+
+    assert len(canvas.history.undo_stack) == 2
+
+    canvas.history.undo()
+    assert canvas.nodes[0]["rate"] == NODE["rate"]
+
+    canvas.history.redo()
+    assert canvas.nodes[0]["rate"] == 250.0
+
+
+def test_undo_is_not_recorded_as_an_edit():
+    canvas = Canvas()
+    canvas.edit({"op": "add", "index": 0, "node": NODE})
+    canvas.history.undo()
+
+    assert canvas.nodes == []
+    assert not canvas.history.undo_stack
+    assert len(canvas.history.redo_stack) == 1
+    # but the journal sees the inverse
+    assert canvas.journal[-1] == {"op": "delete", "index": 0}
+
+
+def test_edits_apart_in_time_are_separate(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(undo.time, "monotonic", lambda: now[0])
+
+    canvas = Canvas()
+    canvas.edit({"op": "add", "index": 0, "node": NODE})
+
+    canvas.edit({"op": "rate", "index": 0, "rate": 2.0, "from": 1.0})
+    now[0] += 0.3
+    canvas.edit({"op": "rate", "index": 0, "rate": 25.0, "from": 2.0})
+    # a minute later, another edit of the same rate
+    now[0] += 60
+    canvas.edit({"op": "rate", "index": 0, "rate": 3.0, "from": 25.0})
+
+    assert len(canvas.history.undo_stack) == 3
+
+    canvas.history.undo()
+    assert canvas.nodes[0]["rate"] == 25.0
+    canvas.history.undo()
+    assert canvas.nodes[0]["rate"] == 1.0
+
+
+def test_no_coalescing_across_undo(monkeypatch):
+    monkeypatch.setattr(undo.time, "monotonic", lambda: 100.0)
+
+    canvas = Canvas()
+    canvas.edit({"op": "add", "index": 0, "node": NODE})
+    canvas.edit({"op": "rate", "index": 0, "rate": 2.0, "from": 1.0})
+    canvas.edit({"op": "rate", "index": 0, "rate": 3.0, "from": 2.0})
+    canvas.history.undo()
+    canvas.history.redo()
+
+    # right after the redo, but not part of the redone entry
+    canvas.edit({"op": "rate", "index": 0, "rate": 4.0, "from": 3.0})
+    canvas.history.undo()
+    assert canvas.nodes[0]["rate"] == 3.0
@@ -1,8 +1,17 @@
-from typing import Dict, List, Optional, Set, Tuple, Union
-from numpy.linalg import lstsq
-import numpy as np
+import logging
+import math
+
+from typing import TYPE_CHECKING, Dict, List, Optional, Set, Tuple, Union
 
 from dictproxy import DictProxy
+import instrumentation
+
+if TYPE_CHECKING:
+    # imported where they are used, numpy takes longer to import than the gui needs to start
+    import numpy as np
+
+
+logger = logging.getLogger(__name__)
 
 
 Item = str
@@ -102,8 +111,11 @@ class Group:
         #     cause_rate = 1.0
 
 
+    @instrumentation.nested("propagate")
     def propagate(self, cause: IVar, flow=1.0, cause_group: Optional["Group"]=None):
         # print(f"group {self} {cause} {flow}")
+        import numpy as np
+        from numpy.linalg import lstsq
 
         rate_flow, variables, outbound = self.matrix()
 
@@ -119,13 +131,14 @@ class Group:
         # print(rate_flow)
 
         # solve the system for vx (the rates) given vy (the flows)
-        rates, res, _, _ = lstsq(rate_flow, flows, rcond=None)
+        with instrumentation.active.timer("lstsq", rows=rate_flow.shape[0], columns=rate_flow.shape[1]):
+            rates, res, _, _ = lstsq(rate_flow, flows, rcond=None)
+
+        instrumentation.active.count("lstsq")
+        instrumentation.active.value("lstsq.residual", float(res.sum()))
 
         if res.sum() > 1e-15:
-            print("warning high residual in cycle solution, results might be wrong")
-            print("lstsq residue:", res.sum())
-        else:
-            print("lstsq residue:", res.sum())
+            logger.warning("high residual in cycle solution, results might be wrong (lstsq residue: %s)", res.sum())
 
         # print(rates)
         for v, rate_ in zip(variables, rates):
@@ -178,7 +191,10 @@ class Group:
 
         return seen
     
-    def matrix(self) -> Tuple[np.ndarray, List[IVar], Dict[IHatch, "Step"]]:
+    @instrumentation.timed("group.matrix")
+    def matrix(self) -> Tuple["np.ndarray", List[IVar], Dict[IHatch, "Step"]]:
+        import numpy as np
+
         # returns (A, x, o)
         # A: the matrix representing the flows as a response of the rates in and around this group
         # x: maps the column index to the associated internal step, or external IHatch
@@ -301,6 +317,7 @@ class Step:
         if target not in x:
             x.append(target)
 
+    @instrumentation.nested("propagate")
     def propagate(self, cause: Union[None, "Step", "Buffer"]=None, cause_group: Optional[Group]=None, rate=1.0):
         if self.group:
             if not cause or cause == self:
@@ -401,6 +418,19 @@ def make_groups(sccs):
                 step.group = g
 
 
+TIERS = [ "LV", "MV", "HV", "EV"
+        , "IV", "LuV", "ZPM", "UV"
+        , "UHV", "UEV", "UIV", "UMV"]
+def powerTier(eut):
+
+    m = eut / 32
+    e = min(math.ceil(math.log(max(m, 1), 4)), len(TIERS) - 1)
+
+    m /= 4 ** e
+
+    return (m, e)
+
+
 
 
 
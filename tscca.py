@@ -1,10 +1,12 @@
 
 from throughput import Step
+import instrumentation
 
 class Wrap:
     def __init__(self, value):
         self.value = value
 
+@instrumentation.timed("scc")
 def circuits(nodes):
     nodes = [v for v in nodes if isinstance(v, Step)]
 
@@ -0,0 +1,146 @@
+"""undo.py
+
+Undo and redo for the canvas, on the edit records of NodeCanvas (see
+NodeCanvas.apply_record). An entry holds the records of one user action, and
+each record is undone by applying its inverse, so an entry costs about as much
+as the edit itself.
+"""
+
+import time
+
+from collections import deque
+from typing import TYPE_CHECKING, Deque, List, Optional
+
+from journal import Record
+
+if TYPE_CHECKING:
+    from gui import NodeCanvas
+
+
+Entry = List[Record]
+
+
+def inverse(record: Record) -> Record:
+    op = record["op"]
+
+    if op == "add":
+        return {"op": "delete", "index": record["index"]}
+    elif op == "delete":
+        return {"op": "add", "index": record["index"], "node": record["node"]}
+    elif op == "move":
+        return dict(record, pos=record["from"], **{"from": record["pos"]})
+    elif op == "connect":
+        return dict(record, op="disconnect")
+    elif op == "disconnect":
+        return dict(record, op="connect")
+    elif op == "add_hatch":
+        return {"op": "remove_hatch", "index": record["index"], "output": record["output"], "slot": record["slot"]}
+    elif op in ("remove_hatch", "item", "recipe", "replace"):
+        # these change a node in more ways than one, put back all of it
+        return {"op": "replace", "index": record["index"], "node": record["before"]}
+    elif op in ("machine", "rate"):
+        return dict(record, **{op: record["from"], "from": record[op]})
+    else:
+        raise ValueError(f"Unknown edit {op}")
+
+
+class History:
+    # total number of records kept, the oldest entries are dropped beyond this
+    LIMIT = 100000
+    # seconds between keystrokes that still count as typing the same value
+    COALESCE_S = 1.0
+
+    def __init__(self, canvas: "NodeCanvas"):
+        self.canvas = canvas
+
+        self.undo_stack: Deque[Entry] = deque()
+        self.redo_stack: List[Entry] = []
+        self.size = 0
+        # when the top of the undo stack was last added to, None once it is not the last edit
+        self.last_commit: Optional[float] = None
+
+        # the records of the current event, they become one entry once it is handled
+        self.pending: Entry = []
+        self.busy = False
+
+    def append(self, record: Record):
+        if self.busy:
+            return
+
+        if not self.pending:
+            self.canvas.after_idle(self.commit)
+
+        self.pending.append(record)
+
+    def commit(self):
+        entry, self.pending = self.pending, []
+
+        if not entry:
+            return
+
+        self.redo_stack = []
+
+        now = time.monotonic()
+        recent = self.last_commit is not None and now - self.last_commit < self.COALESCE_S
+        self.last_commit = now
+
+        if recent and self.undo_stack and self.coalesces(self.undo_stack[-1], entry):
+            # keep the first "from" and the last value
+            last = self.undo_stack[-1][0]
+            op = last["op"]
+            last[op] = entry[0][op]
+            return
+
+        self.undo_stack.append(entry)
+        self.size += len(entry)
+
+        while self.size > self.LIMIT and len(self.undo_stack) > 1:
+            self.size -= len(self.undo_stack.popleft())
+
+    def coalesces(self, last: Entry, entry: Entry) -> bool:
+        # typing a machine name or a rate gives a record per keystroke, made within COALESCE_S of each other
+        if len(last) != 1 or len(entry) != 1:
+            return False
+
+        a, b = last[0], entry[0]
+        return a["op"] == b["op"] and a["op"] in ("machine", "rate") and a["index"] == b["index"]
+
+    def apply(self, records: Entry):
+        self.busy = True
+        try:
+            for record in records:
+                self.canvas.apply_record(record)
+                # for the journal
+                self.canvas.record(record)
+        finally:
+            self.busy = False
+
+    def undo(self) -> Optional[Entry]:
+        self.commit()
+
+        if not self.undo_stack:
+            return None
+
+        entry = self.undo_stack.pop()
+        self.size -= len(entry)
+
+        self.apply([inverse(record) for record in reversed(entry)])
+        self.redo_stack.append(entry)
+        self.last_commit = None
+
+        return entry
+
+    def redo(self) -> Optional[Entry]:
+        self.commit()
+
+        if not self.redo_stack:
+            return None
+
+        entry = self.redo_stack.pop()
+        self.apply(entry)
+
+        self.undo_stack.append(entry)
+        self.size += len(entry)
+        self.last_commit = None
+
+        return entry